@@ -0,0 +1,308 @@
+"""
+Benchmarks for vidhash's hashing and matching hot paths, using synthetic videos generated locally with FFmpeg.
+
+Run with `python bench/benchmark.py`. Results can be saved as a baseline with --save-baseline, and later runs compared
+against it with --compare, which flags any benchmark which got slower by more than --threshold.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import vidhash.func  # noqa: E402
+from vidhash import DecodeOptions, HashOptions, VideoHash, VideoHashIndex, hash_video  # noqa: E402
+from vidhash.frame_hash import SimpleImageHash  # noqa: E402
+from vidhash.match_options import DurationMatch, FrameCountMatch, PercentageMatch  # noqa: E402
+from vidhash.packed_hash import PackedFrameHashes  # noqa: E402
+
+VIDEO_DIR = pathlib.Path(vidhash.func.TEMP_DIR) / "bench"
+VIDEO_LENGTHS = [10, 60, 300]
+QUICK_VIDEO_LENGTHS = [5, 20]
+LIBRARY_SIZES = [100, 1000, 10000]
+QUICK_LIBRARY_SIZES = [100, 1000]
+
+
+@dataclass
+class Result:
+    name: str
+    params: Dict[str, Any]
+    seconds: float
+    frames: Optional[int]
+    peak_memory: int
+
+    @property
+    def key(self) -> str:
+        params = ",".join(f"{key}={value}" for key, value in sorted(self.params.items()))
+        return f"{self.name}[{params}]"
+
+    @property
+    def frames_per_second(self) -> Optional[float]:
+        if self.frames is None or self.seconds == 0:
+            return None
+        return self.frames / self.seconds
+
+
+def measure(
+    name: str, params: Dict[str, Any], func: Callable[[], Any], frames: Optional[int] = None, repeat: int = 3
+) -> Result:
+    """
+    Runs the function once under tracemalloc to find the peak memory allocated by Python and numpy while it runs,
+    which also warms up any caches, then times it, taking the median of several runs. Memory used by FFmpeg
+    subprocesses is not included.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    result = Result(name, params, statistics.median(times), frames, peak_memory)
+    fps = f"{result.frames_per_second:10.1f} frames/s" if result.frames_per_second is not None else " " * 19
+    print(f"{result.key:<60} {result.seconds * 1000:10.2f} ms {fps} {peak_memory / 2**20:8.2f} MiB peak")
+    return result
+
+
+def generate_video(length: int) -> str:
+    """
+    Generates a deterministic synthetic video of the given length in seconds, or reuses it if it was already generated
+    """
+    path = VIDEO_DIR / f"synthetic_{length}s.mp4"
+    if path.exists():
+        return str(path)
+    os.makedirs(VIDEO_DIR, exist_ok=True)
+    # Three scenes from different deterministic sources, so the video has cuts and keyframes like a real video
+    scene_length = length / 3
+    sources = [
+        f"testsrc2=size=640x360:rate=25:duration={scene_length}",
+        f"cellauto=size=640x360:rate=25:rule=110:seed=1,trim=duration={scene_length}",
+        f"smptehdbars=size=640x360:rate=25:duration={scene_length}",
+    ]
+    temp_path = VIDEO_DIR / f"{uuid.uuid4()}.mp4"
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"]
+        + [arg for source in sources for arg in ["-f", "lavfi", "-i", source]]
+        + ["-filter_complex", "[0:v][1:v][2:v]concat=n=3:v=1,format=yuv420p[out]", "-map", "[out]"]
+        + ["-c:v", "libx264", "-g", "50", "-threads", "1", "-bitexact", str(temp_path)],
+        check=True,
+    )
+    os.replace(temp_path, path)
+    return str(path)
+
+
+def random_video_hash(frame_count: int, seed: int, hash_options: HashOptions = HashOptions()) -> VideoHash:
+    packed = np.random.default_rng(seed).integers(0, 2**63, (frame_count, 1), dtype=np.uint64)
+    return VideoHash(PackedFrameHashes(packed, (8, 8)), frame_count / hash_options.fps, hash_options)
+
+
+def related_video_hashes(frame_count: int, seed: int) -> List[VideoHash]:
+    # Two videos which share a section of similar frames in the middle, so matches have to find it
+    rng = np.random.default_rng(seed)
+    hash1 = rng.integers(0, 2**63, (frame_count, 1), dtype=np.uint64)
+    hash2 = rng.integers(0, 2**63, (frame_count, 1), dtype=np.uint64)
+    shared = slice(frame_count // 2, frame_count // 2 + 20)
+    hash2[shared] = hash1[shared] ^ np.uint64(1)
+    return [VideoHash(PackedFrameHashes(packed, (8, 8)), frame_count / 5, HashOptions()) for packed in [hash1, hash2]]
+
+
+def bench_pipeline(video_lengths: List[int], repeat: int) -> List[Result]:
+    results = []
+    options = HashOptions()
+    max_size = options.settings.get_video_size()
+    for length in video_lengths:
+        video_path = generate_video(length)
+        frames = int(length * options.fps)
+        params = {"length": length}
+        results.append(
+            measure("probe", params, lambda: asyncio.run(vidhash.func._probe_metadata(video_path)), None, repeat)
+        )
+
+        def decompose() -> None:
+            decompose_path = str(VIDEO_DIR / str(uuid.uuid4()))
+            try:
+                asyncio.run(vidhash.func._decompose_video(video_path, decompose_path, options.fps, max_size))
+            finally:
+                vidhash.func._cleanup_dir(decompose_path)
+
+        results.append(measure("transcode_and_extract", params, decompose, frames, repeat))
+
+        async def stream() -> None:
+            async for _ in vidhash.func._sample_frames(video_path, options):
+                pass
+
+        results.append(measure("stream_frames", params, lambda: asyncio.run(stream()), frames, repeat))
+        for pipe_frames in [False, True]:
+            decode_options = DecodeOptions(pipe_frames=pipe_frames)
+            results.append(
+                measure(
+                    "hash_video",
+                    {**params, "pipe_frames": pipe_frames},
+                    lambda: asyncio.run(hash_video(video_path, options, decode_options)),
+                    frames,
+                    repeat,
+                )
+            )
+    return results
+
+
+def bench_frame_hashing(frame_counts: List[int], repeat: int) -> List[Result]:
+    results = []
+    settings = HashOptions().settings
+    rng = np.random.default_rng(0)
+    for frame_count in frame_counts:
+        frames = rng.integers(0, 256, (frame_count, 200, 356), dtype=np.uint8)
+        images = [Image.fromarray(frame) for frame in frames]
+        params = {"frames": frame_count}
+        results.append(
+            measure("hash_image", params, lambda: [settings.hash_image(image) for image in images], frame_count, repeat)
+        )
+        results.append(measure("hash_batch", params, lambda: settings.hash_batch(frames), frame_count, repeat))
+    return results
+
+
+def bench_matching(frame_counts: List[int], repeat: int) -> List[Result]:
+    results = []
+    for frame_count in frame_counts:
+        hash1, hash2 = related_video_hashes(frame_count, frame_count)
+        params = {"frames": frame_count}
+        query = SimpleImageHash.from_bits(np.zeros((8, 8), dtype=bool))
+        results.append(measure("contains_hash", params, lambda: hash1.contains_hash(query, 3), frame_count, repeat))
+        for match_options in [PercentageMatch(), FrameCountMatch(count_overlap=30), DurationMatch(time_overlap=10)]:
+            results.append(
+                measure(
+                    f"check_match.{match_options.__class__.__name__}",
+                    params,
+                    lambda: match_options.check_match(hash1, hash2),
+                    frame_count,
+                    repeat,
+                )
+            )
+    return results
+
+
+def bench_index(library_sizes: List[int], repeat: int) -> List[Result]:
+    results = []
+    frame_count = 300
+    for library_size in library_sizes:
+        video_hashes = [random_video_hash(frame_count, seed) for seed in range(library_size)]
+        params = {"library_size": library_size}
+
+        def build() -> VideoHashIndex:
+            index = VideoHashIndex()
+            for num, video_hash in enumerate(video_hashes):
+                index.insert(str(num), video_hash)
+            index.candidates(video_hashes[0])
+            return index
+
+        results.append(measure("index.build", params, build, library_size * frame_count, 1))
+        index = build()
+        queries = video_hashes[:10]
+        results.append(
+            measure(
+                "index.find_matches",
+                params,
+                lambda: [index.find_matches(query) for query in queries],
+                len(queries) * frame_count,
+                repeat,
+            )
+        )
+    return results
+
+
+def compare(results: List[Result], baseline_path: str, threshold: float) -> bool:
+    """
+    Compares results against a saved baseline, printing the change in time for each benchmark. Returns whether any
+    benchmark got slower by more than the threshold fraction.
+    """
+    with open(baseline_path) as f:
+        baseline = {entry["key"]: entry for entry in json.load(f)["results"]}
+    regressed = False
+    print(f"\nComparison with {baseline_path}:")
+    for result in results:
+        entry = baseline.get(result.key)
+        if entry is None:
+            print(f"{result.key:<60} (not in baseline)")
+            continue
+        change = result.seconds / entry["seconds"] - 1 if entry["seconds"] else 0
+        memory_change = result.peak_memory / entry["peak_memory"] - 1 if entry["peak_memory"] else 0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{result.key:<60} {change:+8.1%} time {memory_change:+8.1%} memory{flag}")
+    return regressed
+
+
+def save_baseline(results: List[Result], path: str) -> None:
+    data = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "results": [{"key": result.key, **asdict(result)} for result in results],
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"\nSaved baseline to {path}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark vidhash's hashing and matching")
+    parser.add_argument("--quick", action="store_true", help="Use shorter videos and smaller libraries")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark, the median time is reported")
+    parser.add_argument(
+        "--only",
+        choices=["pipeline", "frame_hashing", "matching", "index"],
+        action="append",
+        help="Only run these benchmark groups",
+    )
+    parser.add_argument("--save-baseline", metavar="PATH", help="Save the results to this JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="Compare the results with a saved baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="Fraction slower than the baseline to count as a regression"
+    )
+    args = parser.parse_args()
+
+    video_lengths = QUICK_VIDEO_LENGTHS if args.quick else VIDEO_LENGTHS
+    library_sizes = QUICK_LIBRARY_SIZES if args.quick else LIBRARY_SIZES
+    frame_counts = [length * 5 for length in video_lengths]
+    groups = args.only or ["pipeline", "frame_hashing", "matching", "index"]
+    results = []
+    if "pipeline" in groups:
+        results += bench_pipeline(video_lengths, args.repeat)
+    if "frame_hashing" in groups:
+        results += bench_frame_hashing(frame_counts, args.repeat)
+    if "matching" in groups:
+        results += bench_matching(frame_counts, args.repeat)
+    if "index" in groups:
+        results += bench_index(library_sizes, args.repeat)
+
+    if args.save_baseline:
+        save_baseline(results, args.save_baseline)
+    if args.compare and compare(results, args.compare, args.threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
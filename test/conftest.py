@@ -1,10 +1,25 @@
+from __future__ import annotations
+
 import os.path
 from pathlib import Path
+from typing import TYPE_CHECKING
 
+import numpy as np
 import pytest
 import requests
 
 import vidhash.func
+from vidhash.frame_hash import FrameHash, SimpleImageHash
+from vidhash.hash_options import DEFAULT_HASH_OPTS, HashOptions
+from vidhash.packed_hash import PackedFrameHashes, pack_bits, unpack_bits
+from vidhash.video_hash import VideoHash
+
+if TYPE_CHECKING:
+    from typing import Any, Optional, Sequence, Union
+
+    import numpy.typing as npt
+
+    from vidhash.metadata import VideoMetadata
 
 SAMPLE_VIDEOS = [
     "https://storage.googleapis.com/gtv-videos-bucket/sample/BigBuckBunny.mp4",  # 158mb, 596s
@@ -32,6 +47,32 @@ BUTTERFLY_KILL_SCENE = "ButterflyKill.mp4"
 CREDITS_SCENE_FILENAME = "CreditsScene.mp4"
 
 
+def make_video_hash(
+    frames: Union[int, npt.NDArray[Any]],
+    hash_options: HashOptions = DEFAULT_HASH_OPTS,
+    seed: int = 0,
+    video_length: Optional[float] = None,
+    metadata: Optional[VideoMetadata] = None,
+    objects: bool = False,
+) -> VideoHash:
+    """
+    Makes a video hash for tests. frames is either the bits of the frame hashes, shaped (N, ...), their packed hashes,
+    as a uint64 array shaped (N, words), or a number of random frame hashes to make from the seed. The video length
+    defaults to the frame count at the hash options' frame rate. If objects is set, the frame hashes are
+    SimpleImageHash objects rather than packed.
+    """
+    hash_shape = hash_options.settings.hash_shape
+    if isinstance(frames, int):
+        packed = pack_bits(np.random.default_rng(seed).random((frames, int(np.prod(hash_shape)))) > 0.5)
+    else:
+        packed = frames if frames.dtype == np.uint64 else pack_bits(frames)
+    frame_hashes: Sequence[FrameHash] = PackedFrameHashes(packed, hash_shape)
+    if objects:
+        frame_hashes = [SimpleImageHash.from_bits(bits) for bits in unpack_bits(packed, hash_shape)]
+    length = len(packed) / hash_options.fps if video_length is None else video_length
+    return VideoHash(frame_hashes, length, hash_options, metadata)
+
+
 @pytest.fixture
 def long_video() -> Path:
     video_path = TEST_DIR / BIG_BUCK_BUNNY_FILENAME
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+import vidhash
+from test.conftest import make_video_hash
+from vidhash import DecodeOptions, HashOptions, VideoHash, append_video
+from vidhash.func import hash_video_range
+from vidhash.hash_options import DHash, MultiResolutionHash
+from vidhash.match_options import DurationMatch, FrameCountMatch, MatchOptions, PercentageMatch
+from vidhash.metadata import VideoMetadata
+from vidhash.packed_hash import PackedFrameHashes, RunLengthFrameHashes, pack_bits
+from vidhash.sampling import KeyframeSampling, UniformSampling
+
+
+def test_append():
+    rng = np.random.default_rng(0)
+    bits = rng.random((30, 64)) > 0.5
+    whole = make_video_hash(bits)
+    first, second = make_video_hash(bits[:12]), make_video_hash(bits[12:])
+    first.metadata = VideoMetadata(duration=2.4, width=320, height=240)
+
+    appended = first.append(second)
+    assert appended == whole
+    assert appended.video_length == whole.video_length
+    assert appended.next_frame_time == 6
+    assert appended.metadata == VideoMetadata(duration=6, width=320, height=240)
+    assert appended.signature == whole.compute_signature()
+    run_length = first.to_run_length().append(second)
+    assert isinstance(run_length.image_hashes, RunLengthFrameHashes)
+    assert run_length == whole
+
+
+def test_append_follows_frame_times():
+    # Each part is hashed from the time of the next frame, which may be after the end of the previous part
+    rng = np.random.default_rng(1)
+    first = make_video_hash(rng.random((11, 64)) > 0.5, video_length=2.12)
+    second = make_video_hash(rng.random((5, 64)) > 0.5, video_length=0.9)
+    assert first.next_frame_time == pytest.approx(2.2)
+    assert first.append(second).video_length == pytest.approx(3.1)
+
+    # Sampled frames aren't at fixed times, so the parts follow on from each other's lengths
+    options = HashOptions(sampling=KeyframeSampling())
+    first = VideoHash(first.image_hashes, 2.12, options)
+    assert first.append(VideoHash(second.image_hashes, 0.9, options)).video_length == pytest.approx(3.02)
+
+
+def test_append_coarse_hashes():
+    rng = np.random.default_rng(2)
+    options = HashOptions(settings=MultiResolutionHash(DHash(8), DHash(4)))
+    parts = [make_video_hash(rng.random((10, 64)) > 0.5, options) for _ in range(2)]
+    coarse_bits = rng.random((20, 16)) > 0.5
+    parts[0].coarse_hashes = PackedFrameHashes(pack_bits(coarse_bits[:10]), (4, 4))
+    parts[1].coarse_hashes = PackedFrameHashes(pack_bits(coarse_bits[10:]), (4, 4))
+    assert parts[0].append(parts[1]).coarse_hashes == PackedFrameHashes(pack_bits(coarse_bits), (4, 4))
+    parts[1].coarse_hashes = None
+    assert parts[0].append(parts[1]).coarse_hashes is None
+
+
+def test_append_different_options():
+    rng = np.random.default_rng(3)
+    video_hash = make_video_hash(rng.random((10, 64)) > 0.5)
+    other = make_video_hash(rng.random((10, 16)) > 0.5, HashOptions(settings=DHash(4)), video_length=2)
+    with pytest.raises(ValueError):
+        video_hash.append(other)
+
+
+@pytest.mark.parametrize("match_options", [PercentageMatch(), FrameCountMatch(count_overlap=5), DurationMatch()])
+def test_resume_matching(match_options: MatchOptions):
+    # A recording which only starts to match the reference once it has grown
+    rng = np.random.default_rng(4)
+    reference_bits = rng.random((20, 64)) > 0.5
+    reference = make_video_hash(reference_bits)
+    parts = [make_video_hash(rng.random((15, 64)) > 0.5) for _ in range(3)] + [make_video_hash(reference_bits)]
+    matcher = match_options.incremental_matcher(reference)
+    recording = None
+    results = []
+    for part in parts:
+        matcher.add_video_hash(part)
+        recording = part if recording is None else recording.append(part)
+        results.append(matcher.finish(recording.video_length))
+        assert results[-1] == match_options.check_match(recording, reference)
+    assert results == [False, False, False, True]
+    assert matcher.decided
+
+
+def test_resume_matching_different_options():
+    rng = np.random.default_rng(5)
+    matcher = PercentageMatch().incremental_matcher(make_video_hash(rng.random((10, 64)) > 0.5))
+    with pytest.raises(ValueError):
+        matcher.add_video_hash(make_video_hash(rng.random((10, 64)) > 0.5, HashOptions(fps=2)))
+
+
+async def test_hash_video_range_invalid():
+    with pytest.raises(ValueError):
+        await hash_video_range("video.mp4", -1)
+    with pytest.raises(ValueError):
+        await hash_video_range("video.mp4", 5, 5)
+    with pytest.raises(ValueError):
+        await hash_video_range("video.mp4", 0, 5, HashOptions(sampling=UniformSampling(5)))
+
+
+async def test_append_video(both_butterflies_clip):
+    decode_options = DecodeOptions(pipe_frames=True)
+    whole = await vidhash.hash_video(str(both_butterflies_clip), decode_options=decode_options)
+    video_hash = await hash_video_range(str(both_butterflies_clip), 0, 10.1)
+    assert video_hash.video_length == pytest.approx(10.1)
+    video_hash = await append_video(video_hash, str(both_butterflies_clip), end=25)
+    video_hash = await append_video(video_hash, str(both_butterflies_clip))
+    assert video_hash == whole
+    assert video_hash.video_length == pytest.approx(whole.video_length)
@@ -0,0 +1,126 @@
+import os
+import threading
+
+from test.conftest import make_video_hash
+from vidhash import DecodeOptions, HashOptions, VideoHashCache
+from vidhash.hash_options import DHash
+from vidhash.packed_hash import PackedFrameHashes, RunLengthFrameHashes
+
+
+def _video_file(tmp_path, name: str, content: bytes = b"video") -> str:
+    path = str(tmp_path / name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path
+
+
+def test_cache_round_trip(tmp_path):
+    cache = VideoHashCache(str(tmp_path / "cache"))
+    video_path = _video_file(tmp_path, "a.mp4")
+    video_hash = make_video_hash(20)
+    assert cache.get(video_path) is None
+    cache.put(video_path, video_hash)
+    assert cache.get(video_path) == video_hash
+    assert cache.get(video_path, HashOptions(fps=2)) is None
+    assert cache.get(video_path, HashOptions(settings=DHash(16))) is None
+
+
+def test_cache_miss_when_file_changes(tmp_path):
+    cache = VideoHashCache(str(tmp_path / "cache"))
+    video_path = _video_file(tmp_path, "a.mp4")
+    cache.put(video_path, make_video_hash(20))
+    _video_file(tmp_path, "a.mp4", b"a different video")
+    assert cache.get(video_path) is None
+
+
+def test_cache_by_content(tmp_path):
+    cache = VideoHashCache(str(tmp_path / "cache"), key_by_content=True)
+    video_hash = make_video_hash(20)
+    cache.put(_video_file(tmp_path, "a.mp4"), video_hash)
+    assert cache.get(_video_file(tmp_path, "copy.mp4")) == video_hash
+    assert cache.get(_video_file(tmp_path, "other.mp4", b"other")) is None
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = VideoHashCache(str(tmp_path / "cache"))
+    paths = [_video_file(tmp_path, f"{i}.mp4", str(i).encode()) for i in range(3)]
+    for num, path in enumerate(paths):
+        cache.put(path, make_video_hash(100))
+        entry_path = cache._entry_path(cache.cache_key(path, HashOptions()))
+        os.utime(entry_path, (num, num))
+    cache.get(paths[0])
+    cache.max_size = cache.size() - 1
+    cache.evict()
+    assert cache.get(paths[0]) is not None
+    assert cache.get(paths[1]) is None
+    assert cache.get(paths[2]) is not None
+
+
+async def test_cache_hash_video_only_hashes_once(tmp_path, monkeypatch):
+    calls = []
+
+    async def fake_hash_video(video_path, hash_options, decode_options, executor=None):
+        calls.append(video_path)
+        return make_video_hash(10, hash_options)
+
+    monkeypatch.setattr("vidhash.cache.hash_video", fake_hash_video)
+    cache = VideoHashCache(str(tmp_path / "cache"))
+    video_path = _video_file(tmp_path, "a.mp4")
+    first = await cache.hash_video(video_path)
+    second = await cache.hash_video(video_path)
+    assert first == second
+    assert calls == [video_path]
+
+
+async def test_cache_hash_video_off_event_loop(tmp_path, monkeypatch):
+    async def fake_hash_video(video_path, hash_options, decode_options, executor=None):
+        return make_video_hash(10, hash_options)
+
+    threads = []
+    file_identity = VideoHashCache._file_identity
+    evict = VideoHashCache.evict
+
+    def record_identity(self, video_path):
+        threads.append(threading.get_ident())
+        return file_identity(self, video_path)
+
+    def record_evict(self):
+        threads.append(threading.get_ident())
+        evict(self)
+
+    monkeypatch.setattr("vidhash.cache.hash_video", fake_hash_video)
+    monkeypatch.setattr(VideoHashCache, "_file_identity", record_identity)
+    monkeypatch.setattr(VideoHashCache, "evict", record_evict)
+    cache = VideoHashCache(str(tmp_path / "cache"), key_by_content=True)
+    video_path = _video_file(tmp_path, "a.mp4")
+    await cache.hash_video(video_path)
+    await cache.hash_video(video_path)
+    # Keyed for the miss, the write and the hit, and evicted after the write
+    assert len(threads) == 4
+    assert threading.get_ident() not in threads
+
+
+def test_cache_decode_options(tmp_path):
+    # Decode options which change the decoded pixels are cached separately, but thread counts are not
+    cache = VideoHashCache(str(tmp_path / "cache"))
+    video_path = _video_file(tmp_path, "a.mp4")
+    video_hash = make_video_hash(20)
+    cache.put(video_path, video_hash, DecodeOptions(pipe_frames=True))
+    assert cache.get(video_path, decode_options=DecodeOptions(pipe_frames=True, threads=2)) == video_hash
+    assert cache.get(video_path) is None
+    assert cache.get(video_path, decode_options=DecodeOptions(pipe_frames=True, lowres=1)) is None
+    assert cache.get(video_path, decode_options=DecodeOptions(pipe_frames=True, scaler="area")) is None
+
+
+def test_cache_run_length(tmp_path):
+    # Run-length encoding doesn't change the frame hashes, so shares cache entries, but is applied to cache hits
+    cache = VideoHashCache(str(tmp_path / "cache"))
+    video_path = _video_file(tmp_path, "a.mp4")
+    video_hash = make_video_hash(20)
+    cache.put(video_path, video_hash.to_run_length(), DecodeOptions(run_length=True))
+    loaded = cache.get(video_path)
+    assert isinstance(loaded.image_hashes, PackedFrameHashes)
+    assert loaded == video_hash
+    loaded = cache.get(video_path, decode_options=DecodeOptions(run_length=True))
+    assert isinstance(loaded.image_hashes, RunLengthFrameHashes)
+    assert loaded == video_hash
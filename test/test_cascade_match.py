@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+
+from vidhash import HashOptions, VideoHash, VideoHashIndex
+from vidhash.hash_options import ColorHash, DHash, HashSettings, MultiResolutionHash
+from vidhash.match_options import CascadeMatch, DurationMatch, FrameCountMatch, MatchOptions, PercentageMatch
+from vidhash.packed_hash import PackedFrameHashes, hamming_distances, pack_bits, similar_masks
+
+OPTIONS = HashOptions(settings=MultiResolutionHash())
+
+
+def _frames(count: int, seed: int) -> np.ndarray:
+    # Random blocks, so that frames are distinct, but have structure at every hash size
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 200, (count, 12, 16))
+    frames = np.repeat(np.repeat(blocks, 5, axis=1), 5, axis=2) + rng.integers(0, 40, (count, 60, 80))
+    return frames.astype(np.uint8)
+
+
+def _video_hash(frames: np.ndarray) -> VideoHash:
+    settings = OPTIONS.settings
+    coarse_settings = settings.coarse_settings
+    assert coarse_settings is not None
+    hashes = PackedFrameHashes(settings.hash_batch(frames), settings.hash_shape)
+    coarse_hashes = PackedFrameHashes(coarse_settings.hash_batch(frames), coarse_settings.hash_shape)
+    return VideoHash(hashes, len(frames) / OPTIONS.fps, OPTIONS, coarse_hashes=coarse_hashes)
+
+
+def _noisy(frames: np.ndarray, seed: int) -> np.ndarray:
+    noise = np.random.default_rng(seed).integers(-4, 5, frames.shape)
+    return np.clip(frames.astype(int) + noise, 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("bit_count", [16, 36, 64, 128])
+@pytest.mark.parametrize("hamming_dist", [0, 1, 3])
+def test_similar_masks(bit_count, hamming_dist):
+    rng = np.random.default_rng(bit_count + hamming_dist)
+    bits1 = rng.random((200, bit_count)) > 0.5
+    bits2 = rng.random((150, bit_count)) > 0.5
+    # Copy some hashes across with a few bits flipped, and repeat some hashes
+    bits2[:60] = bits1[:60] ^ (rng.random((60, bit_count)) > 0.98)
+    bits1[100:120] = bits1[0]
+    hashes1, hashes2 = pack_bits(bits1), pack_bits(bits2)
+    similar = hamming_distances(hashes1, hashes2) <= hamming_dist
+    found1, found2 = similar_masks(hashes1, hashes2, hamming_dist, bit_count)
+    assert np.array_equal(found1, similar.any(axis=1))
+    assert np.array_equal(found2, similar.any(axis=0))
+
+
+def test_similar_masks_empty():
+    found1, found2 = similar_masks(np.zeros((0, 1), dtype=np.uint64), pack_bits(np.ones((3, 16), dtype=bool)), 1, 16)
+    assert found1.shape == (0,)
+    assert not found2.any()
+
+
+def test_multi_resolution_hash():
+    settings = MultiResolutionHash(DHash(8), DHash(4))
+    frames = _frames(5, 0)
+    assert np.array_equal(settings.hash_batch(frames), DHash(8).hash_batch(frames))
+    assert settings.hash_shape == (8, 8)
+    assert settings.coarse_settings == DHash(4)
+    assert DHash().coarse_settings is None
+    assert HashSettings.from_dict(settings.to_dict()) == settings
+    with pytest.raises(ValueError):
+        MultiResolutionHash(DHash(8), ColorHash())
+
+
+def test_coarse_hashes_round_trip():
+    video_hash = _video_hash(_frames(12, 1))
+    loaded = VideoHash.from_bytes(video_hash.to_bytes())
+    assert loaded.coarse_hashes == video_hash.coarse_hashes
+    assert loaded.to_unpacked().coarse_hashes == video_hash.coarse_hashes
+    coarse = loaded.coarse_video_hash()
+    assert coarse is not None
+    assert coarse.hash_options.settings == DHash(6)
+    assert VideoHash(video_hash.image_hashes, 2.4, OPTIONS).coarse_video_hash() is None
+
+
+MATCH_OPTIONS = [PercentageMatch(), FrameCountMatch(count_overlap=5), DurationMatch(time_overlap=2)]
+
+
+@pytest.mark.parametrize("match_options", MATCH_OPTIONS)
+def test_cascade_matches_full_check(match_options: MatchOptions):
+    cascade = CascadeMatch(match_options=match_options)
+    assert cascade.hamming_dist == match_options.hamming_dist
+    shared = _frames(20, 2)
+    video = _video_hash(np.concatenate([_frames(10, 3), shared]))
+    related = _video_hash(np.concatenate([_noisy(shared, 4), _frames(15, 5)]))
+    unrelated = _video_hash(_frames(30, 6))
+    for other in [related, unrelated]:
+        assert cascade.check_match(video, other) == match_options.check_match(video, other)
+    assert cascade.check_match(video, related)
+    assert not cascade._coarse_could_match(video, unrelated)
+
+
+def test_cascade_without_coarse_hashes():
+    video = _video_hash(_frames(10, 7))
+    without_coarse = VideoHash(video.image_hashes, video.video_length, OPTIONS)
+    cascade = CascadeMatch()
+    assert cascade._coarse_could_match(video, without_coarse)
+    assert cascade.check_match(video, without_coarse)
+
+
+def test_cascade_with_index():
+    index = VideoHashIndex(OPTIONS)
+    shared = _frames(20, 8)
+    index.insert("related", _video_hash(np.concatenate([_noisy(shared, 9), _frames(5, 10)])))
+    index.insert("unrelated", _video_hash(_frames(25, 11)))
+    assert index.find_matches(_video_hash(shared), CascadeMatch()) == ["related"]
+
+
+@pytest.mark.parametrize("match_options", MATCH_OPTIONS)
+def test_cascade_incremental_matches_check_match(match_options: MatchOptions):
+    cascade = CascadeMatch(match_options=match_options)
+    shared = _frames(20, 12)
+    video = _video_hash(np.concatenate([_frames(10, 13), shared]))
+    related = _video_hash(np.concatenate([_noisy(shared, 14), _frames(15, 15)]))
+    # The full hashes match, but the coarse hashes are of another video, so only the coarse check rejects this
+    coarse_rejected = VideoHash(
+        related.image_hashes, related.video_length, OPTIONS, coarse_hashes=_video_hash(_frames(35, 16)).coarse_hashes
+    )
+    assert match_options.check_match(video, coarse_rejected)
+    for other in [related, coarse_rejected, _video_hash(_frames(30, 17))]:
+        matcher = cascade.incremental_matcher(video)
+        for start in range(0, len(other.packed_hashes.packed), 7):
+            part = slice(start, start + 7)
+            assert other.coarse_hashes is not None
+            matcher.add_packed(other.packed_hashes.packed[part], other.coarse_hashes.packed[part])
+            assert not matcher.decided
+        assert matcher.finish(other.video_length) == cascade.check_match(video, other)
+    assert cascade.check_match(video, related)
+    assert not cascade.check_match(video, coarse_rejected)
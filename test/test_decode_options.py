@@ -0,0 +1,118 @@
+import asyncio
+from typing import List, Optional
+
+import ffmpy3
+import numpy as np
+import pytest
+
+from vidhash import DecodeOptions, HashOptions, hash_video
+from vidhash.func import _scale_filters, _stream_frames
+from vidhash.metadata import VideoMetadata
+
+# What FFmpeg logs before writing raw gray frames, describing the input video and then the scaled output stream
+FFMPEG_HEADER = b"""Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'video.mp4':
+  Duration: 00:00:01.00, start: 0.000000, bitrate: 512 kb/s
+  Stream #0:0(und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(tv, bt709), 640x480, 500 kb/s, 25 fps, 25 tbr
+Output #0, rawvideo, to 'pipe:1':
+  Stream #0:0(und): Video: rawvideo (Y800 / 0x30303859), gray(pc, progressive), 32x24, q=2-31, 3 kb/s, 5 fps, 5 tbn
+"""
+# The same for a Y4M video, whose input stream is also rawvideo, with the unscaled frame size
+Y4M_FFMPEG_HEADER = b"""Input #0, yuv4mpegpipe, from 'video.y4m':
+  Duration: 00:00:01.00, start: 0.000000, bitrate: 30412 kb/s
+  Stream #0:0: Video: rawvideo (I420 / 0x30323449), yuv420p(progressive), 352x288, 25 fps, 25 tbr, 25 tbn
+Output #0, rawvideo, to 'pipe:1':
+  Stream #0:0: Video: rawvideo (Y800 / 0x30303859), gray(pc, progressive), 32x24, q=2-31, 3 kb/s, 5 fps, 5 tbn
+"""
+
+
+class FakeFFmpegProcess:
+    """
+    Stands in for an FFmpeg process streaming frames, with its stdout and stderr already written
+    """
+
+    def __init__(self, stdout: bytes, stderr: bytes) -> None:
+        self.stdout = asyncio.StreamReader()
+        self.stdout.feed_data(stdout)
+        self.stdout.feed_eof()
+        self.stderr = asyncio.StreamReader()
+        self.stderr.feed_data(stderr)
+        self.stderr.feed_eof()
+        self.returncode: Optional[int] = None
+
+    async def wait(self) -> int:
+        self.returncode = 0
+        return 0
+
+    def kill(self) -> None:
+        self.returncode = -9
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch, request):
+    header = getattr(request, "param", FFMPEG_HEADER)
+    frames = np.random.default_rng(0).integers(0, 256, (5, 24, 32), dtype=np.uint8)
+    commands: List[str] = []
+
+    async def run_async(self, stdout=None, stderr=None, **kwargs):
+        commands.append(self.cmd)
+        # A partial frame is left over when FFmpeg is cut off, which should be dropped
+        return FakeFFmpegProcess(frames.tobytes() + bytes(100), header)
+
+    monkeypatch.setattr(ffmpy3.FFmpeg, "run_async", run_async)
+    return frames, commands
+
+
+def test_default_options_add_nothing() -> None:
+    options = DecodeOptions()
+
+    assert options.global_options() == []
+    assert options.input_options() == []
+    assert options.intermediate_options() == []
+    assert _scale_filters(200, options.scaler) == _scale_filters(200)
+
+
+def test_thread_options() -> None:
+    options = DecodeOptions(threads=2, filter_threads=1)
+
+    assert options.global_options() == ["-filter_threads", "1"]
+    assert options.input_options() == ["-threads", "2"]
+    assert options.intermediate_options() == ["-threads", "2"]
+
+
+def test_fast_decode_options() -> None:
+    options = DecodeOptions(lowres=2, skip_loop_filter=True, intermediate_preset="ultrafast", intermediate_crf=30)
+
+    assert options.input_options() == ["-lowres", "2", "-skip_loop_filter", "all"]
+    assert options.intermediate_options() == ["-preset", "ultrafast", "-crf", "30"]
+
+
+def test_scaler_flags() -> None:
+    filters = _scale_filters(200, "area")
+
+    assert len(filters) == 2
+    assert all(scale_filter.endswith(":flags=area") for scale_filter in filters)
+
+
+@pytest.mark.parametrize("fake_ffmpeg", [FFMPEG_HEADER, Y4M_FFMPEG_HEADER], indirect=True)
+async def test_stream_frames(fake_ffmpeg) -> None:
+    frames, commands = fake_ffmpeg
+    metadata: List[VideoMetadata] = []
+    stream = _stream_frames("video.mp4", ["fps=5"], on_metadata=metadata.append)
+    results = [frame async for _, frame in stream]
+
+    assert len(results) == 5
+    assert all(frame.shape == (24, 32) and frame.dtype == np.uint8 for frame in results)
+    np.testing.assert_array_equal(np.stack(results), frames)
+    assert len(metadata) == 1 and metadata[0].duration == 1
+    assert "format=gray" in commands[0] and "-pix_fmt gray" in commands[0]
+
+
+async def test_hash_video_pipe_frames(fake_ffmpeg) -> None:
+    frames, commands = fake_ffmpeg
+    hash_options = HashOptions()
+    video_hash = await hash_video("video.mp4", hash_options, DecodeOptions(pipe_frames=True))
+
+    assert len(commands) == 1
+    assert len(video_hash.image_hashes) == 5
+    assert video_hash.video_length == 1
+    np.testing.assert_array_equal(video_hash.packed_hashes.packed, hash_options.settings.hash_batch(frames))
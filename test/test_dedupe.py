@@ -0,0 +1,115 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from test.conftest import make_video_hash
+from vidhash import HashOptions, VideoHash, find_duplicates
+from vidhash.hash_options import DHash
+from vidhash.match_options import DurationMatch, FrameCountMatch, MatchException, PercentageMatch
+
+
+def _library(seed: int) -> dict:
+    # Videos drawn from a few shared clips, with noise, so that some of them match each other
+    rng = np.random.default_rng(seed)
+    clips = [rng.random((10, 64)) > 0.5 for _ in range(5)]
+    videos = {}
+    for num in range(40):
+        parts = [rng.random((int(rng.integers(1, 8)), 64)) > 0.5]
+        for clip_num in rng.choice(5, size=int(rng.integers(0, 3)), replace=False):
+            clip = clips[clip_num]
+            parts.append(clip ^ (rng.random(clip.shape) > 0.97))
+        videos[f"video_{num}"] = make_video_hash(np.concatenate(parts))
+    return videos
+
+
+def _brute_force(videos: dict, match_options) -> list:
+    # Connected components of every pair which matches, to compare against
+    keys = list(videos)
+    groups = {key: {key} for key in keys}
+    for key1, key2 in itertools.combinations(keys, 2):
+        if match_options.check_match(videos[key1], videos[key2]) and groups[key1] is not groups[key2]:
+            merged = groups[key1] | groups[key2]
+            for key in merged:
+                groups[key] = merged
+    clusters = {id(group): group for group in groups.values() if len(group) > 1}
+    return sorted(sorted(cluster, key=keys.index) for cluster in clusters.values())
+
+
+@pytest.mark.parametrize(
+    "match_options", [PercentageMatch(), FrameCountMatch(count_overlap=5), DurationMatch(time_overlap=1)]
+)
+def test_find_duplicates(match_options):
+    videos = _library(0)
+    expected = _brute_force(videos, match_options)
+    assert expected
+    assert sorted(find_duplicates(videos, match_options, max_workers=1, batch_size=7)) == expected
+
+
+def test_find_duplicates_executor():
+    videos = _library(1)
+    expected = _brute_force(videos, PercentageMatch())
+    with ThreadPoolExecutor(2) as executor:
+        assert sorted(find_duplicates(videos.items(), executor=executor, batch_size=5)) == expected
+
+
+def test_find_duplicates_process_pool():
+    videos = _library(2)
+    assert sorted(find_duplicates(videos, max_workers=2, batch_size=5)) == _brute_force(videos, PercentageMatch())
+
+
+def test_find_duplicates_progress():
+    videos = _library(0)
+    updates = []
+    find_duplicates(videos, max_workers=1, batch_size=3, progress=updates.append)
+    assert updates
+    assert updates[-1].checked_pairs == updates[-1].candidate_pairs
+    assert [update.checked_pairs for update in updates] == sorted(update.checked_pairs for update in updates)
+
+
+def test_find_duplicates_resume(tmp_path):
+    videos = _library(0)
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    expected = _brute_force(videos, PercentageMatch())
+
+    def interrupt(update):
+        if update.checked_pairs >= 6:
+            raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        find_duplicates(videos, max_workers=1, batch_size=3, progress=interrupt, checkpoint_path=checkpoint_path)
+    updates = []
+    result = find_duplicates(
+        videos, max_workers=1, batch_size=3, progress=updates.append, checkpoint_path=checkpoint_path
+    )
+    assert sorted(result) == expected
+    # The batches checked before the interruption are not checked again
+    assert updates[0].checked_pairs == 9
+    with pytest.raises(ValueError):
+        find_duplicates(videos, max_workers=1, batch_size=4, checkpoint_path=checkpoint_path)
+
+
+def test_find_duplicates_resume_changed_hashes(tmp_path):
+    # A checkpoint for the same keys, but different video hashes, can't be resumed from
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    clip = np.random.default_rng(1).random((20, 64)) > 0.5
+    videos = {key: make_video_hash(clip) for key in ["a", "b"]}
+    videos["c"] = make_video_hash(~clip)
+    assert find_duplicates(videos, max_workers=1, checkpoint_path=checkpoint_path) == [["a", "b"]]
+    videos["b"] = make_video_hash(np.random.default_rng(2).random((20, 64)) > 0.5)
+    with pytest.raises(ValueError):
+        find_duplicates(videos, max_workers=1, checkpoint_path=checkpoint_path)
+    assert find_duplicates(videos, max_workers=1) == []
+
+
+def test_find_duplicates_empty():
+    assert find_duplicates({}) == []
+    assert find_duplicates({"only": _library(0)["video_0"]}) == []
+
+
+def test_find_duplicates_different_options():
+    videos = _library(0)
+    videos["other"] = VideoHash(videos["video_0"].image_hashes, 1, HashOptions(settings=DHash(4)))
+    with pytest.raises(MatchException):
+        find_duplicates(videos, max_workers=1)
@@ -0,0 +1,77 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from test.conftest import make_video_hash
+from vidhash import hash_videos
+
+
+@pytest.fixture
+def fake_hash_video(monkeypatch):
+    state = {"running": 0, "max_running": 0, "executors": set()}
+
+    async def fake_hash_video(video_path, hash_options, decode_options, executor=None):
+        state["running"] += 1
+        state["max_running"] = max(state["max_running"], state["running"])
+        state["executors"].add(executor)
+        try:
+            # Later videos finish first
+            await asyncio.sleep(0.01 * (20 - int(video_path)))
+            if video_path == "13":
+                raise ValueError("Broken video")
+            return make_video_hash(int(video_path), seed=int(video_path))
+        finally:
+            state["running"] -= 1
+
+    monkeypatch.setattr("vidhash.func.hash_video", fake_hash_video)
+    return state
+
+
+async def test_hash_videos_bounded_concurrency(fake_hash_video):
+    paths = [str(num) for num in range(20) if num != 13]
+    with ThreadPoolExecutor(2) as executor:
+        results = [result async for result in hash_videos(paths, max_workers=4, executor=executor)]
+
+    assert sorted(path for path, _ in results) == sorted(paths)
+    assert all(video_hash == make_video_hash(int(path), seed=int(path)) for path, video_hash in results)
+    assert [path for path, _ in results] != paths
+    assert fake_hash_video["max_running"] == 4
+    assert fake_hash_video["executors"] == {executor}
+
+
+async def test_hash_videos_return_exceptions(fake_hash_video):
+    paths = [str(num) for num in range(20)]
+    results = dict([result async for result in hash_videos(paths, max_workers=3, return_exceptions=True)])
+
+    assert len(results) == 20
+    assert isinstance(results["13"], ValueError)
+    assert results["12"] == make_video_hash(12, seed=12)
+
+
+async def test_hash_videos_raises(fake_hash_video):
+    paths = [str(num) for num in range(20)]
+    results = []
+    with pytest.raises(ValueError):
+        async for result in hash_videos(paths, max_workers=3):
+            results.append(result)
+
+    assert 0 < len(results) < 20
+    assert fake_hash_video["running"] == 0
+
+
+async def test_hash_videos_shuts_down_off_event_loop(fake_hash_video, monkeypatch):
+    shutdown_threads = []
+
+    class RecordingExecutor(ThreadPoolExecutor):
+        def shutdown(self, wait=True, *, cancel_futures=False):
+            shutdown_threads.append(threading.get_ident())
+            super().shutdown(wait, cancel_futures=cancel_futures)
+
+    monkeypatch.setattr("vidhash.func.ProcessPoolExecutor", RecordingExecutor)
+    results = [result async for result in hash_videos(["1", "2"], max_workers=2)]
+
+    assert len(results) == 2
+    assert len(shutdown_threads) == 1
+    assert shutdown_threads[0] != threading.get_ident()
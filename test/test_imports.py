@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import vidhash
+from vidhash.hash_options import AHash, ColorHash, DHash, MultiResolutionHash, PHash, WHash
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Libraries for decoding videos and hashing images, which loading and matching stored hashes shouldn't need
+HEAVY_MODULES = {"imagehash", "scipy", "pywt", "PIL", "ffmpy3"}
+
+
+def _imported_modules(code: str) -> set:
+    # Each check runs in a fresh interpreter, as this one has already imported everything
+    script = f"import sys\n{code}\nprint(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=PACKAGE_DIR, capture_output=True, text=True, check=True)
+    return {name.split(".")[0] for name in result.stdout.split()}
+
+
+def test_import_is_lazy():
+    assert not _imported_modules("import vidhash") & (HEAVY_MODULES | {"numpy", "asyncio"})
+
+
+def test_matching_imports():
+    code = """
+import numpy as np
+from vidhash import HashOptions, VideoHash, VideoHashIndex, find_duplicates, score_match
+from vidhash.match_options import DurationMatch, PercentageMatch
+from vidhash.packed_hash import PackedFrameHashes, pack_bits
+
+bits = np.random.default_rng(0).random((20, 64)) > 0.5
+bits[:3] = False
+video_hash = VideoHash.from_bytes(VideoHash(PackedFrameHashes(pack_bits(bits), (8, 8)), 4, HashOptions()).to_bytes())
+assert PercentageMatch().check_match(video_hash, video_hash)
+assert DurationMatch().check_match(video_hash, video_hash)
+assert score_match(video_hash, video_hash).percentage_overlap == 85
+index = VideoHashIndex()
+index.insert("video", video_hash)
+assert index.find_matches(video_hash) == ["video"]
+assert find_duplicates({"a": video_hash, "b": video_hash}, max_workers=1) == [["a", "b"]]
+"""
+    assert not _imported_modules(code) & HEAVY_MODULES
+
+
+def test_hashing_imports():
+    assert {"ffmpy3", "PIL"} <= _imported_modules("from vidhash import hash_video")
+    assert "imagehash" in _imported_modules("from vidhash.hash_options import DHash; DHash().blank_hash")
+
+
+def test_lazy_attributes():
+    assert sorted(vidhash.__all__) == sorted(vidhash._EXPORTS)
+    assert set(vidhash.__all__) <= set(dir(vidhash))
+    for name in vidhash.__all__:
+        assert getattr(vidhash, name) is getattr(sys.modules[vidhash._EXPORTS[name]], name)
+    with pytest.raises(AttributeError):
+        vidhash.no_such_name
+
+
+@pytest.mark.parametrize(
+    "settings", [DHash(8), AHash(6), PHash(8), WHash(8), ColorHash(3), MultiResolutionHash(DHash(8), DHash(4))]
+)
+def test_blank_bits(settings):
+    assert np.array_equal(settings.blank_bits, settings.blank_hash.to_bits())
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from test.conftest import make_video_hash
+from vidhash.incremental_match import IncrementalMatcher
+from vidhash.match_options import DurationMatch, FrameCountMatch, MatchOptions, PercentageMatch
+
+
+def _related_bits(seed: int) -> tuple:
+    # Two videos sharing a noisy section, with blank and repeated frames
+    rng = np.random.default_rng(seed)
+    shared = rng.random((20, 8, 8)) > 0.5
+    noisy = shared ^ (rng.random(shared.shape) > 0.95)
+    bits1 = np.concatenate([rng.random((15, 8, 8)) > 0.5, shared, np.zeros((2, 8, 8), dtype=bool)])
+    start = int(rng.integers(0, 10))
+    bits2 = np.concatenate(
+        [
+            np.zeros((1, 8, 8), dtype=bool),
+            noisy[rng.integers(0, 20, 10)],
+            noisy[start : start + int(rng.integers(0, 10))],
+            rng.random((int(rng.integers(0, 30)), 8, 8)) > 0.5,
+        ]
+    )
+    bits2[5:9] = bits2[5]
+    return bits1, bits2
+
+
+MATCH_OPTIONS = [
+    PercentageMatch(),
+    PercentageMatch(hamming_dist=1, percentage_overlap=10, ignore_blank=False),
+    FrameCountMatch(),
+    FrameCountMatch(hamming_dist=0, count_overlap=8, ignore_blank=False),
+    DurationMatch(),
+    DurationMatch(hamming_dist=5, time_overlap=0.6),
+]
+
+
+@pytest.mark.parametrize("match_options", MATCH_OPTIONS)
+@pytest.mark.parametrize("know_length", [True, False])
+def test_incremental_matches_check_match(match_options: MatchOptions, know_length: bool) -> None:
+    rng = np.random.default_rng(0)
+    for seed in range(40):
+        bits1, bits2 = _related_bits(seed)
+        for reference_bits, video_bits in [(bits1, bits2), (bits2, bits1)]:
+            reference = make_video_hash(reference_bits, objects=True)
+            video = make_video_hash(video_bits, objects=True)
+            expected = match_options.check_match(video, reference)
+            matcher = match_options.incremental_matcher(reference, video.video_length if know_length else None)
+            packed = video.packed_hashes.packed
+            start = 0
+            while start < len(packed) and not matcher.decided:
+                end = start + int(rng.integers(1, 6))
+                matcher.add_packed(packed[start:end])
+                start = end
+            if matcher.decided:
+                # A match decided early must hold whatever the rest of the video is
+                assert expected is True
+            assert matcher.finish(video.video_length) == expected
+
+
+@pytest.mark.parametrize("match_options", MATCH_OPTIONS)
+def test_incremental_decides_early_on_copy(match_options: MatchOptions) -> None:
+    rng = np.random.default_rng(1)
+    reference = make_video_hash(rng.random((100, 8, 8)) > 0.5, objects=True)
+    matcher = match_options.incremental_matcher(reference, reference.video_length)
+
+    for frame_hash in reference.image_hashes:
+        if matcher.add(frame_hash):
+            break
+
+    assert matcher.result is True
+    assert matcher.frame_count < len(reference.image_hashes)
+
+
+def test_base_matcher_decides_at_finish() -> None:
+    bits1, bits2 = _related_bits(3)
+    reference = make_video_hash(bits1, objects=True)
+    video = make_video_hash(bits2, objects=True)
+    matcher = IncrementalMatcher(FrameCountMatch(), reference)
+
+    assert matcher.add_packed(video.packed_hashes.packed) is None
+    with pytest.raises(ValueError):
+        matcher.finish()
+    assert matcher.finish(video.video_length) == FrameCountMatch().check_match(video, reference)
+    assert matcher.video_hash(video.video_length) == video.to_packed()
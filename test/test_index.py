@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from test.conftest import make_video_hash
+from vidhash import HashOptions, VideoHashIndex
+from vidhash.hash_options import DHash
+from vidhash.match_options import DurationMatch, FrameCountMatch, MatchException, PercentageMatch
+from vidhash.packed_hash import unique_values, unpack_bits
+
+
+def _library(seed: int) -> dict:
+    # Videos drawn from a few shared clips, with noise, so that some of them match each other
+    rng = np.random.default_rng(seed)
+    clips = [rng.random((10, 8, 8)) > 0.5 for _ in range(5)]
+    videos = {}
+    for num in range(60):
+        parts = [rng.random((int(rng.integers(0, 8)), 8, 8)) > 0.5]
+        for clip_num in rng.choice(5, size=int(rng.integers(0, 3)), replace=False):
+            clip = clips[clip_num]
+            parts.append(clip ^ (rng.random(clip.shape) > 0.97))
+        if num % 10 == 0:
+            parts.append(np.zeros((3, 8, 8), dtype=bool))
+        videos[f"video_{num}"] = make_video_hash(np.concatenate(parts), objects=True)
+    return videos
+
+
+MATCH_OPTIONS = [
+    PercentageMatch(),
+    PercentageMatch(hamming_dist=0, percentage_overlap=30, ignore_blank=False),
+    FrameCountMatch(),
+    FrameCountMatch(hamming_dist=1, count_overlap=2, ignore_blank=False),
+    DurationMatch(),
+    DurationMatch(hamming_dist=2, time_overlap=1),
+]
+
+
+@pytest.mark.parametrize("match_options", MATCH_OPTIONS)
+def test_find_matches_same_as_check_match(match_options) -> None:
+    videos = _library(0)
+    index = VideoHashIndex()
+    for key, video_hash in videos.items():
+        index.insert(key, video_hash)
+
+    for video_hash in list(videos.values())[:20]:
+        expected = {key for key, other in videos.items() if match_options.check_match(video_hash, other)}
+        assert set(index.find_matches(video_hash, match_options)) == expected
+
+
+def test_candidates_are_a_shortlist() -> None:
+    videos = _library(1)
+    index = VideoHashIndex()
+    for key, video_hash in videos.items():
+        index.insert(key, video_hash)
+
+    query = videos["video_3"]
+    assert len(index.candidates(query, FrameCountMatch(count_overlap=5))) < len(videos)
+
+
+def test_insert_and_remove() -> None:
+    videos = _library(2)
+    index = VideoHashIndex()
+    for key, video_hash in videos.items():
+        index.insert(key, video_hash)
+    query = videos["video_0"]
+    assert "video_0" in index.find_matches(query)
+
+    # Replacing and removing videos, enough to trigger a compaction
+    index.insert("video_0", videos["video_1"])
+    for num in range(2, 50):
+        index.remove(f"video_{num}")
+    remaining = {key: videos[key] for key in index}
+    remaining["video_0"] = videos["video_1"]
+
+    assert len(index) == 12
+    assert index.get("video_0") == videos["video_1"].to_packed()
+    assert index.get("video_2") is None
+    for video_hash in [query, videos["video_1"]]:
+        expected = {key for key, other in remaining.items() if FrameCountMatch().check_match(video_hash, other)}
+        assert set(index.find_matches(video_hash, FrameCountMatch())) == expected
+
+
+def test_empty_query() -> None:
+    index = VideoHashIndex()
+    index.insert("video", make_video_hash(np.ones((3, 8, 8), dtype=bool), objects=True))
+
+    assert index.find_matches(make_video_hash(np.zeros((0, 8, 8), dtype=bool), objects=True)) == []
+
+
+def test_unrelated_query() -> None:
+    index = VideoHashIndex()
+    for key, video_hash in _library(0).items():
+        index.insert(key, video_hash)
+    rng = np.random.default_rng(100)
+    unrelated = rng.random((20, 8, 8)) > 0.5
+    # Shares its first chunk with an indexed frame, but differs in every other bit, so is too far to be similar
+    indexed = index.get("video_0")
+    assert indexed is not None
+    near_chunk = ~unpack_bits(indexed.packed_hashes.packed[:1], (8, 8))
+    near_chunk[:, :2] = ~near_chunk[:, :2]
+    for bits in [unrelated, near_chunk]:
+        query = make_video_hash(bits)
+        assert index.candidates(query) == []
+        assert index.find_matches(query) == []
+    assert len(unique_values(np.zeros(0, dtype=np.int64))) == 0
+
+
+def test_hamming_dist_above_index_limit() -> None:
+    index = VideoHashIndex(max_hamming_dist=1)
+
+    with pytest.raises(ValueError):
+        index.candidates(make_video_hash(np.ones((3, 8, 8), dtype=bool), objects=True), FrameCountMatch(hamming_dist=2))
+
+
+def test_hash_options_mismatch() -> None:
+    index = VideoHashIndex()
+    other = make_video_hash(
+        np.ones((1, 16, 16), dtype=bool), HashOptions(settings=DHash(16)), video_length=1, objects=True
+    )
+
+    with pytest.raises(MatchException):
+        index.insert("video", other)
@@ -0,0 +1,83 @@
+import asyncio
+
+from test.conftest import make_video_hash
+from vidhash import Tracer, trace
+from vidhash.instrumentation import Stage, StageStats, count_comparisons, current_tracer, record_stage
+from vidhash.match_options import DurationMatch, FrameCountMatch, PercentageMatch
+
+
+def test_stages_record_nothing_without_trace() -> None:
+    assert current_tracer() is None
+    with Stage("test") as stage:
+        count_comparisons(5)
+    assert stage.stats.comparisons == 0
+    record_stage("test", StageStats(1))
+
+
+def test_stage_totals() -> None:
+    with trace() as tracer:
+        assert current_tracer() is tracer
+        for _ in range(3):
+            with Stage("outer") as stage:
+                stage.stats.frames += 2
+                count_comparisons(10)
+                with Stage("inner"):
+                    count_comparisons(1)
+        record_stage("recorded", StageStats(0.5, calls=1, bytes_written=100))
+    assert current_tracer() is None
+    assert tracer.stages["outer"].calls == 3
+    assert tracer.stages["outer"].frames == 6
+    assert tracer.stages["outer"].comparisons == 30
+    assert tracer.stages["inner"].comparisons == 3
+    assert tracer.stages["outer"].duration >= tracer.stages["inner"].duration
+    assert tracer.to_dict()["recorded"]["bytes_written"] == 100
+
+
+def test_match_comparisons() -> None:
+    hash1 = make_video_hash(50, seed=1)
+    hash2 = make_video_hash(80, seed=2)
+    # Signatures can't rule out frames this far apart, so the frames are compared
+    for match_options in [
+        PercentageMatch(hamming_dist=4),
+        FrameCountMatch(hamming_dist=4),
+        DurationMatch(hamming_dist=4),
+    ]:
+        with trace() as tracer:
+            match_options.check_match(hash1, hash2)
+        stats = tracer.stages["match"]
+        assert stats.calls == 1
+        # None of the random frames match, so every pair gets compared
+        assert stats.comparisons == 50 * 80
+    # Unrelated videos are ruled out by their signatures without comparing any frames
+    with trace() as tracer:
+        PercentageMatch().check_match(hash1, hash2)
+    assert tracer.stages["match"].comparisons == 0
+
+
+def test_custom_tracer() -> None:
+    recorded = []
+
+    class ListTracer(Tracer):
+        def record(self, name: str, stats: StageStats) -> None:
+            super().record(name, stats)
+            recorded.append((name, stats.comparisons))
+
+    with trace(ListTracer()):
+        PercentageMatch(hamming_dist=4).check_match(make_video_hash(10, seed=1), make_video_hash(10, seed=2))
+    assert recorded == [("match", 100)]
+
+
+async def test_trace_follows_tasks() -> None:
+    async def run_stage(name: str) -> None:
+        await asyncio.sleep(0)
+        with Stage(name):
+            count_comparisons(1)
+
+    with trace() as tracer1:
+        task1 = asyncio.create_task(run_stage("task"))
+    with trace() as tracer2:
+        task2 = asyncio.create_task(run_stage("task"))
+        await run_stage("task")
+    await asyncio.gather(task1, task2)
+    assert tracer1.stages["task"].calls == 1
+    assert tracer2.stages["task"].calls == 2
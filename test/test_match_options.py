@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import math
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pytest
+
+import vidhash.match_options
+from test.conftest import make_video_hash
+from vidhash.match_options import AlignedSegment, CascadeMatch, DurationMatch, FrameCountMatch, PercentageMatch
+
+if TYPE_CHECKING:
+    from vidhash import VideoHash
+
+
+def _related_hashes(seed: int) -> tuple:
+    # Two videos sharing a noisy section, with blank and repeated frames
+    rng = np.random.default_rng(seed)
+    shared = rng.random((20, 8, 8)) > 0.5
+    noisy = shared ^ (rng.random(shared.shape) > 0.95)
+    bits1 = np.concatenate([rng.random((15, 8, 8)) > 0.5, shared, np.zeros((2, 8, 8), dtype=bool)])
+    bits2 = np.concatenate(
+        [np.zeros((1, 8, 8), dtype=bool), noisy[rng.integers(0, 20, 10)], rng.random((12, 8, 8)) > 0.5]
+    )
+    bits2[5:9] = bits2[5]
+    return make_video_hash(bits1, objects=True), make_video_hash(bits2, objects=True)
+
+
+def _legacy_has_overlap(frame_hashes, hash2, hamming_dist, required_overlap, ignore_blank) -> bool:
+    overlaps = 0
+    blank_hash = hash2.hash_options.settings.blank_hash
+    for image_hash in frame_hashes:
+        if any(
+            other.similar_to(image_hash, hamming_dist)
+            for other in hash2.hash_set
+            if not (ignore_blank and other == blank_hash)
+        ):
+            overlaps += 1
+            if overlaps >= required_overlap:
+                return True
+    return False
+
+
+def _legacy_percentage(match: PercentageMatch, hash1: VideoHash, hash2: VideoHash) -> bool:
+    required = match.percentage_overlap * min(len(hash1.image_hashes), len(hash2.image_hashes)) / 100
+    shorter, longer = (hash1, hash2) if hash1.video_length < hash2.video_length else (hash2, hash1)
+    blank_hash = shorter.hash_options.settings.blank_hash
+    frames = [f for f in shorter.image_hashes if not (match.ignore_blank and f == blank_hash)]
+    return _legacy_has_overlap(frames, longer, match.hamming_dist, required, match.ignore_blank)
+
+
+def _legacy_frame_count(match: FrameCountMatch, hash1: VideoHash, hash2: VideoHash) -> bool:
+    required = min(match.count_overlap, len(hash1.hash_set), len(hash2.hash_set))
+    hash_set = hash1.hash_set.copy()
+    if match.ignore_blank:
+        hash_set.discard(hash1.hash_options.settings.blank_hash)
+    return _legacy_has_overlap(hash_set, hash2, match.hamming_dist, required, match.ignore_blank)
+
+
+def _legacy_duration(match: DurationMatch, hash1: VideoHash, hash2: VideoHash) -> bool:
+    frame_count = min(
+        math.ceil(hash1.hash_options.fps * match.time_overlap), len(hash1.image_hashes), len(hash2.image_hashes)
+    )
+    for start1 in range(len(hash1.image_hashes)):
+        for start2 in range(len(hash2.image_hashes)):
+            frames1 = hash1.image_hashes[start1:]
+            frames2 = hash2.image_hashes[start2:]
+            if len(frames1) < frame_count or len(frames2) < frame_count:
+                continue
+            match_count = 0
+            for frame1, frame2 in zip(frames1, frames2):
+                if not frame1.similar_to(frame2, match.hamming_dist):
+                    break
+                match_count += 1
+                if match_count >= frame_count:
+                    return True
+    return False
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("hamming_dist", [0, 3, 8])
+@pytest.mark.parametrize("ignore_blank", [True, False])
+def test_percentage_match_unchanged(seed, hamming_dist, ignore_blank):
+    hash1, hash2 = _related_hashes(seed)
+    for percentage in [0, 10, 20, 30, 50, 100]:
+        match = PercentageMatch(hamming_dist, percentage, ignore_blank)
+        expected = _legacy_percentage(match, hash1, hash2)
+        assert match.check_match(hash1, hash2) == expected
+        assert match.check_match(hash2.to_packed(), hash1.to_packed()) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("hamming_dist", [0, 3, 8])
+@pytest.mark.parametrize("ignore_blank", [True, False])
+def test_frame_count_match_unchanged(seed, hamming_dist, ignore_blank):
+    hash1, hash2 = _related_hashes(seed)
+    for count in [1, 3, 5, 10, 30]:
+        match = FrameCountMatch(hamming_dist, count, ignore_blank)
+        assert match.check_match(hash1, hash2) == _legacy_frame_count(match, hash1, hash2)
+        assert match.check_match(hash2.to_packed(), hash1.to_packed()) == _legacy_frame_count(match, hash2, hash1)
+
+
+def test_empty_video_never_matches():
+    hash1, _ = _related_hashes(0)
+    empty = make_video_hash(np.zeros((0, 8, 8), dtype=bool), objects=True)
+    assert not PercentageMatch(3, 0).check_match(hash1, empty)
+    assert not FrameCountMatch(3, 1).check_match(empty, hash1)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("hamming_dist", [0, 3, 8])
+def test_duration_match_unchanged(seed, hamming_dist):
+    hash1, hash2 = _related_hashes(seed)
+    for time_overlap in [0, 0.2, 0.6, 1, 2, 10]:
+        match = DurationMatch(hamming_dist, time_overlap)
+        assert match.check_match(hash1, hash2) == _legacy_duration(match, hash1, hash2)
+        assert match.check_match(hash2.to_packed(), hash1.to_packed()) == _legacy_duration(match, hash2, hash1)
+
+
+def test_duration_best_segment():
+    rng = np.random.default_rng(0)
+    bits1 = rng.random((30, 8, 8)) > 0.5
+    bits2 = np.concatenate([rng.random((7, 8, 8)) > 0.5, bits1[12:23], rng.random((4, 8, 8)) > 0.5])
+    segment = DurationMatch(0).best_segment(make_video_hash(bits1, objects=True), make_video_hash(bits2, objects=True))
+    assert segment == AlignedSegment(12, 7, 11, 5)
+    assert segment.start_time1 == 2.4
+    assert segment.duration == 2.2
+    reverse = DurationMatch(0).best_segment(make_video_hash(bits2, objects=True), make_video_hash(bits1, objects=True))
+    assert reverse == AlignedSegment(7, 12, 11, 5)
+
+
+@pytest.mark.parametrize(
+    "match_options",
+    [
+        PercentageMatch(),
+        FrameCountMatch(hamming_dist=2, count_overlap=7, ignore_blank=False),
+        DurationMatch(time_overlap=1.5),
+        CascadeMatch(DurationMatch(time_overlap=2), coarse_hamming_dist=2),
+    ],
+)
+def test_match_options_dict(match_options):
+    data = match_options.to_dict()
+    assert vidhash.match_options.MatchOptions.from_dict(data) == match_options
+    with pytest.raises(ValueError):
+        vidhash.match_options.MatchOptions.from_dict({**data, "type": "NoSuchMatch"})
@@ -0,0 +1,75 @@
+from test.conftest import make_video_hash
+from vidhash import HashOptions, VideoHash, VideoHashLibrary, write_library
+from vidhash.metadata import VideoMetadata, parse_ffmpeg_log
+
+MP4_LOG = """Input #0, mov,mp4,m4a,3gp,3g2,mj2, from 'scenes.mp4':
+  Metadata:
+    major_brand     : isom
+    encoder         : Lavf61.1.100
+  Duration: 00:01:12.50, start: 0.000000, bitrate: 408 kb/s
+  Stream #0:0[0x1](und): Audio: aac (LC) (mp4a / 0x6134706D), 44100 Hz, stereo, fltp, 128 kb/s (default)
+  Stream #0:1[0x2](und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(tv, bt709, progressive), 1280x720 [SAR 1:1 \
+DAR 16:9], 405 kb/s, 29.97 fps, 29.97 tbr, 30k tbn (default)
+Stream mapping:
+  Stream #0:1 -> #0:0 (h264 (native) -> rawvideo (native))
+Output #0, rawvideo, to 'pipe:1':
+  Stream #0:0(und): Video: rawvideo (Y800 / 0x30303859), gray, 200x112, q=2-31, 179 kb/s, 5 fps, 5 tbn (default)
+"""
+
+WEBM_LOG = """Input #0, matroska,webm, from 'clip.webm':
+  Duration: N/A, start: 0.000000, bitrate: N/A
+  Stream #0:0: Video: vp9 (Profile 0), yuv420p(tv, progressive), 640x360, SAR 1:1 DAR 16:9, 1k tbr, 1k tbn (default)
+Output #0, rawvideo, to 'pipe:1':
+"""
+
+
+def test_parse_mp4_log() -> None:
+    metadata = parse_ffmpeg_log(MP4_LOG.splitlines())
+
+    assert metadata == VideoMetadata(duration=72.5, width=1280, height=720, codec="h264", fps=29.97)
+    assert metadata.frame_count == 2173
+
+
+def test_parse_log_without_duration() -> None:
+    metadata = parse_ffmpeg_log(WEBM_LOG.splitlines())
+
+    assert metadata == VideoMetadata(duration=None, width=640, height=360, codec="vp9", fps=1000)
+    assert metadata.frame_count is None
+
+
+def test_parse_log_without_input() -> None:
+    log = "[in#0 @ 0x22746ac0] Error opening input: No such file or directory\nError opening input file x.mp4."
+
+    assert parse_ffmpeg_log(log.splitlines()) is None
+
+
+def test_metadata_bytes_round_trip() -> None:
+    for codec in ["h264", "vp9", "a much longer codec name"]:
+        video_hash = make_video_hash(10, video_length=2, metadata=VideoMetadata(2, 640, 360, codec, 25))
+        loaded = VideoHash.from_bytes(video_hash.to_bytes())
+
+        assert loaded == video_hash
+        assert loaded.metadata == video_hash.metadata
+        assert VideoHash.from_bytes(video_hash.to_unpacked().to_bytes()).metadata == video_hash.metadata
+
+
+def test_metadata_not_compared() -> None:
+    video_hash = make_video_hash(10, video_length=2, metadata=VideoMetadata(2, 640, 360, "h264", 25))
+
+    assert video_hash == make_video_hash(10, video_length=2, metadata=VideoMetadata())
+    assert video_hash == VideoHash(video_hash.image_hashes, 2, HashOptions())
+
+
+def test_library_with_metadata(tmp_path) -> None:
+    path = str(tmp_path / "library.vhl")
+    video_hashes = [
+        (f"video_{num}", make_video_hash(10, video_length=2, metadata=VideoMetadata(num, codec="h264" * num)))
+        for num in range(5)
+    ]
+    video_hashes.append(("no_metadata", VideoHash(video_hashes[0][1].image_hashes, 2, HashOptions())))
+    write_library(path, video_hashes)
+
+    with VideoHashLibrary(path) as library:
+        for key, video_hash in video_hashes:
+            assert library[key] == video_hash
+            assert library[key].metadata == video_hash.metadata
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+import vidhash.packed_hash
+from test.conftest import make_video_hash
+from vidhash import VideoHash
+from vidhash.frame_hash import SimpleImageHash
+from vidhash.match_options import DurationMatch, FrameCountMatch, PercentageMatch
+from vidhash.packed_hash import PackedFrameHashes, RunLengthFrameHashes, longest_diagonal_run_of_runs
+
+HASH_SHAPE = (8, 8)
+
+
+def _static_hashes(rng: np.random.Generator, pool: np.ndarray, scenes: int) -> np.ndarray:
+    # Scenes of repeated hashes drawn from a shared pool, some with a bit flipped, like static shots and slides
+    hashes = np.repeat(rng.choice(pool, scenes), rng.integers(1, 12, scenes))
+    flips = np.uint64(1) << rng.integers(0, 64, len(hashes)).astype(np.uint64)
+    hashes = np.where(rng.random(len(hashes)) < 0.1, hashes ^ flips, hashes)
+    return hashes.reshape(-1, 1)
+
+
+def test_run_length_frame_hashes():
+    packed = np.array([[1], [1], [1], [2], [1], [1]], dtype=np.uint64)
+    runs = RunLengthFrameHashes.from_packed(packed, HASH_SHAPE)
+    assert runs.packed_runs.tolist() == [[1], [2], [1]]
+    assert runs.run_starts.tolist() == [0, 3, 4]
+    assert runs.run_lengths.tolist() == [3, 1, 2]
+    assert len(runs) == 6
+    assert runs == PackedFrameHashes(packed, HASH_SHAPE)
+    assert PackedFrameHashes(packed, HASH_SHAPE) == runs
+    assert runs.to_packed() == PackedFrameHashes(packed, HASH_SHAPE)
+    assert list(runs) == list(PackedFrameHashes(packed, HASH_SHAPE))
+    assert [runs[index] for index in range(-6, 6)] == list(PackedFrameHashes(packed, HASH_SHAPE)) * 2
+    assert runs[2:4] == PackedFrameHashes(packed[2:4], HASH_SHAPE)
+    with pytest.raises(IndexError):
+        runs[6]
+    assert RunLengthFrameHashes.from_frame_hashes(list(runs), HASH_SHAPE) == runs
+
+
+def test_run_length_concatenate():
+    packed = np.array([[1], [1], [2], [2], [2], [3]], dtype=np.uint64)
+    parts = [RunLengthFrameHashes.from_packed(packed[start : start + 2], HASH_SHAPE) for start in range(0, 6, 2)]
+    joined = RunLengthFrameHashes.concatenate(parts, HASH_SHAPE)
+    assert joined.run_lengths.tolist() == [2, 3, 1]
+    assert joined == RunLengthFrameHashes.from_packed(packed, HASH_SHAPE)
+    assert len(RunLengthFrameHashes.concatenate([], HASH_SHAPE)) == 0
+
+
+def test_run_length_empty():
+    runs = RunLengthFrameHashes.from_packed(np.zeros((0, 1), dtype=np.uint64), HASH_SHAPE)
+    assert len(runs) == 0
+    assert list(runs) == []
+    assert longest_diagonal_run_of_runs(runs, runs, 3) == (0, 0, 0)
+
+
+@pytest.mark.parametrize("max_segments", [2**22, 10])
+def test_longest_diagonal_run_of_runs(monkeypatch, max_segments):
+    monkeypatch.setattr(vidhash.packed_hash, "MAX_RUN_SEGMENTS", max_segments)
+    rng = np.random.default_rng(max_segments)
+    for _ in range(200):
+        pool = rng.integers(0, 2**63, int(rng.integers(1, 6)), dtype=np.uint64)
+        hashes1 = _static_hashes(rng, pool, int(rng.integers(1, 30)))
+        hashes2 = _static_hashes(rng, pool, int(rng.integers(1, 30)))
+        hamming_dist = int(rng.integers(0, 3))
+        target_length = None if rng.random() < 0.5 else int(rng.integers(1, 20))
+        runs1 = RunLengthFrameHashes.from_packed(hashes1, HASH_SHAPE)
+        runs2 = RunLengthFrameHashes.from_packed(hashes2, HASH_SHAPE)
+        assert longest_diagonal_run_of_runs(
+            runs1, runs2, hamming_dist, target_length
+        ) == vidhash.packed_hash.longest_diagonal_run(hashes1, hashes2, hamming_dist, target_length)
+
+
+@pytest.mark.parametrize(
+    "match_options",
+    [
+        PercentageMatch(),
+        PercentageMatch(hamming_dist=0, percentage_overlap=50, ignore_blank=False),
+        FrameCountMatch(count_overlap=4),
+        DurationMatch(time_overlap=2),
+        DurationMatch(hamming_dist=0, time_overlap=1),
+    ],
+)
+def test_run_length_match_results(match_options):
+    rng = np.random.default_rng(0)
+    results = []
+    for _ in range(30):
+        pool = rng.integers(0, 2**63, 8, dtype=np.uint64)
+        pool[0] = 0
+        hash1 = make_video_hash(_static_hashes(rng, pool, int(rng.integers(1, 20))))
+        hash2 = make_video_hash(_static_hashes(rng, pool, int(rng.integers(1, 20))))
+        expected = match_options.check_match(hash1.to_unpacked(), hash2.to_unpacked())
+        assert match_options.check_match(hash1.to_run_length(), hash2.to_run_length()) == expected
+        assert match_options.check_match(hash1.to_run_length(), hash2) == expected
+        results.append(expected)
+    assert any(results) and not all(results)
+
+
+def test_run_length_best_segment():
+    rng = np.random.default_rng(1)
+    pool = rng.integers(0, 2**63, 4, dtype=np.uint64)
+    hash1 = make_video_hash(_static_hashes(rng, pool, 15))
+    hash2 = make_video_hash(_static_hashes(rng, pool, 15))
+    expected = DurationMatch().best_segment(hash1, hash2)
+    assert expected is not None
+    assert DurationMatch().best_segment(hash1.to_run_length(), hash2.to_run_length()) == expected
+
+
+def test_run_length_video_hash():
+    rng = np.random.default_rng(2)
+    video_hash = make_video_hash(_static_hashes(rng, rng.integers(0, 2**63, 4, dtype=np.uint64), 10))
+    run_length = video_hash.to_run_length()
+    assert isinstance(run_length.image_hashes, RunLengthFrameHashes)
+    assert run_length == video_hash
+    assert run_length.packed_hashes == video_hash.packed_hashes
+    assert np.array_equal(run_length.unique_packed_hashes(), video_hash.unique_packed_hashes())
+    assert VideoHash.from_bytes(run_length.to_bytes()) == video_hash
+    assert run_length.contains_hash(SimpleImageHash.from_bits(np.ones(HASH_SHAPE, dtype=bool)), 64)
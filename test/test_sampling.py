@@ -0,0 +1,62 @@
+import pytest
+
+from test.conftest import make_video_hash
+from vidhash import HashOptions, VideoHash
+from vidhash.hash_options import DHash
+from vidhash.match_options import DurationMatch, MatchException, PercentageMatch
+from vidhash.sampling import KeyframeSampling, Sampling, SceneChangeSampling, UniformSampling
+
+SAMPLINGS = [KeyframeSampling(), SceneChangeSampling(0.4), UniformSampling(12)]
+
+
+@pytest.mark.parametrize("sampling", SAMPLINGS)
+def test_hash_options_round_trip(sampling: Sampling) -> None:
+    options = HashOptions(fps=2, settings=DHash(16), sampling=sampling)
+
+    assert HashOptions.from_dict(options.to_dict()) == options
+    assert not options.fixed_rate
+
+
+def test_fixed_rate_options_dict_unchanged() -> None:
+    options = HashOptions()
+
+    assert options.to_dict() == {"fps": 5, "settings": DHash(8).to_dict()}
+    assert options.fixed_rate
+
+
+@pytest.mark.parametrize("sampling", SAMPLINGS)
+def test_video_hash_bytes_round_trip(sampling: Sampling) -> None:
+    video_hash = make_video_hash(12, HashOptions(sampling=sampling), video_length=60)
+    loaded = VideoHash.from_bytes(video_hash.to_bytes())
+
+    assert loaded == video_hash
+    assert loaded.hash_options == video_hash.hash_options
+
+
+def test_different_sampling_cannot_be_compared() -> None:
+    hash1 = make_video_hash(12, HashOptions(sampling=KeyframeSampling()), video_length=60)
+    hash2 = make_video_hash(12, HashOptions(sampling=UniformSampling(12)), video_length=60)
+
+    with pytest.raises(MatchException):
+        PercentageMatch().check_match(hash1, hash2)
+    assert PercentageMatch().check_match(hash1, hash1)
+
+
+def test_duration_match_needs_fixed_rate() -> None:
+    video_hash = make_video_hash(12, HashOptions(sampling=UniformSampling(12)), video_length=60)
+
+    with pytest.raises(MatchException):
+        DurationMatch().check_match(video_hash, video_hash)
+    with pytest.raises(MatchException):
+        DurationMatch().best_segment(video_hash, video_hash)
+    with pytest.raises(MatchException):
+        DurationMatch().incremental_matcher(video_hash)
+
+
+def test_uniform_seek_times() -> None:
+    seek_times = UniformSampling(4).seek_times(10)
+
+    assert seek_times == [1.25, 3.75, 6.25, 8.75]
+    assert KeyframeSampling().seek_times(10) is None
+    assert UniformSampling(4).seeks
+    assert not any(sampling.seeks for sampling in [KeyframeSampling(), SceneChangeSampling()])
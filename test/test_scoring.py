@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from test.conftest import make_video_hash
+from vidhash import HashOptions
+from vidhash.hash_options import DHash
+from vidhash.match_options import DurationMatch, MatchException, PercentageMatch
+from vidhash.packed_hash import hamming_distances
+from vidhash.sampling import KeyframeSampling
+from vidhash.scoring import rank_matches, score_match
+
+
+def _videos(seed: int, count: int) -> list:
+    # Videos made of runs of frames from a shared clip, with noise, and blank frames
+    rng = np.random.default_rng(seed)
+    clip = np.repeat(rng.random((15, 64)) > 0.5, rng.integers(1, 4, 15), axis=0)
+    videos = []
+    for _ in range(count):
+        parts = [rng.random((int(rng.integers(0, 10)), 64)) > 0.5, np.zeros((int(rng.integers(0, 3)), 64), dtype=bool)]
+        start = int(rng.integers(0, len(clip)))
+        part = clip[start : start + int(rng.integers(0, 20))]
+        parts.append(part ^ (rng.random(part.shape) > 0.97))
+        parts.append(rng.random((int(rng.integers(0, 10)), 64)) > 0.5)
+        videos.append(make_video_hash(np.concatenate(parts)))
+    return videos
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_score_match(seed):
+    videos = _videos(seed, 10)
+    for hash1 in videos:
+        for hash2 in videos:
+            for ignore_blank in [True, False]:
+                score = score_match(hash1, hash2, 4, ignore_blank)
+                assert score is not None
+                for percentage in [1, 20, 50, 80]:
+                    expected = PercentageMatch(4, percentage, ignore_blank).check_match(hash1, hash2)
+                    assert expected == (score.overlap_frames > 0 and score.percentage_overlap >= percentage)
+                assert score.best_segment == DurationMatch(4).best_segment(hash1, hash2)
+                distances = hamming_distances(hash1.packed_hashes.packed, hash2.packed_hashes.packed)
+                if len(hash1.image_hashes) and len(hash2.image_hashes):
+                    np.testing.assert_array_equal(score.min_distances1, distances.min(axis=1))
+                    np.testing.assert_array_equal(score.min_distances2, distances.min(axis=0))
+
+
+def test_score_match_segment_times():
+    rng = np.random.default_rng(5)
+    clip = rng.random((10, 64)) > 0.5
+    hash1 = make_video_hash(np.concatenate([rng.random((5, 64)) > 0.5, clip]))
+    hash2 = make_video_hash(np.concatenate([clip, rng.random((20, 64)) > 0.5]))
+    score = score_match(hash1, hash2)
+    assert score is not None
+    assert score.percentage_overlap == pytest.approx(200 / 3)
+    assert score.best_segment is not None
+    assert (score.best_segment.start_time1, score.best_segment.start_time2) == (1, 0)
+    assert score.best_segment.duration == 2
+
+
+def test_score_match_segment_ties():
+    # Videos of the same length sharing two clips of the same length, in opposite orders, so the best segment could
+    # be either of them
+    rng = np.random.default_rng(0)
+    clip1, clip2 = rng.random((4, 64)) > 0.5, rng.random((4, 64)) > 0.5
+    hash1 = make_video_hash(np.concatenate([clip1, rng.random((6, 64)) > 0.5, clip2, rng.random((6, 64)) > 0.5]))
+    hash2 = make_video_hash(np.concatenate([clip2, rng.random((6, 64)) > 0.5, clip1, rng.random((6, 64)) > 0.5]))
+    for video_hash1, video_hash2 in [(hash1, hash2), (hash2, hash1)]:
+        score = score_match(video_hash1, video_hash2)
+        assert score is not None
+        assert score.best_segment == DurationMatch().best_segment(video_hash1, video_hash2)
+        assert score.best_segment is not None
+        assert (score.best_segment.start_frame1, score.best_segment.start_frame2) == (0, 10)
+
+
+def test_score_match_sampled():
+    # Sampled frames aren't at fixed times, so there is no segment
+    rng = np.random.default_rng(6)
+    options = HashOptions(sampling=KeyframeSampling())
+    bits = rng.random((10, 64)) > 0.5
+    score = score_match(make_video_hash(bits, options), make_video_hash(bits, options))
+    assert score is not None
+    assert score.percentage_overlap == 100
+    assert score.best_segment is None
+
+
+def test_score_match_empty():
+    score = score_match(make_video_hash(np.zeros((0, 64), dtype=bool)), make_video_hash(np.ones((5, 64), dtype=bool)))
+    assert score is not None
+    assert score.percentage_overlap == 0
+    assert score.best_segment is None
+    assert list(score.min_distances2) == [65] * 5
+
+
+def test_score_match_min_percentage():
+    videos = _videos(7, 20)
+    for hash1 in videos:
+        for hash2 in videos:
+            score = score_match(hash1, hash2)
+            assert score is not None
+            for min_percentage in [10, 50, 90]:
+                bounded = score_match(hash1, hash2, min_percentage=min_percentage)
+                if score.percentage_overlap >= min_percentage:
+                    assert bounded == score
+                else:
+                    assert bounded is None or bounded == score
+
+
+def test_score_match_different_options():
+    rng = np.random.default_rng(8)
+    video_hash = make_video_hash(rng.random((10, 64)) > 0.5)
+    other = make_video_hash(rng.random((10, 16)) > 0.5, HashOptions(settings=DHash(4)), video_length=2)
+    with pytest.raises(MatchException):
+        score_match(video_hash, other)
+
+
+@pytest.mark.parametrize("top_k", [0, 1, 3, 10, 50])
+def test_rank_matches(top_k):
+    videos = _videos(9, 40)
+    candidates = {f"video_{num}": video_hash for num, video_hash in enumerate(videos[1:])}
+    scores = [(key, score_match(videos[0], candidate)) for key, candidate in candidates.items()]
+    expected = sorted(scores, key=lambda item: item[1].rank_key, reverse=True)[:top_k]
+    ranked = rank_matches(videos[0], candidates, top_k)
+    assert ranked == expected
+    assert rank_matches(videos[0], list(candidates.items()), top_k) == expected
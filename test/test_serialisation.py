@@ -0,0 +1,58 @@
+import pytest
+
+from test.conftest import make_video_hash
+from vidhash import HashOptions, VideoHash, VideoHashLibrary, write_library
+from vidhash.hash_options import DHash
+from vidhash.packed_hash import PackedFrameHashes
+
+
+def _video_hash(frame_count: int, hash_size: int = 8, seed: int = 0) -> VideoHash:
+    return make_video_hash(frame_count, HashOptions(fps=2.5, settings=DHash(hash_size)), seed, objects=True)
+
+
+@pytest.mark.parametrize("hash_size", [4, 8, 16])
+def test_video_hash_bytes_round_trip(hash_size):
+    video_hash = _video_hash(25, hash_size)
+    loaded = VideoHash.from_bytes(video_hash.to_bytes())
+    assert isinstance(loaded.image_hashes, PackedFrameHashes)
+    assert loaded == video_hash
+    assert loaded.video_length == video_hash.video_length
+    assert loaded.hash_options == video_hash.hash_options
+
+
+def test_video_hash_bytes_empty():
+    video_hash = _video_hash(0)
+    assert VideoHash.from_bytes(video_hash.to_bytes()) == video_hash
+
+
+def test_video_hash_bytes_invalid():
+    with pytest.raises(ValueError):
+        VideoHash.from_bytes(b"not a video hash at all, just some bytes")
+    with pytest.raises(ValueError):
+        VideoHash.from_bytes(_video_hash(10).to_bytes()[:-1])
+
+
+def test_library_round_trip(tmp_path):
+    path = str(tmp_path / "library.vhl")
+    video_hashes = {f"video {i}": _video_hash(i * 3, seed=i) for i in range(10)}
+    assert write_library(path, video_hashes.items()) == 10
+    with VideoHashLibrary(path) as library:
+        assert len(library) == 10
+        assert list(library.keys()) == list(video_hashes.keys())
+        assert "video 3" in library
+        assert "video 11" not in library
+        assert library["video 4"] == video_hashes["video 4"]
+        assert dict(library.items()) == video_hashes
+
+
+def test_library_close(tmp_path):
+    path = str(tmp_path / "library.vhl")
+    write_library(path, [("video", _video_hash(6))])
+    with VideoHashLibrary(path) as library:
+        assert list(library.keys()) == ["video"]
+    assert library._mmap.closed
+    # A video hash read from the library keeps the mapping open while it is held
+    library = VideoHashLibrary(path)
+    video_hash = library["video"]
+    library.close()
+    assert video_hash == _video_hash(6)
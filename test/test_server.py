@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from test.conftest import make_video_hash
+from vidhash import HashOptions, VideoHash, write_library
+from vidhash.hash_options import DHash
+from vidhash.index import VideoHashIndex
+from vidhash.match_options import DurationMatch, FrameCountMatch, PercentageMatch
+from vidhash.server import ServerError, VideoHashClient, VideoHashServer
+
+
+def _video_hash(seed: int, hash_options: HashOptions = HashOptions()) -> VideoHash:
+    # Videos with seeds in the same ten share most of their frames, so they match each other
+    rng = np.random.default_rng(seed // 10)
+    packed = rng.integers(0, 2**63, (50, 1), dtype=np.uint64)
+    packed[seed % 10 :: 10] = np.random.default_rng(seed).integers(0, 2**63, (len(packed[seed % 10 :: 10]), 1))
+    return make_video_hash(packed, hash_options, video_length=10)
+
+
+@pytest.fixture
+def fake_hash_video(monkeypatch):
+    state = {"calls": [], "running": 0, "max_running": 0}
+
+    async def fake_hash_video(video_path, hash_options, decode_options, executor=None):
+        state["calls"].append(video_path)
+        state["running"] += 1
+        state["max_running"] = max(state["max_running"], state["running"])
+        try:
+            await asyncio.sleep(0.02)
+            name = os.path.basename(video_path)
+            if name == "broken":
+                raise ValueError("Broken video")
+            return _video_hash(int(name), hash_options)
+        finally:
+            state["running"] -= 1
+
+    monkeypatch.setattr("vidhash.server.hash_video", fake_hash_video)
+    return state
+
+
+@pytest.fixture
+async def server(tmp_path, fake_hash_video):
+    with ThreadPoolExecutor(2) as executor:
+        async with VideoHashServer(str(tmp_path / "vidhash.sock"), max_videos=3, executor=executor) as server:
+            yield server
+
+
+async def test_server_hash_video(server, fake_hash_video):
+    async with VideoHashClient(server.socket_path) as client:
+        assert await client.hash_video("12") == _video_hash(12)
+        hash_options = HashOptions(settings=DHash(4))
+        video_hash = await client.hash_video("12", hash_options)
+        assert video_hash.hash_options == hash_options
+    assert fake_hash_video["calls"] == [os.path.abspath("12")] * 2
+
+
+async def test_server_shares_concurrent_requests(server, fake_hash_video):
+    async with VideoHashClient(server.socket_path) as client:
+        results = await asyncio.gather(*[client.hash_video("5") for _ in range(10)])
+    assert all(result == _video_hash(5) for result in results)
+    assert len(fake_hash_video["calls"]) == 1
+
+
+async def test_server_limits_concurrent_videos(server, fake_hash_video):
+    async with VideoHashClient(server.socket_path) as client, VideoHashClient(server.socket_path) as client2:
+        results = await asyncio.gather(
+            *[client.hash_video(str(num)) for num in range(10)],
+            *[client2.hash_video(str(num)) for num in range(10, 20)],
+        )
+    assert results == [_video_hash(num) for num in range(20)]
+    assert fake_hash_video["max_running"] == 3
+
+
+async def test_server_check_match(server):
+    async with VideoHashClient(server.socket_path) as client:
+        assert await client.check_match("10", "11")
+        assert not await client.check_match("10", "20")
+        assert await client.check_match("10", "11", FrameCountMatch(count_overlap=20))
+        assert not await client.check_match("10", "11", DurationMatch(time_overlap=10))
+
+
+async def test_server_reference_sets(server, tmp_path):
+    library_path = str(tmp_path / "library.vhl")
+    write_library(library_path, [(f"library_{num}", _video_hash(num)) for num in range(30, 40)])
+    async with VideoHashClient(server.socket_path) as client:
+        assert await client.add_references("refs", {f"video_{num}": str(num) for num in range(10, 30)}) == 20
+        assert await client.load_library("refs", library_path) == 10
+        assert await client.add_references("other", {"video_1": "1"}) == 1
+        assert await client.reference_sets() == {"refs": 30, "other": 1}
+        assert sorted(await client.find_matches("15", "refs")) == [f"video_{num}" for num in range(10, 20)]
+        assert sorted(await client.find_matches("35", "refs")) == [f"library_{num}" for num in range(30, 40)]
+        assert await client.find_matches("15", "other") == []
+        with pytest.raises(ServerError) as error:
+            await client.find_matches("15", "missing")
+        assert error.value.error_type == "KeyError"
+
+
+async def test_server_matches_off_event_loop(server, tmp_path, monkeypatch):
+    threads = []
+
+    def record_thread(func):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.get_ident())
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(VideoHashIndex, "insert", record_thread(VideoHashIndex.insert))
+    monkeypatch.setattr(VideoHashIndex, "find_matches", record_thread(VideoHashIndex.find_matches))
+    monkeypatch.setattr(PercentageMatch, "check_match", record_thread(PercentageMatch.check_match))
+    library_path = str(tmp_path / "library.vhl")
+    write_library(library_path, [(f"library_{num}", _video_hash(num)) for num in range(30, 33)])
+    async with VideoHashClient(server.socket_path) as client:
+        await client.add_references("refs", {"video_10": "10"})
+        await client.load_library("refs", library_path)
+        assert await client.find_matches("31", "refs") == ["library_30", "library_31", "library_32"]
+        assert await client.check_match("10", "11")
+    assert threads
+    assert threading.get_ident() not in threads
+
+
+async def test_server_errors(server):
+    async with VideoHashClient(server.socket_path) as client:
+        with pytest.raises(ServerError) as error:
+            await client.hash_video("broken")
+        assert error.value.error_type == "ValueError"
+        assert error.value.message == "Broken video"
+        with pytest.raises(ServerError):
+            await client._call("no_such_method")
+        with pytest.raises(ServerError):
+            await client._call("hash_video", no_such_param=1)
+        # The connection is still usable after errors
+        assert await client.hash_video("3") == _video_hash(3)
+
+
+async def test_client_connection_closed(tmp_path, fake_hash_video):
+    socket_path = str(tmp_path / "vidhash.sock")
+    with ThreadPoolExecutor(1) as executor:
+        server = VideoHashServer(socket_path, executor=executor)
+        await server.start()
+        client = VideoHashClient(socket_path)
+        await client.connect()
+        request = asyncio.create_task(client.hash_video("1"))
+        await asyncio.sleep(0)
+        await client.close()
+        with pytest.raises((ConnectionError, asyncio.CancelledError)):
+            await request
+        await server.close()
+    assert not os.path.exists(socket_path)
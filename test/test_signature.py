@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from test.conftest import make_video_hash
+from vidhash import VideoHash, trace
+from vidhash.match_options import CascadeMatch, DurationMatch, FrameCountMatch, PercentageMatch
+from vidhash.packed_hash import hamming_distances, pack_bits, unique_hashes
+from vidhash.signature import VideoSignature
+
+
+def _related_bits(seed: int) -> tuple:
+    rng = np.random.default_rng(seed)
+    bits1 = rng.random((80, 64)) > 0.5
+    bits2 = rng.random((60, 64)) > 0.5
+    bits2[10:40] = bits1[30:60] ^ (rng.random((30, 64)) > 0.97)
+    bits1[60:70] = bits1[0]
+    return bits1, bits2
+
+
+def _shots_bits(frame_count: int, seed: int) -> np.ndarray:
+    # Shots of nearly still frames, with a little noise between frames, like a real video
+    rng = np.random.default_rng(seed)
+    frames: list = []
+    while len(frames) < frame_count:
+        shot = rng.random(64) > 0.5
+        frames += [shot ^ (rng.random(64) > 0.98) for _ in range(int(rng.integers(1, 20)))]
+    return np.array(frames[:frame_count])
+
+
+@pytest.mark.parametrize("hamming_dist", [0, 1, 3])
+def test_signature_bounds_are_upper_bounds(hamming_dist):
+    for seed in range(5):
+        bits1, bits2 = _related_bits(seed)
+        hash1, hash2 = make_video_hash(bits1), make_video_hash(bits2)
+        bounds = hash1.matching_bounds(hash2, hamming_dist)
+        assert bounds is not None
+        matching_frames, matching_hashes = bounds
+        similar = hamming_distances(pack_bits(bits1), pack_bits(bits2)) <= hamming_dist
+        assert matching_frames[0] >= similar.any(axis=1).sum() > 0
+        assert matching_frames[1] >= similar.any(axis=0).sum() > 0
+        assert matching_hashes[0] >= len(unique_hashes(pack_bits(bits1)[similar.any(axis=1)]))
+        assert matching_hashes[1] >= len(unique_hashes(pack_bits(bits2)[similar.any(axis=0)]))
+
+
+def test_signature_bounds_high_hamming_dist():
+    # Hashes are split into 4 chunks, so hamming distances of 4 or more can't be bounded
+    bits1, bits2 = _related_bits(0)
+    assert make_video_hash(bits1).matching_bounds(make_video_hash(bits2), 4) is None
+
+
+def test_signature_counts():
+    bits1, _ = _related_bits(0)
+    video_hash = make_video_hash(bits1)
+    signature = video_hash.compute_signature()
+    assert signature.frame_count == 80
+    assert signature.distinct_hash_count == len(unique_hashes(pack_bits(bits1)))
+    assert len(signature.keys) == 4
+    # A computed signature is kept for the next match
+    assert video_hash.get_signature() is video_hash.get_signature()
+
+
+@pytest.mark.parametrize(
+    "match_options",
+    [
+        PercentageMatch(hamming_dist=3),
+        PercentageMatch(hamming_dist=5, percentage_overlap=10),
+        FrameCountMatch(hamming_dist=3, count_overlap=5),
+        DurationMatch(hamming_dist=2, time_overlap=2),
+        CascadeMatch(PercentageMatch(hamming_dist=3)),
+    ],
+)
+def test_signature_prefilter_does_not_change_results(match_options):
+    for seed in range(5):
+        bits1, bits2 = _related_bits(seed)
+        hash1, hash2 = make_video_hash(bits1), make_video_hash(bits2)
+        expected = match_options._check_match(hash1, hash2)
+        assert match_options.check_match(hash1, hash2) == expected
+        hash1.signature = hash1.compute_signature()
+        assert match_options.check_match(hash1, hash2) == expected
+
+
+@pytest.mark.parametrize("match_options", [PercentageMatch(), DurationMatch()])
+def test_signature_prefilter_rejects_unrelated_videos(match_options):
+    video_hashes = [make_video_hash(_shots_bits(300, seed)) for seed in range(30)]
+    with trace() as tracer:
+        for hash1 in video_hashes[:20]:
+            for hash2 in video_hashes[20:]:
+                assert not match_options.check_match(hash1, hash2)
+    assert tracer.stages["match"].comparisons == 0
+
+
+def test_signature_round_trip():
+    bits1, _ = _related_bits(0)
+    video_hash = make_video_hash(bits1)
+    signature = video_hash.compute_signature()
+    assert VideoSignature.from_dict(signature.to_dict()) == signature
+    video_hash.signature = signature
+    loaded = VideoHash.from_bytes(video_hash.to_bytes())
+    assert loaded.signature == signature
+    assert loaded == video_hash
+    assert VideoHash.from_bytes(make_video_hash(bits1).to_bytes()).signature is None
+
+
+def test_signature_older_version():
+    class OldSignature:
+        def to_dict(self):
+            return {"frame_counts": [1, 2], "hash_counts": [1, 2]}
+
+    with pytest.raises(ValueError):
+        VideoSignature.from_dict(OldSignature().to_dict())
+    # Video hashes stored with an older kind of signature still load, and compute a new one when needed
+    bits1, _ = _related_bits(0)
+    video_hash = make_video_hash(bits1)
+    video_hash.signature = OldSignature()
+    loaded = VideoHash.from_bytes(video_hash.to_bytes())
+    assert loaded.signature is None
+    assert loaded.get_signature() == make_video_hash(bits1).compute_signature()
@@ -0,0 +1,89 @@
+import asyncio
+import io
+import os
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import vidhash
+import vidhash.func
+from vidhash import DecodeOptions, HashOptions
+from vidhash.sampling import UniformSampling
+
+TEST_DIR = Path(vidhash.func.TEMP_DIR) / "tests"
+BUTTERFLY_REACT_FASTSTART = "ButterflyReactFaststart.mp4"
+
+
+async def _chunks(data: bytes, chunk_size: int = 100_000):
+    # Arrives in pieces, like an upload
+    for start in range(0, len(data), chunk_size):
+        await asyncio.sleep(0)
+        yield data[start : start + chunk_size]
+
+
+@pytest.fixture
+async def faststart_clip(butterfly_react_clip: Path) -> Path:
+    # MP4 files can only be read from a pipe if their index comes before the video data
+    video_path = TEST_DIR / BUTTERFLY_REACT_FASTSTART
+    if not os.path.exists(video_path):
+        await vidhash.func._run_ffmpeg(
+            inputs={str(butterfly_react_clip): None}, outputs={str(video_path): "-c copy -movflags +faststart"}
+        )
+    return video_path
+
+
+@pytest.mark.parametrize("source_type", ["bytes", "file", "async_iterable"])
+async def test_hash_video_stream(faststart_clip, source_type):
+    # Video streams are always decoded straight into memory, so are compared to a video file decoded the same way
+    path_hash = await vidhash.hash_video(str(faststart_clip), decode_options=DecodeOptions(pipe_frames=True))
+    data = faststart_clip.read_bytes()
+    source = {"bytes": data, "file": io.BytesIO(data), "async_iterable": _chunks(data)}[source_type]
+    stream_hash = await vidhash.hash_video(source)
+    assert stream_hash == path_hash
+    assert stream_hash.video_length == path_hash.video_length
+
+
+async def test_hash_video_stream_same_command(tmp_path):
+    # A stream is decoded by the same FFmpeg command as a file, only reading from stdin
+    video_path = tmp_path / "testsrc.mkv"
+    await vidhash.func._run_ffmpeg(
+        inputs={"testsrc=duration=3:size=160x120:rate=10": "-f lavfi"}, outputs={str(video_path): None}
+    )
+    decode_options = DecodeOptions(pipe_frames=True, threads=1)
+    path_hash = await vidhash.hash_video(str(video_path), decode_options=decode_options)
+    stream_hash = await vidhash.hash_video(video_path.read_bytes(), decode_options=decode_options)
+    assert len(path_hash.image_hashes) > 0
+    assert stream_hash == path_hash
+
+
+async def test_match_video_stream(faststart_clip):
+    reference = await vidhash.hash_video(str(faststart_clip))
+    with open(faststart_clip, "rb") as f:
+        assert await vidhash.match_video(f, reference)
+
+
+async def test_stream_cannot_seek():
+    with pytest.raises(ValueError):
+        await vidhash.hash_video(b"", HashOptions(sampling=UniformSampling(5)))
+
+
+@pytest.mark.parametrize("source_type", ["bytes", "file", "async_iterable"])
+async def test_feed_stdin(source_type):
+    data = os.urandom(3 * vidhash.func.STDIN_CHUNK_SIZE + 5)
+    source = {"bytes": data, "file": io.BytesIO(data), "async_iterable": _chunks(data)}[source_type]
+    process = await asyncio.create_subprocess_exec("cat", stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    assert process.stdin is not None and process.stdout is not None
+    feed_task = asyncio.create_task(vidhash.func._feed_stdin(process.stdin, source))
+    output = await process.stdout.read()
+    await feed_task
+    assert await process.wait() == 0
+    assert output == data
+
+
+async def test_feed_stdin_stops_early():
+    # The reading process exits without reading the whole stream, which isn't an error
+    process = await asyncio.create_subprocess_exec("head", "-c", "10", stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    assert process.stdin is not None and process.stdout is not None
+    await vidhash.func._feed_stdin(process.stdin, os.urandom(4 * vidhash.func.STDIN_CHUNK_SIZE))
+    assert len(await process.stdout.read()) == 10
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from test.conftest import make_video_hash
+from vidhash.packed_hash import PackedFrameHashes
+
+if TYPE_CHECKING:
+    from vidhash import VideoHash
+
+
+def _object_video_hash(frame_count: int, seed: int = 0, blank_frames: int = 0) -> VideoHash:
+    rng = np.random.default_rng(seed)
+    bits = rng.random((frame_count, 8, 8)) > 0.5
+    bits[:blank_frames] = False
+    # Repeat some frames, as static scenes do
+    bits[frame_count // 2 :: 3] = bits[frame_count // 2]
+    return make_video_hash(bits, objects=True)
+
+
+def test_packed_round_trip():
+    video_hash = _object_video_hash(40, blank_frames=2)
+    packed = video_hash.to_packed()
+    assert isinstance(packed.image_hashes, PackedFrameHashes)
+    assert packed.image_hashes.packed.shape == (40, 1)
+    assert packed == video_hash
+    unpacked = packed.to_unpacked()
+    assert isinstance(unpacked.image_hashes, list)
+    assert unpacked.image_hashes == video_hash.image_hashes
+
+
+def test_packed_hash_set():
+    video_hash = _object_video_hash(40)
+    assert video_hash.to_packed().hash_set == video_hash.hash_set
+
+
+def test_packed_blank_frame():
+    assert _object_video_hash(20, blank_frames=1).to_packed().has_blank_frame()
+    assert not _object_video_hash(20).to_packed().has_blank_frame()
+
+
+def test_packed_contains_hash():
+    video_hash = _object_video_hash(30, blank_frames=1)
+    packed = video_hash.to_packed()
+    blank_hash = video_hash.hash_options.settings.blank_hash
+    for other_hash in _object_video_hash(30, seed=1).image_hashes[:10] + video_hash.image_hashes[:3]:
+        for hamming_dist in [0, 20, 30]:
+            for ignore_blank in [True, False]:
+                expected = {
+                    frame_hash
+                    for frame_hash in video_hash.hash_set
+                    if frame_hash.similar_to(other_hash, hamming_dist)
+                    and not (ignore_blank and frame_hash == blank_hash)
+                }
+                assert set(packed.matching_hashes(other_hash, hamming_dist, ignore_blank)) == expected
+                assert packed.contains_hash(other_hash, hamming_dist, ignore_blank) == bool(expected)
@@ -1,6 +1,79 @@
-from vidhash.func import check_match, hash_video
-from vidhash.hash_options import HashOptions, HashSettings
-from vidhash.match_options import MatchOptions
-from vidhash.video_hash import VideoHash
+from __future__ import annotations
 
-__all__ = ["hash_video", "check_match", "HashSettings", "HashOptions", "MatchOptions", "VideoHash"]
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, List
+
+    from vidhash.cache import VideoHashCache
+    from vidhash.decode_options import DecodeOptions
+    from vidhash.dedupe import find_duplicates
+    from vidhash.func import append_video, check_match, hash_video, hash_videos, iter_frame_hashes, match_video
+    from vidhash.hash_options import HashOptions, HashSettings
+    from vidhash.index import VideoHashIndex
+    from vidhash.instrumentation import Tracer, trace
+    from vidhash.library import VideoHashLibrary, write_library
+    from vidhash.match_options import MatchOptions
+    from vidhash.scoring import rank_matches, score_match
+    from vidhash.video_hash import VideoHash
+
+# The module defining each public name. They are only imported when first used, so that processes which just load and
+# compare stored hashes don't import FFmpeg and image hashing libraries.
+_EXPORTS = {
+    "hash_video": "vidhash.func",
+    "hash_videos": "vidhash.func",
+    "append_video": "vidhash.func",
+    "iter_frame_hashes": "vidhash.func",
+    "match_video": "vidhash.func",
+    "check_match": "vidhash.func",
+    "find_duplicates": "vidhash.dedupe",
+    "score_match": "vidhash.scoring",
+    "rank_matches": "vidhash.scoring",
+    "HashSettings": "vidhash.hash_options",
+    "HashOptions": "vidhash.hash_options",
+    "DecodeOptions": "vidhash.decode_options",
+    "MatchOptions": "vidhash.match_options",
+    "VideoHash": "vidhash.video_hash",
+    "VideoHashCache": "vidhash.cache",
+    "VideoHashIndex": "vidhash.index",
+    "Tracer": "vidhash.instrumentation",
+    "trace": "vidhash.instrumentation",
+    "VideoHashLibrary": "vidhash.library",
+    "write_library": "vidhash.library",
+}
+
+__all__ = [
+    "hash_video",
+    "hash_videos",
+    "append_video",
+    "iter_frame_hashes",
+    "match_video",
+    "check_match",
+    "find_duplicates",
+    "score_match",
+    "rank_matches",
+    "HashSettings",
+    "HashOptions",
+    "DecodeOptions",
+    "MatchOptions",
+    "VideoHash",
+    "VideoHashCache",
+    "VideoHashIndex",
+    "Tracer",
+    "trace",
+    "VideoHashLibrary",
+    "write_library",
+]
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted({*globals(), *__all__})
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import pathlib
+import uuid
+from typing import TYPE_CHECKING
+
+from vidhash.decode_options import DEFAULT_DECODE_OPTS
+from vidhash.func import TEMP_DIR, hash_video
+from vidhash.hash_options import DEFAULT_HASH_OPTS
+from vidhash.video_hash import VideoHash
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from typing import List, Optional, Tuple
+
+    from vidhash.decode_options import DecodeOptions
+    from vidhash.func import PathLike
+    from vidhash.hash_options import HashOptions
+
+CACHE_DIR = str(pathlib.Path(TEMP_DIR) / "cache")
+CACHE_VERSION = 3
+CACHE_SUFFIX = ".vhc"
+DEFAULT_MAX_CACHE_SIZE = 1024**3
+CONTENT_HASH_CHUNK_SIZE = 1024**2
+
+logger = logging.getLogger(__name__)
+
+
+class VideoHashCache:
+    """
+    An on-disk cache of video hashes, keyed by the identity of the video file and the hash and decode options used.
+    Decode options which only set thread counts are left out of the key, as they never change the video hash, and so
+    is run_length, as cached video hashes are run-length encoded when they are read instead.
+
+    By default a file is identified by its absolute path, size and modification time, which is cheap to check. With
+    key_by_content, the file's contents are hashed instead, so that moved or copied videos still hit the cache.
+
+    Entries are written to a temporary file and atomically renamed into place, so several processes can share one
+    cache directory safely. Reading an entry marks it as recently used, and once the cache is larger than max_size,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = CACHE_DIR,
+        max_size: int = DEFAULT_MAX_CACHE_SIZE,
+        key_by_content: bool = False,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.key_by_content = key_by_content
+
+    def _file_identity(self, video_path: PathLike) -> str:
+        if self.key_by_content:
+            content_hash = hashlib.sha256()
+            with open(video_path, "rb") as f:
+                while chunk := f.read(CONTENT_HASH_CHUNK_SIZE):
+                    content_hash.update(chunk)
+            return f"content:{content_hash.hexdigest()}"
+        stat = os.stat(video_path)
+        return f"file:{os.path.abspath(video_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def cache_key(
+        self, video_path: PathLike, hash_options: HashOptions, decode_options: Optional[DecodeOptions] = None
+    ) -> str:
+        # The options are frozen dataclasses, so their repr is a stable description of them
+        decode_opts = (decode_options or DEFAULT_DECODE_OPTS).cache_options()
+        key_source = f"{CACHE_VERSION}\n{self._file_identity(video_path)}\n{hash_options!r}\n{decode_opts!r}"
+        return hashlib.sha256(key_source.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return str(pathlib.Path(self.cache_dir) / f"{key}{CACHE_SUFFIX}")
+
+    def get(
+        self,
+        video_path: PathLike,
+        hash_options: Optional[HashOptions] = None,
+        decode_options: Optional[DecodeOptions] = None,
+    ) -> Optional[VideoHash]:
+        options = hash_options or DEFAULT_HASH_OPTS
+        entry_path = self._entry_path(self.cache_key(video_path, options, decode_options))
+        try:
+            with open(entry_path, "rb") as f:
+                video_hash = VideoHash.from_bytes(f.read())
+        except FileNotFoundError:
+            logger.debug("Cache miss for video %s", video_path)
+            return None
+        except (ValueError, KeyError):
+            logger.warning("Discarding unreadable cache entry %s", entry_path)
+            self._remove_entry(entry_path)
+            return None
+        logger.debug("Cache hit for video %s", video_path)
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass
+        if (decode_options or DEFAULT_DECODE_OPTS).run_length:
+            return video_hash.to_run_length()
+        return video_hash
+
+    def put(self, video_path: PathLike, video_hash: VideoHash, decode_options: Optional[DecodeOptions] = None) -> None:
+        entry_path = self._entry_path(self.cache_key(video_path, video_hash.hash_options, decode_options))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = str(pathlib.Path(self.cache_dir) / f".{uuid.uuid4()}.tmp")
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(video_hash.to_bytes())
+            os.replace(temp_path, entry_path)
+        finally:
+            self._remove_entry(temp_path)
+        logger.debug("Cached hash of video %s in %s", video_path, entry_path)
+        self.evict()
+
+    async def hash_video(
+        self,
+        video_path: PathLike,
+        hash_options: Optional[HashOptions] = None,
+        decode_options: Optional[DecodeOptions] = None,
+        executor: Optional[Executor] = None,
+    ) -> VideoHash:
+        """
+        Returns the cached hash of the video, or hashes it with hash_video() and caches the result. The cache's file
+        access runs in threads, so other tasks keep running while it reads the video or the cache directory.
+        """
+        options = hash_options or DEFAULT_HASH_OPTS
+        # Reading the video to key it, reading and writing entries, and evicting all block, so run off the event loop
+        video_hash = await asyncio.to_thread(self.get, video_path, options, decode_options)
+        if video_hash is None:
+            video_hash = await hash_video(video_path, options, decode_options, executor)
+            await asyncio.to_thread(self.put, video_path, video_hash, decode_options)
+        return video_hash
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        try:
+            dir_entries = list(os.scandir(self.cache_dir))
+        except FileNotFoundError:
+            return []
+        for dir_entry in dir_entries:
+            if not dir_entry.name.endswith(CACHE_SUFFIX):
+                continue
+            try:
+                stat = dir_entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache fits in max_size
+        """
+        entries = sorted(self._entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total_size <= self.max_size:
+                break
+            logger.debug("Evicting cache entry %s", entry_path)
+            self._remove_entry(entry_path)
+            total_size -= size
+
+    def clear(self) -> None:
+        for _, _, entry_path in self._entries():
+            self._remove_entry(entry_path)
+
+    @staticmethod
+    def _remove_entry(path: str) -> None:
+        # Another process may have evicted or replaced the entry already
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
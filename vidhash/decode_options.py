@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import dataclasses
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import List, Optional
+
+
+@dataclass(eq=True, frozen=True)
+class DecodeOptions:
+    """
+    Controls how FFmpeg decodes videos for hashing, separately from HashOptions, so they do not affect whether video
+    hashes can be compared.
+
+    pipe_frames decodes the video in a single FFmpeg process, streaming raw frames into memory, rather than writing a
+    downscaled video and PNG frames to disk. Greyscale hashes are then taken from FFmpeg's "gray" pixel format, the
+    luma plane of the decoded video scaled to full range, while PNG frames are converted to RGB and then to greyscale
+    by Pillow's weighted sum, so the pixels can differ by a few levels, especially at colour edges. The hashes are
+    close, but not bit-identical, to those made without piping.
+
+    threads and filter_threads cap how many threads each FFmpeg process uses for decoding (and encoding, when not
+    piping frames) and for filtering, so that many processes can share a machine. FFmpeg picks these itself if None.
+    These never change the decoded pixels.
+
+    The other options trade accuracy for speed, and change the pixels being hashed, so hashes may differ slightly from
+    those made with the defaults:
+    - scaler sets the swscale algorithm used when downscaling, such as "area", "bilinear" or "fast_bilinear",
+      instead of FFmpeg's default of bicubic
+    - lowres decodes at 1/2, 1/4 or 1/8 resolution for values of 1 to 3, for decoders which support it
+    - skip_loop_filter skips the deblocking loop filter, which is a large part of the decoding cost for H.264
+    - intermediate_preset and intermediate_crf set the x264 preset and quality of the downscaled video which is
+      written when not piping frames
+
+    run_length makes hash_video() return the frame hashes run-length encoded, as RunLengthFrameHashes, which takes
+    much less memory for videos with long static shots. The hashes themselves are the same.
+    """
+
+    pipe_frames: bool = False
+    threads: Optional[int] = None
+    filter_threads: Optional[int] = None
+    scaler: Optional[str] = None
+    lowres: int = 0
+    skip_loop_filter: bool = False
+    intermediate_preset: Optional[str] = None
+    intermediate_crf: Optional[int] = None
+    run_length: bool = False
+
+    def cache_options(self) -> DecodeOptions:
+        """
+        These decode options without the thread counts or run_length, which never change the frame hashes produced, for
+        telling apart cached video hashes
+        """
+        return dataclasses.replace(self, threads=None, filter_threads=None, run_length=False)
+
+    def global_options(self) -> List[str]:
+        if self.filter_threads is None:
+            return []
+        return ["-filter_threads", str(self.filter_threads)]
+
+    def input_options(self) -> List[str]:
+        """
+        FFmpeg options for decoding the input video
+        """
+        options = []
+        if self.threads is not None:
+            options += ["-threads", str(self.threads)]
+        if self.lowres:
+            options += ["-lowres", str(self.lowres)]
+        if self.skip_loop_filter:
+            options += ["-skip_loop_filter", "all"]
+        return options
+
+    def intermediate_options(self) -> List[str]:
+        """
+        FFmpeg options for encoding the downscaled video, when frames are not piped
+        """
+        options = []
+        if self.threads is not None:
+            options += ["-threads", str(self.threads)]
+        if self.intermediate_preset is not None:
+            options += ["-preset", self.intermediate_preset]
+        if self.intermediate_crf is not None:
+            options += ["-crf", str(self.intermediate_crf)]
+        return options
+
+
+DEFAULT_DECODE_OPTS = DecodeOptions()
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from collections.abc import Mapping
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+from vidhash.index import VideoHashIndex
+from vidhash.match_options import DEFAULT_MATCH_OPTS, MatchException
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor, Future
+    from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+    from vidhash.match_options import MatchOptions
+    from vidhash.video_hash import VideoHash
+
+DEFAULT_BATCH_SIZE = 500
+CHECKPOINT_VERSION = 1
+# Minimum seconds between checkpoint writes, so that writing them doesn't slow down checking many small batches
+CHECKPOINT_INTERVAL = 10
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(eq=True, frozen=True)
+class DedupeProgress:
+    """
+    How far find_duplicates() has got: how many candidate pairs of videos the index found, how many of them have been
+    checked with the full match options so far, and how many of those matched
+    """
+
+    candidate_pairs: int
+    checked_pairs: int
+    matches: int
+
+
+class _DisjointSet:
+    def __init__(self, size: int) -> None:
+        self.parents = list(range(size))
+
+    def find(self, item: int) -> int:
+        root = item
+        while self.parents[root] != root:
+            root = self.parents[root]
+        while self.parents[item] != root:
+            self.parents[item], item = root, self.parents[item]
+        return root
+
+    def union(self, item1: int, item2: int) -> None:
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 != root2:
+            self.parents[max(root1, root2)] = min(root1, root2)
+
+
+def _candidate_pairs(video_hashes: List[VideoHash], match_options: MatchOptions) -> List[Tuple[int, int]]:
+    """
+    Finds the pairs of videos, by position, which the index can't rule out matching, with the first of each pair
+    being the earlier video, as it is the first video hash given to check_match()
+    """
+    index = VideoHashIndex(video_hashes[0].hash_options, match_options.hamming_dist)
+    for num, video_hash in enumerate(video_hashes):
+        index.insert(str(num), video_hash)
+    pairs = []
+    for num, video_hash in enumerate(video_hashes):
+        candidates = sorted(int(key) for key in index.candidates(video_hash, match_options))
+        pairs += [(num, other) for other in candidates if other > num]
+    return pairs
+
+
+def _check_pairs(
+    match_options: MatchOptions, pairs: List[Tuple[int, int]], video_hashes: Dict[int, VideoHash]
+) -> List[Tuple[int, int]]:
+    return [(num1, num2) for num1, num2 in pairs if match_options.check_match(video_hashes[num1], video_hashes[num2])]
+
+
+def _fingerprint(keys: List[str], video_hashes: List[VideoHash], match_options: MatchOptions, batch_size: int) -> str:
+    # Batches are only the same between runs if the videos, their order, the match options and batch size are
+    fingerprint = hashlib.sha256(f"{CHECKPOINT_VERSION}\n{match_options!r}\n{batch_size}\n".encode())
+    for key, video_hash in zip(keys, video_hashes):
+        fingerprint.update(f"{key}\0{video_hash.hash_options!r}\0{video_hash.video_length!r}\0".encode())
+        fingerprint.update(video_hash.packed_hashes.packed.tobytes())
+    return fingerprint.hexdigest()
+
+
+def _load_checkpoint(path: str, fingerprint: str) -> Tuple[Set[int], List[Tuple[int, int]]]:
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return set(), []
+    if data.get("version") != CHECKPOINT_VERSION or data.get("fingerprint") != fingerprint:
+        raise ValueError(f"Checkpoint {path} was made for different video hashes, match options or batch size")
+    logger.info("Resuming from checkpoint %s with %s batches done", path, len(data["done_batches"]))
+    return set(data["done_batches"]), [(num1, num2) for num1, num2 in data["matches"]]
+
+
+def _save_checkpoint(path: str, fingerprint: str, done_batches: Set[int], matches: List[Tuple[int, int]]) -> None:
+    data = {
+        "version": CHECKPOINT_VERSION,
+        "fingerprint": fingerprint,
+        "done_batches": sorted(done_batches),
+        "matches": [list(pair) for pair in matches],
+    }
+    # Write to a temporary file and rename it, so a crash while writing never leaves a broken checkpoint
+    temp_path = f"{path}.{uuid.uuid4()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+
+def _batch_hashes(video_hashes: List[VideoHash], batch: List[Tuple[int, int]]) -> Dict[int, VideoHash]:
+    # Only the video hashes which a batch needs are sent to the worker checking it
+    return {num: video_hashes[num] for pair in batch for num in pair}
+
+
+def _check_batches(
+    executor: Optional[Executor],
+    max_workers: int,
+    match_options: MatchOptions,
+    video_hashes: List[VideoHash],
+    batches: List[List[Tuple[int, int]]],
+    todo: List[int],
+    batch_done: Callable[[int, List[Tuple[int, int]]], None],
+) -> None:
+    own_executor = executor is None
+    check_executor = executor or ProcessPoolExecutor(max_workers)
+    batch_iter = iter(todo)
+    running: Dict[Future[List[Tuple[int, int]]], int] = {}
+
+    def start_next() -> None:
+        for batch_num in batch_iter:
+            batch = batches[batch_num]
+            future = check_executor.submit(_check_pairs, match_options, batch, _batch_hashes(video_hashes, batch))
+            running[future] = batch_num
+            return
+
+    try:
+        # Keep a couple of batches queued per worker, rather than holding the video hashes for every batch at once
+        for _ in range(2 * max_workers):
+            start_next()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch_num = running.pop(future)
+                start_next()
+                batch_done(batch_num, future.result())
+    finally:
+        for future in running:
+            future.cancel()
+        if own_executor:
+            check_executor.shutdown(wait=True, cancel_futures=True)
+
+
+def find_duplicates(
+    hashes: Union[Mapping[str, VideoHash], Iterable[Tuple[str, VideoHash]]],
+    match_options: Optional[MatchOptions] = None,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    progress: Optional[Callable[[DedupeProgress], None]] = None,
+    checkpoint_path: Optional[str] = None,
+) -> List[List[str]]:
+    """
+    Finds groups of duplicate videos among keyed video hashes, such as a dict or VideoHashLibrary.items(). Returns
+    the keys of each group of two or more videos which are connected by matches, in the order the videos were given.
+
+    Rather than checking every pair of videos, all the video hashes are put in a VideoHashIndex, which shortlists the
+    pairs which could match. Those candidate pairs are checked with the match options in batches, on the given
+    executor, or a process pool of max_workers processes, defaulting to the number of CPUs. With max_workers of 1 and
+    no executor, batches are checked in this process.
+
+    progress is called with a DedupeProgress after each batch is checked. If checkpoint_path is given, the checked
+    batches and matches found are saved there as they complete, and when an interrupted run is repeated with the
+    same video hashes and options, it resumes from there instead of checking those batches again.
+    """
+    match_options = match_options or DEFAULT_MATCH_OPTS
+    items = list(hashes.items() if isinstance(hashes, Mapping) else hashes)
+    keys = [key for key, _ in items]
+    video_hashes = [video_hash.to_packed() for _, video_hash in items]
+    if len(set(keys)) != len(keys):
+        raise ValueError("Video hash keys must be unique")
+    if not items:
+        return []
+    if any(video_hash.hash_options != video_hashes[0].hash_options for video_hash in video_hashes):
+        raise MatchException("Video hashes were not created with the same hash options, so cannot be compared.")
+
+    pairs = _candidate_pairs(video_hashes, match_options)
+    batches = [pairs[start : start + batch_size] for start in range(0, len(pairs), batch_size)]
+    logger.info("Found %s candidate pairs among %s videos, in %s batches", len(pairs), len(items), len(batches))
+    fingerprint = _fingerprint(keys, video_hashes, match_options, batch_size)
+    done_batches: Set[int] = set()
+    matches: List[Tuple[int, int]] = []
+    if checkpoint_path is not None:
+        done_batches, matches = _load_checkpoint(checkpoint_path, fingerprint)
+    checked_pairs = sum(len(batch) for batch_num, batch in enumerate(batches) if batch_num in done_batches)
+    last_checkpoint = time.monotonic()
+
+    def batch_done(batch_num: int, batch_matches: List[Tuple[int, int]]) -> None:
+        nonlocal checked_pairs, last_checkpoint
+        done_batches.add(batch_num)
+        matches.extend(batch_matches)
+        checked_pairs += len(batches[batch_num])
+        if checkpoint_path is not None and time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+            _save_checkpoint(checkpoint_path, fingerprint, done_batches, matches)
+            last_checkpoint = time.monotonic()
+        if progress is not None:
+            progress(DedupeProgress(len(pairs), checked_pairs, len(matches)))
+
+    todo = [batch_num for batch_num in range(len(batches)) if batch_num not in done_batches]
+    max_workers = max_workers or os.cpu_count() or 1
+    try:
+        if executor is None and max_workers == 1:
+            for batch_num in todo:
+                batch = batches[batch_num]
+                batch_done(batch_num, _check_pairs(match_options, batch, _batch_hashes(video_hashes, batch)))
+        else:
+            _check_batches(executor, max_workers, match_options, video_hashes, batches, todo, batch_done)
+    finally:
+        if checkpoint_path is not None:
+            _save_checkpoint(checkpoint_path, fingerprint, done_batches, matches)
+
+    groups = _DisjointSet(len(items))
+    for num1, num2 in matches:
+        groups.union(num1, num2)
+    clusters: Dict[int, List[str]] = {}
+    for num, key in enumerate(keys):
+        clusters.setdefault(groups.find(num), []).append(key)
+    return [cluster for cluster in clusters.values() if len(cluster) > 1]
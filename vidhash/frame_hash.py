@@ -5,6 +5,8 @@ from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     import imagehash
+    import numpy as np
+    import numpy.typing as npt
 
 
 class FrameHash(ABC):
@@ -20,11 +22,22 @@ class FrameHash(ABC):
     def similar_to(self, other: FrameHash, hamming_dist: float) -> bool:
         pass
 
+    @abstractmethod
+    def to_bits(self) -> npt.NDArray[np.bool_]:
+        pass
+
 
 class SimpleImageHash(FrameHash):
     def __init__(self, image_hash: imagehash.ImageHash) -> None:
         self.image_hash = image_hash
 
+    @classmethod
+    def from_bits(cls, bits: npt.NDArray[np.bool_]) -> SimpleImageHash:
+        # imagehash is only imported once frame hashes are needed as objects, as matching works on packed hashes
+        import imagehash
+
+        return cls(imagehash.ImageHash(bits))
+
     def __eq__(self, other: object) -> bool:
         return isinstance(other, SimpleImageHash) and other.image_hash == self.image_hash
 
@@ -35,3 +48,6 @@ class SimpleImageHash(FrameHash):
         if not isinstance(other, SimpleImageHash):
             raise ValueError(f"Can't compare {self.__class__.__name__} with {other.__class__.__name__}")
         return (self.image_hash - other.image_hash) <= hamming_dist
+
+    def to_bits(self) -> npt.NDArray[np.bool_]:
+        return self.image_hash.hash
@@ -1,32 +1,68 @@
 from __future__ import annotations
 
+import asyncio
+import collections
+import collections.abc
+import contextlib
+import dataclasses
 import glob
 import logging
 import os
 import pathlib
+import re
+import shlex
 import shutil
 import subprocess
+import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from multiprocessing.pool import ThreadPool
 from typing import TYPE_CHECKING, TypeVar
 
 import ffmpy3
+import numpy as np
 from PIL import Image
 
+from vidhash.decode_options import DEFAULT_DECODE_OPTS
 from vidhash.hash_options import DEFAULT_HASH_OPTS
+from vidhash.instrumentation import Stage, StageStats, children_cpu_time, current_tracer, record_stage
 from vidhash.match_options import DEFAULT_MATCH_OPTS
+from vidhash.metadata import parse_ffmpeg_log
+from vidhash.packed_hash import PackedFrameHashes, RunLengthFrameHashes, hash_words, pack_frame_hashes
 from vidhash.video_hash import VideoHash
 
 if TYPE_CHECKING:
-    from typing import Dict, List, Optional, Tuple
+    from collections.abc import AsyncGenerator, AsyncIterable, AsyncIterator, Sequence
+    from concurrent.futures import Executor
+    from typing import IO, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple, TypeGuard, Union
 
-    from vidhash.hash_options import HashOptions
+    import numpy.typing as npt
+
+    from vidhash.cache import VideoHashCache
+    from vidhash.decode_options import DecodeOptions
+    from vidhash.frame_hash import FrameHash
+    from vidhash.hash_options import HashOptions, HashSettings
     from vidhash.match_options import MatchOptions
+    from vidhash.metadata import VideoMetadata
+
+    # Videos which are read in and piped to FFmpeg, rather than opened by FFmpeg from a path
+    VideoStream = Union[bytes, bytearray, memoryview, IO[bytes], AsyncIterable[bytes]]
+    VideoSource = Union[str, pathlib.Path, VideoStream]
 
 PathLike = TypeVar("PathLike", str, pathlib.Path)
 
 TEMP_DIR = "vidhash_temp/"
+PIPE_BATCH_SIZE = 32
+# Smaller batches when streaming frame hashes, so that each one is yielded sooner
+STREAM_BATCH_SIZE = 8
+# Size of the chunks piped to FFmpeg's stdin from a video stream
+STDIN_CHUNK_SIZE = 2**20
+
+_OUTPUT_HEADER_PATTERN = re.compile(r"Output #\d+")
+_RAW_STREAM_PATTERN = re.compile(r"Stream #\d+:\d+.*: Video: rawvideo.*?, (\d+)x(\d+)")
+_SHOWINFO_PATTERN = re.compile(r"Parsed_showinfo.* n: *\d+ pts: *-?\d+ pts_time:(-?[\d.]+)")
+# Bytes per pixel of the raw pixel formats which frames can be streamed in
+_PIX_FMT_CHANNELS = {"gray": 1, "rgb24": 3}
 
 logger = logging.getLogger(__name__)
 
@@ -73,11 +109,17 @@ def _cleanup_dir(path: str) -> None:
         pass
 
 
-async def _decompose_video(video_path: PathLike, decompose_path: str, fps: float, max_size: float) -> None:
-    # Convert video and downscale
-    output_path = str(pathlib.Path(TEMP_DIR) / f"{uuid.uuid4()}.mp4")
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _scale_filters(max_size: float, scaler: Optional[str] = None) -> List[str]:
     # Minimum dimension should be scaled down to max_size, if video is at least that big
-    filters = [
+    flags = [] if scaler is None else [f"flags={scaler}"]
+    return [
         "scale="
         + ":".join(
             [
@@ -85,70 +127,764 @@ async def _decompose_video(video_path: PathLike, decompose_path: str, fps: float
                 f"'ih/(min(iw,ih)/min(min(iw,ih),{max_size}))'",
                 "force_original_aspect_ratio=decrease",
             ]
+            + flags
         ),
-        "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        ":".join(["scale=trunc(iw/2)*2", "trunc(ih/2)*2"] + flags),
     ]
+
+
+def _join_options(options: List[str]) -> Optional[str]:
+    return " ".join(options) if options else None
+
+
+def _is_stream(video_source: VideoSource) -> TypeGuard[VideoStream]:
+    return not isinstance(video_source, (str, os.PathLike))
+
+
+def _input_path(video_source: VideoSource) -> str:
+    return "pipe:0" if _is_stream(video_source) else str(video_source)
+
+
+def _source_name(video_source: VideoSource) -> str:
+    # Used in logs and errors, so that the contents of a video stream are never logged
+    return f"<{type(video_source).__name__} stream>" if _is_stream(video_source) else str(video_source)
+
+
+async def _feed_stdin(stdin: asyncio.StreamWriter, video_stream: VideoStream) -> None:
+    """
+    Pipes a video stream to FFmpeg's stdin, a chunk at a time, waiting for FFmpeg to read each chunk before taking the
+    next one from the stream. Closes stdin at the end of the stream, or if reading the stream fails.
+    """
+    try:
+        if isinstance(video_stream, (bytes, bytearray, memoryview)):
+            view = memoryview(video_stream)
+            for start in range(0, len(view), STDIN_CHUNK_SIZE):
+                stdin.write(view[start : start + STDIN_CHUNK_SIZE])
+                await stdin.drain()
+        elif isinstance(video_stream, collections.abc.AsyncIterable):
+            async for chunk in video_stream:
+                stdin.write(chunk)
+                await stdin.drain()
+        else:
+            # Reading a file-like object may block, for example on a network stream, so it is read in a thread
+            while chunk := await asyncio.to_thread(video_stream.read, STDIN_CHUNK_SIZE):
+                stdin.write(chunk)
+                await stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # FFmpeg exits without reading the whole stream if it has all the frames it needs
+        logger.debug("FFmpeg stopped reading the video stream early")
+    finally:
+        stdin.close()
+        with contextlib.suppress(BrokenPipeError, ConnectionResetError):
+            await stdin.wait_closed()
+
+
+async def _decompose_video(
+    video_path: PathLike,
+    decompose_path: str,
+    fps: float,
+    max_size: float,
+    decode_options: DecodeOptions = DEFAULT_DECODE_OPTS,
+) -> Optional[VideoMetadata]:
+    # Convert video and downscale
+    output_path = str(pathlib.Path(TEMP_DIR) / f"{uuid.uuid4()}.mp4")
+    filters = _scale_filters(max_size, decode_options.scaler)
+    encode_options = " ".join(decode_options.intermediate_options())
     os.makedirs(TEMP_DIR, exist_ok=True)
     try:
         logger.debug("Converting and downscaling video %s to %s", video_path, output_path)
-        await _run_ffmpeg(
-            inputs={str(video_path): None},
-            outputs={output_path: f"-vf \"{','.join(filters)}\""},
-        )
+        with Stage("transcode") as transcode_stage:
+            _, convert_log = await _run_ffmpeg(
+                inputs={str(video_path): _join_options(decode_options.input_options())},
+                outputs={output_path: f"-vf \"{','.join(filters)}\" {encode_options}".strip()},
+                global_options=decode_options.global_options() or None,
+            )
+            transcode_stage.stats.bytes_written = _file_size(output_path)
         # Decompose video into frames
         os.makedirs(decompose_path, exist_ok=True)
         logger.debug("Decomposing video (%s) into frames in %s at %s FPS", output_path, decompose_path, fps)
-        await _run_ffmpeg(
-            inputs={output_path: None},
-            outputs={f"{decompose_path}/out%d.png": f"-vf fps={fps} -vsync 0"},
-            global_options=["-y"],
-        )
+        thread_options = [] if decode_options.threads is None else ["-threads", str(decode_options.threads)]
+        with Stage("extract_frames") as extract_stage:
+            await _run_ffmpeg(
+                inputs={output_path: _join_options(thread_options)},
+                outputs={f"{decompose_path}/out%d.png": f"-vf fps={fps} -vsync 0"},
+                global_options=["-y"] + decode_options.global_options(),
+            )
+            if current_tracer() is not None:
+                frame_files = glob.glob(f"{decompose_path}/*.png")
+                extract_stage.stats.frames = len(frame_files)
+                extract_stage.stats.bytes_written = sum(_file_size(path) for path in frame_files)
     finally:
         # Clean up the temporary video file
         _cleanup_file(output_path)
+    # The conversion read the original video, so its log describes it
+    return parse_ffmpeg_log(convert_log.splitlines())
+
+
+class _FFmpegLog:
+    """
+    Reads FFmpeg's stderr, keeping the lines for error messages, and picking out the output frame size and the frame
+    timestamps logged by the showinfo filter.
+    """
+
+    def __init__(self, stream: asyncio.StreamReader) -> None:
+        self.stream = stream
+        self.lines: List[str] = []
+        self.frame_times: List[float] = []
+        self.finished = False
+        self._updated = asyncio.Event()
+
+    async def _read_line(self) -> Optional[str]:
+        line_bytes = await self.stream.readline()
+        if not line_bytes:
+            self.finished = True
+            self._updated.set()
+            return None
+        line = line_bytes.decode("utf-8", errors="replace").rstrip()
+        self.lines.append(line)
+        match = _SHOWINFO_PATTERN.search(line)
+        if match:
+            self.frame_times.append(float(match.group(1)))
+        self._updated.set()
+        return line
+
+    async def read_frame_size(self) -> Optional[Tuple[int, int]]:
+        # FFmpeg logs the output stream description before it writes any frames, which gives the scaled frame size.
+        # Only lines after the output header are searched, as a rawvideo input, such as a Y4M file, is described the
+        # same way with its unscaled size.
+        in_output = False
+        while (line := await self._read_line()) is not None:
+            in_output = in_output or _OUTPUT_HEADER_PATTERN.match(line) is not None
+            match = _RAW_STREAM_PATTERN.search(line) if in_output else None
+            if match:
+                return int(match.group(1)), int(match.group(2))
+        return None
+
+    async def drain(self) -> None:
+        while await self._read_line() is not None:
+            pass
+
+    async def frame_time(self, frame_num: int) -> float:
+        # Filters log each frame before it is written out, so its timestamp will be logged by the time it is read
+        while len(self.frame_times) <= frame_num and not self.finished:
+            self._updated.clear()
+            await self._updated.wait()
+        if len(self.frame_times) <= frame_num:
+            raise ValueError(f"FFmpeg did not log a timestamp for frame {frame_num}")
+        return self.frame_times[frame_num]
+
+
+async def _stream_frames(
+    video_source: VideoSource,
+    filters: List[str],
+    input_options: Optional[List[str]] = None,
+    output_options: Optional[List[str]] = None,
+    frame_times: bool = False,
+    on_metadata: Optional[Callable[[VideoMetadata], None]] = None,
+    decode_options: DecodeOptions = DEFAULT_DECODE_OPTS,
+    pix_fmt: str = "gray",
+) -> AsyncGenerator[Tuple[Optional[float], npt.NDArray[np.uint8]], None]:
+    """
+    Decodes, filters and converts a video to the pixel format in a single FFmpeg process, yielding each frame as a
+    numpy array, shaped (H, W) for "gray" or (H, W, 3) for "rgb24", as it is read from FFmpeg's stdout. Nothing is
+    written to disk. If frame_times is set, each frame is yielded with its timestamp, logged by the showinfo filter,
+    otherwise with None. If on_metadata is given, it is called with the video's metadata from FFmpeg's log, before any
+    frames are yielded.
+    A video stream, rather than a path, is piped to FFmpeg's stdin while the frames are read.
+    """
+    source_name = _source_name(video_source)
+    channels = _PIX_FMT_CHANNELS[pix_fmt]
+    filters = filters + [f"format={pix_fmt}"] + (["showinfo"] if frame_times else [])
+    extra_output_args = " ".join(output_options or [])
+    global_args = ["-hide_banner", "-nostats"] + decode_options.global_options()
+    input_args = _join_options(decode_options.input_options() + (input_options or []))
+    output_args = f"-vf \"{','.join(filters)}\" {extra_output_args} -vsync 0 -f rawvideo -pix_fmt {pix_fmt}"
+    ff = ffmpy3.FFmpeg(
+        global_options=global_args,
+        inputs={_input_path(video_source): input_args},
+        outputs={"pipe:1": output_args},
+    )
+    logger.debug("Streaming frames from video %s: %s", source_name, ff.cmd)
+    traced = current_tracer() is not None
+    start, start_cpu = (time.perf_counter(), children_cpu_time()) if traced else (0.0, 0.0)
+    frame_num = 0
+    feed_task: Optional[asyncio.Task[None]] = None
+    if _is_stream(video_source):
+        # ffmpy3 only writes a whole input to stdin at once, so the same command is started with a pipe to feed instead
+        cmd = [ff.executable, *global_args, *shlex.split(input_args or ""), "-i", "pipe:0"]
+        cmd += [*shlex.split(output_args), "pipe:1"]
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        assert process.stdin is not None
+        feed_task = asyncio.create_task(_feed_stdin(process.stdin, video_source))
+    else:
+        process = await ff.run_async(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.stdout is not None and process.stderr is not None
+    log = _FFmpegLog(process.stderr)
+    drain_task: Optional[asyncio.Task[None]] = None
+    try:
+        frame_size = await log.read_frame_size()
+        drain_task = asyncio.create_task(log.drain())
+        # FFmpeg describes its input before its output, so the metadata has been logged by now
+        metadata = parse_ffmpeg_log(log.lines)
+        if on_metadata is not None and metadata is not None:
+            on_metadata(metadata)
+        if frame_size is not None:
+            width, height = frame_size
+            logger.debug("Frames from video %s will be %sx%s", source_name, width, height)
+            while True:
+                try:
+                    data = await process.stdout.readexactly(width * height * channels)
+                except asyncio.IncompleteReadError as e:
+                    if e.partial:
+                        logger.warning("Discarding %s bytes of incomplete frame from %s", len(e.partial), source_name)
+                    break
+                timestamp = await log.frame_time(frame_num) if frame_times else None
+                frame = np.frombuffer(data, dtype=np.uint8)
+                yield timestamp, frame.reshape((height, width) if channels == 1 else (height, width, channels))
+                frame_num += 1
+        await drain_task
+        if feed_task is not None:
+            # An error reading the video stream explains FFmpeg failing, so is raised first
+            await feed_task
+        exit_code = await process.wait()
+        logger.debug("FF process ended with exit code %s", exit_code)
+        if exit_code != 0:
+            raise ffmpy3.FFRuntimeError(ff.cmd, exit_code, b"", "\n".join(log.lines).encode())
+        if frame_size is None:
+            raise ValueError(f"FFmpeg did not output a video stream for {source_name}")
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        if drain_task is not None and not drain_task.done():
+            drain_task.cancel()
+        if feed_task is not None and not feed_task.done():
+            feed_task.cancel()
+        if traced:
+            duration, cpu_time = time.perf_counter() - start, children_cpu_time() - start_cpu
+            record_stage("decode", StageStats(duration, calls=1, frames=frame_num, cpu_time=cpu_time))
+
+
+async def _sample_frames(
+    video_source: VideoSource,
+    options: HashOptions,
+    on_metadata: Optional[Callable[[VideoMetadata], None]] = None,
+    decode_options: DecodeOptions = DEFAULT_DECODE_OPTS,
+    input_options: Optional[List[str]] = None,
+) -> AsyncGenerator[Tuple[float, npt.NDArray[np.uint8]], None]:
+    """
+    Yields (timestamp, frame) tuples for each frame of the video picked by the hash options' sampling.
+    on_metadata is called with the video's metadata before any frames are yielded. input_options are added to the
+    FFmpeg input's options, such as to decode only part of the video.
+    """
+    scale_filters = _scale_filters(options.settings.get_video_size(), decode_options.scaler)
+    pix_fmt = options.settings.pix_fmt
+    sampling = options.sampling
+    if sampling is None:
+        frame_num = 0
+        frames = _stream_frames(
+            video_source,
+            [f"fps={options.fps}"] + scale_filters,
+            input_options,
+            on_metadata=on_metadata,
+            decode_options=decode_options,
+            pix_fmt=pix_fmt,
+        )
+        async with contextlib.aclosing(frames):
+            async for _, frame in frames:
+                yield frame_num / options.fps, frame
+                frame_num += 1
+        return
+    if sampling.seeks:
+        if not isinstance(video_source, (str, os.PathLike)):
+            raise ValueError(f"{sampling} seeks to each frame, so it needs a video file rather than a video stream")
+        if input_options:
+            raise ValueError(f"{sampling} seeks to each frame, so it can't be used to hash part of a video")
+        video_path = str(video_source)
+        # Seek times depend on the video length, so the video needs probing first
+        metadata = await _probe_metadata(video_path)
+        if on_metadata is not None:
+            on_metadata(metadata)
+        video_length = metadata.duration if metadata.duration is not None else await _video_length(video_path)
+        seek_times = sampling.seek_times(video_length) or []
+        # Each frame is taken by a separate FFmpeg process, which seeks straight to it
+        for seek_time in seek_times:
+            input_options = sampling.input_options() + ["-ss", str(seek_time)]
+            frames = _stream_frames(
+                video_path,
+                scale_filters,
+                input_options,
+                ["-frames:v", "1"],
+                decode_options=decode_options,
+                pix_fmt=pix_fmt,
+            )
+            async with contextlib.aclosing(frames):
+                async for _, frame in frames:
+                    yield seek_time, frame
+        return
+    frames = _stream_frames(
+        video_source,
+        sampling.filters() + scale_filters,
+        sampling.input_options() + (input_options or []),
+        frame_times=True,
+        on_metadata=on_metadata,
+        decode_options=decode_options,
+        pix_fmt=pix_fmt,
+    )
+    async with contextlib.aclosing(frames):
+        async for timestamp, frame in frames:
+            assert timestamp is not None
+            yield timestamp, frame
+
+
+def _hash_frames(
+    settings: HashSettings, frames: List[npt.NDArray[np.uint8]]
+) -> Tuple[npt.NDArray[np.uint64], Optional[npt.NDArray[np.uint64]], float]:
+    """
+    Hashes a batch of frames, returning the packed frame hashes, the packed coarse hashes if the settings compute
+    them, and the time taken. Hashing runs on the executor, where the tracer is not available, so the time is
+    returned with the hashes.
+    """
+    start = time.perf_counter()
+    stacked = np.stack(frames)
+    hashes = settings.hash_batch(stacked)
+    coarse_settings = settings.coarse_settings
+    coarse_hashes = None if coarse_settings is None else coarse_settings.hash_batch(stacked)
+    return hashes, coarse_hashes, time.perf_counter() - start
+
+
+def _hash_image_files(
+    settings: HashSettings, image_files: List[str]
+) -> Tuple[List[FrameHash], Optional[npt.NDArray[np.uint64]], float]:
+    start = time.perf_counter()
+    images = [Image.open(image_path) for image_path in image_files]
+    hashes = [settings.hash_image(image) for image in images]
+    coarse_settings = settings.coarse_settings
+    coarse_hashes = None
+    if coarse_settings is not None:
+        coarse_list = [coarse_settings.hash_image(image) for image in images]
+        coarse_hashes = pack_frame_hashes(coarse_list, coarse_settings.hash_shape)
+    return hashes, coarse_hashes, time.perf_counter() - start
+
+
+def _join_coarse_hashes(
+    options: HashOptions, batches: List[Optional[npt.NDArray[np.uint64]]]
+) -> Optional[PackedFrameHashes]:
+    coarse_settings = options.settings.coarse_settings
+    if coarse_settings is None:
+        return None
+    coarse_shape = coarse_settings.hash_shape
+    arrays = [batch for batch in batches if batch is not None]
+    packed = np.concatenate(arrays) if arrays else np.zeros((0, hash_words(coarse_shape)), dtype=np.uint64)
+    return PackedFrameHashes(packed, coarse_shape)
+
+
+def _record_hashing(frame_count: int, duration: float) -> None:
+    record_stage("hash_frames", StageStats(duration, calls=1, frames=frame_count))
+
+
+async def _iter_hash_batches(
+    video_source: VideoSource,
+    options: HashOptions,
+    executor: Optional[Executor] = None,
+    batch_size: int = PIPE_BATCH_SIZE,
+    on_metadata: Optional[Callable[[VideoMetadata], None]] = None,
+    decode_options: DecodeOptions = DEFAULT_DECODE_OPTS,
+    input_options: Optional[List[str]] = None,
+) -> AsyncGenerator[Tuple[List[float], npt.NDArray[np.uint64], Optional[npt.NDArray[np.uint64]]], None]:
+    """
+    Streams sampled frames from the video and hashes them in batches on the executor, while FFmpeg carries on
+    decoding. Yields the timestamps, packed hashes and packed coarse hashes, if any, of each batch, in order, as soon
+    as they are ready.
+    """
+    loop = asyncio.get_running_loop()
+    pending: Deque[
+        Tuple[List[float], asyncio.Future[Tuple[npt.NDArray[np.uint64], Optional[npt.NDArray[np.uint64]], float]]]
+    ] = collections.deque()
+    timestamps: List[float] = []
+    batch: List[npt.NDArray[np.uint8]] = []
+    try:
+        async with contextlib.aclosing(
+            _sample_frames(video_source, options, on_metadata, decode_options, input_options)
+        ) as frames:
+            async for timestamp, frame in frames:
+                timestamps.append(timestamp)
+                batch.append(frame)
+                if len(batch) >= batch_size:
+                    pending.append((timestamps, loop.run_in_executor(executor, _hash_frames, options.settings, batch)))
+                    timestamps, batch = [], []
+                while pending and pending[0][1].done():
+                    batch_times, future = pending.popleft()
+                    hashes, coarse_hashes, duration = future.result()
+                    _record_hashing(len(hashes), duration)
+                    yield batch_times, hashes, coarse_hashes
+        if batch:
+            pending.append((timestamps, loop.run_in_executor(executor, _hash_frames, options.settings, batch)))
+        while pending:
+            batch_times, future = pending.popleft()
+            hashes, coarse_hashes, duration = await future
+            _record_hashing(len(hashes), duration)
+            yield batch_times, hashes, coarse_hashes
+    finally:
+        for _, future in pending:
+            future.cancel()
+
+
+def _decoded_length(options: HashOptions, frame_count: int, last_time: Optional[float]) -> float:
+    """
+    Estimates the length of a video from the frames sampled from it, for when FFmpeg's log doesn't give it
+    """
+    if options.fixed_rate:
+        return frame_count / options.fps
+    return last_time or 0.0
+
+
+async def _hash_frame_stream(
+    video_source: VideoSource,
+    options: HashOptions,
+    decode_options: DecodeOptions = DEFAULT_DECODE_OPTS,
+    executor: Optional[Executor] = None,
+    input_options: Optional[List[str]] = None,
+) -> Tuple[Sequence[FrameHash], Optional[PackedFrameHashes], Optional[VideoMetadata], float]:
+    """
+    Hashes all the sampled frames of a video, returning the frame hashes, coarse hashes, metadata, and the length of
+    the video estimated from the decoded frames
+    """
+    hash_shape = options.settings.hash_shape
+    metadata: List[VideoMetadata] = []
+    batches = _iter_hash_batches(
+        video_source,
+        options,
+        executor,
+        on_metadata=metadata.append,
+        decode_options=decode_options,
+        input_options=input_options,
+    )
+    hashes = []
+    runs = []
+    coarse_batches = []
+    frame_count = 0
+    last_time = None
+    async for timestamps, batch, coarse_batch in batches:
+        frame_count += len(timestamps)
+        last_time = timestamps[-1]
+        if decode_options.run_length:
+            # Encode each batch as it arrives, so the hashes of every frame are never all held at once
+            runs.append(RunLengthFrameHashes.from_packed(batch, hash_shape))
+        else:
+            hashes.append(batch)
+        coarse_batches.append(coarse_batch)
+    coarse_hashes = _join_coarse_hashes(options, coarse_batches)
+    frame_hashes: Sequence[FrameHash]
+    if decode_options.run_length:
+        frame_hashes = RunLengthFrameHashes.concatenate(runs, hash_shape)
+    else:
+        packed = np.concatenate(hashes) if hashes else np.zeros((0, hash_words(hash_shape)), dtype=np.uint64)
+        frame_hashes = PackedFrameHashes(packed, hash_shape)
+    decoded_length = _decoded_length(options, frame_count, last_time)
+    return frame_hashes, coarse_hashes, metadata[0] if metadata else None, decoded_length
+
+
+async def iter_frame_hashes(
+    video_source: VideoSource,
+    hash_options: Optional[HashOptions] = None,
+    decode_options: Optional[DecodeOptions] = None,
+    executor: Optional[Executor] = None,
+) -> AsyncGenerator[Tuple[float, FrameHash], None]:
+    """
+    Hashes a video, yielding (timestamp, frame_hash) tuples as FFmpeg decodes the frames, rather than waiting for the
+    whole video. Frames are streamed from FFmpeg in memory, and decoding stops if the iterator is closed early.
+    The video can be a path, or a video stream, as accepted by hash_video().
+    """
+    options = hash_options or DEFAULT_HASH_OPTS
+    hash_shape = options.settings.hash_shape
+    batches = _iter_hash_batches(
+        video_source, options, executor, STREAM_BATCH_SIZE, decode_options=decode_options or DEFAULT_DECODE_OPTS
+    )
+    async with contextlib.aclosing(batches):
+        async for timestamps, batch, _ in batches:
+            for timestamp, frame_hash in zip(timestamps, PackedFrameHashes(batch, hash_shape)):
+                yield timestamp, frame_hash
+
+
+async def match_video(
+    video_source: VideoSource,
+    reference: VideoHash,
+    match_options: Optional[MatchOptions] = None,
+    decode_options: Optional[DecodeOptions] = None,
+    executor: Optional[Executor] = None,
+) -> bool:
+    """
+    Checks whether a video matches a reference video hash, giving the same result as hashing the video and calling
+    match_options.check_match(video_hash, reference). Frames are hashed as FFmpeg decodes them, and decoding stops as
+    soon as a match is certain. The video can be a path, or a video stream, as accepted by hash_video().
+    """
+    match_options = match_options or DEFAULT_MATCH_OPTS
+    options = reference.hash_options
+    matcher = match_options.incremental_matcher(reference)
+
+    def on_metadata(metadata: VideoMetadata) -> None:
+        # Knowing the video length lets the matcher decide sooner
+        matcher.video_length = metadata.duration
+
+    batches = _iter_hash_batches(
+        video_source, options, executor, STREAM_BATCH_SIZE, on_metadata, decode_options or DEFAULT_DECODE_OPTS
+    )
+    last_time = None
+    async with contextlib.aclosing(batches):
+        async for timestamps, batch, coarse_batch in batches:
+            last_time = timestamps[-1]
+            with Stage("match"):
+                matcher.add_packed(batch, coarse_batch)
+            if matcher.decided:
+                logger.info("Video %s matched after %s frames", _source_name(video_source), matcher.frame_count)
+                return True
+    if matcher.video_length is None:
+        decoded_length = _decoded_length(options, matcher.frame_count, last_time)
+        matcher.video_length = await _metadata_video_length(video_source, None, decoded_length)
+    return matcher.finish()
+
+
+async def _probe_metadata(video_path: PathLike) -> VideoMetadata:
+    """
+    Reads the video's metadata with FFmpeg, without decoding any frames
+    """
+    ff = ffmpy3.FFmpeg(
+        global_options=["-hide_banner", "-nostats"],
+        inputs={str(video_path): None},
+        outputs={"-": "-map 0:v:0 -frames:v 0 -f null"},
+    )
+    logger.debug("Probing video %s: %s", video_path, ff.cmd)
+    with Stage("probe"):
+        process = await ff.run_async(stderr=subprocess.PIPE)
+        _, err_bytes = await process.communicate()
+        exit_code = await process.wait()
+    metadata = parse_ffmpeg_log(err_bytes.decode("utf-8", errors="replace").splitlines())
+    if exit_code != 0 or metadata is None:
+        raise ffmpy3.FFRuntimeError(ff.cmd, exit_code, b"", err_bytes)
+    return metadata
 
 
 async def _video_length(video_path: PathLike) -> float:
     logger.debug("Getting length of video %s", video_path)
-    out, err = await _run_ffprobe(
-        inputs={str(video_path): "-show_entries format=duration -of default=noprint_wrappers=1:nokey=1"},
-        global_options=["-v error"],
-    )
+    with Stage("video_length"):
+        out, err = await _run_ffprobe(
+            inputs={str(video_path): "-show_entries format=duration -of default=noprint_wrappers=1:nokey=1"},
+            global_options=["-v error"],
+        )
     logger.debug("Length of video %s is: %s", video_path, out)
     return float(out)
 
 
-async def hash_video(video_path: PathLike, hash_options: Optional[HashOptions] = None) -> VideoHash:
+async def _metadata_video_length(
+    video_source: VideoSource, metadata: Optional[VideoMetadata], decoded_length: Optional[float] = None
+) -> float:
+    # FFmpeg's log gives the duration while decoding, so FFprobe is only needed if it couldn't.
+    # A video stream can't be read again to probe it, so its length is estimated from the decoded frames instead.
+    if metadata is not None and metadata.duration is not None:
+        video_length = metadata.duration
+    elif _is_stream(video_source) and decoded_length is not None:
+        video_length = decoded_length
+    else:
+        video_length = await _video_length(_input_path(video_source))
+    logger.info("Got video length: %s (%s)", video_length, _source_name(video_source))
+    return video_length
+
+
+async def hash_video(
+    video_path: VideoSource,
+    hash_options: Optional[HashOptions] = None,
+    decode_options: Optional[DecodeOptions] = None,
+    executor: Optional[Executor] = None,
+) -> VideoHash:
+    """
+    Hashes a video. Frames are hashed on the given executor, or the event loop's default executor if none is given.
+
+    Rather than a path, the video can be given as a video stream: bytes, a binary file-like object, or an async
+    iterable of bytes, such as an upload still arriving. The stream is piped to FFmpeg as it is read, without being
+    written to disk, and the frames are always decoded straight into memory.
+    """
     options = hash_options or DEFAULT_HASH_OPTS
-    logger.info("Hashing video: %s with options: %s", video_path, hash_options)
-    # Get video length
-    video_length = await _video_length(video_path)
-    logger.info("Got video length: %s (%s)", video_length, video_path)
+    decode_opts = decode_options or DEFAULT_DECODE_OPTS
+    logger.info("Hashing video: %s with options: %s", _source_name(video_path), hash_options)
+    if decode_opts.pipe_frames or not options.fixed_rate or not isinstance(video_path, (str, os.PathLike)):
+        # Decode straight into memory and hash frames as they arrive, which video streams always are
+        packed_hashes, coarse_hashes, metadata, decoded_length = await _hash_frame_stream(
+            video_path, options, decode_opts, executor
+        )
+        video_length = await _metadata_video_length(video_path, metadata, decoded_length)
+        video_hash = VideoHash(packed_hashes, video_length, options, metadata, coarse_hashes)
+        video_hash.signature = video_hash.compute_signature()
+        return video_hash
     # Decompose into images
     video_id = str(uuid.uuid4())
     decompose_path = str(pathlib.Path(TEMP_DIR) / video_id)
     try:
-        await _decompose_video(video_path, decompose_path, options.fps, options.settings.get_video_size())
+        metadata = await _decompose_video(
+            str(video_path), decompose_path, options.fps, options.settings.get_video_size(), decode_opts
+        )
         # Hash images
         image_files = glob.glob(f"{decompose_path}/*.png")
         # Sort by filename number, stripping "out" prefix and extension
         image_files.sort(key=lambda f: int(os.path.basename(f).split(".")[0][3:]))
-        hash_pool = ThreadPool(os.cpu_count())
-        hash_list = hash_pool.map(lambda image_path: options.settings.hash_image(Image.open(image_path)), image_files)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *[
+                loop.run_in_executor(
+                    executor, _hash_image_files, options.settings, image_files[i : i + PIPE_BATCH_SIZE]
+                )
+                for i in range(0, len(image_files), PIPE_BATCH_SIZE)
+            ]
+        )
     finally:
         _cleanup_dir(decompose_path)
+    for batch, _, duration in results:
+        _record_hashing(len(batch), duration)
+    video_length = await _metadata_video_length(video_path, metadata)
     # Create VideoHash and return
-    return VideoHash(hash_list, video_length, options)
+    hash_list: Sequence[FrameHash] = [frame_hash for batch, _, _ in results for frame_hash in batch]
+    if decode_opts.run_length:
+        hash_list = RunLengthFrameHashes.from_frame_hashes(hash_list, options.settings.hash_shape)
+    coarse_hashes = _join_coarse_hashes(options, [coarse_batch for _, coarse_batch, _ in results])
+    video_hash = VideoHash(hash_list, video_length, options, metadata, coarse_hashes)
+    video_hash.signature = video_hash.compute_signature()
+    return video_hash
+
+
+async def hash_video_range(
+    video_source: VideoSource,
+    start: float = 0,
+    end: Optional[float] = None,
+    hash_options: Optional[HashOptions] = None,
+    decode_options: Optional[DecodeOptions] = None,
+    executor: Optional[Executor] = None,
+) -> VideoHash:
+    """
+    Hashes the part of a video from start to end seconds, or to the end of the video, decoding only that part.
+    Frames are taken at the same times as when hashing the whole video, so long as start is a multiple of 1/fps, such
+    as the next_frame_time of a hash of the video so far. The video hash's length is the length of the part hashed.
+    """
+    options = hash_options or DEFAULT_HASH_OPTS
+    decode_opts = decode_options or DEFAULT_DECODE_OPTS
+    if start < 0 or (end is not None and end <= start):
+        raise ValueError(f"Invalid range of video to hash: {start} to {end}")
+    logger.info("Hashing video: %s from %s to %s with options: %s", _source_name(video_source), start, end, options)
+    input_options = ["-ss", str(start)] + ([] if end is None else ["-t", str(end - start)])
+    frame_hashes, coarse_hashes, metadata, decoded_length = await _hash_frame_stream(
+        video_source, options, decode_opts, executor, input_options
+    )
+    # The duration FFmpeg logs is of the whole video, which a growing recording may not have yet
+    if metadata is not None and metadata.duration is not None:
+        video_end = metadata.duration if end is None else min(metadata.duration, end)
+        video_length = max(video_end - start, 0.0)
+    else:
+        video_length = decoded_length
+    if metadata is not None:
+        metadata = dataclasses.replace(metadata, duration=video_length)
+    video_hash = VideoHash(frame_hashes, video_length, options, metadata, coarse_hashes)
+    video_hash.signature = video_hash.compute_signature()
+    return video_hash
+
+
+async def append_video(
+    video_hash: VideoHash,
+    video_source: VideoSource,
+    segment: bool = False,
+    end: Optional[float] = None,
+    decode_options: Optional[DecodeOptions] = None,
+    executor: Optional[Executor] = None,
+) -> VideoHash:
+    """
+    Hashes the next part of a video, and returns the video hash of the video so far with the new frames appended.
+
+    For a growing video, such as a live recording, video_source is the whole video, which is hashed from where the
+    video hash ends, to end seconds or to the end of the video. With segment set, video_source is the next segment
+    file of a segmented video, such as an HLS or DASH segment, which is hashed from the time of its first frame on,
+    so that frames stay evenly spaced across segment boundaries.
+    """
+    start = video_hash.next_frame_time
+    if segment:
+        start = max(start - video_hash.video_length, 0.0)
+    new_part = await hash_video_range(video_source, start, end, video_hash.hash_options, decode_options, executor)
+    return video_hash.append(new_part)
+
+
+async def hash_videos(
+    video_paths: Iterable[PathLike],
+    hash_options: Optional[HashOptions] = None,
+    decode_options: Optional[DecodeOptions] = None,
+    max_workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    cache: Optional[VideoHashCache] = None,
+    return_exceptions: bool = False,
+) -> AsyncIterator[Tuple[PathLike, Union[VideoHash, BaseException]]]:
+    """
+    Hashes many videos concurrently, yielding (video_path, video_hash) tuples in the order the videos finish.
+
+    At most max_workers videos are decoded at once, defaulting to the number of CPUs, and video paths are only taken
+    from the iterable as slots free up. Frames from all the videos are hashed on one shared executor: the given one,
+    or a process pool of max_workers processes which is shut down once all the videos are hashed.
+    If return_exceptions is set, a video which fails to hash is yielded with the exception instead of its hash,
+    otherwise the exception is raised and the remaining videos are cancelled.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    hash_func = hash_video if cache is None else cache.hash_video
+    own_executor = executor is None
+    hash_executor = executor or ProcessPoolExecutor(max_workers)
+    path_iter = iter(video_paths)
+    running: Dict[asyncio.Task[VideoHash], PathLike] = {}
+
+    def start_next() -> None:
+        for video_path in path_iter:
+            task = asyncio.create_task(hash_func(video_path, hash_options, decode_options, hash_executor))
+            running[task] = video_path
+            return
+
+    try:
+        for _ in range(max_workers):
+            start_next()
+        while running:
+            done: Set[asyncio.Task[VideoHash]]
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                video_path = running.pop(task)
+                start_next()
+                try:
+                    video_hash = task.result()
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    logger.warning("Failed to hash video %s: %s", video_path, e)
+                    yield video_path, e
+                else:
+                    yield video_path, video_hash
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        if own_executor:
+            # Waiting for the worker processes to exit blocks, so is done off the event loop
+            await asyncio.to_thread(hash_executor.shutdown, wait=True, cancel_futures=True)
 
 
 @dataclass(eq=True, frozen=True)
 class CheckOptions:
     hash_options: HashOptions = DEFAULT_HASH_OPTS
     match_options: MatchOptions = DEFAULT_MATCH_OPTS
+    decode_options: DecodeOptions = DEFAULT_DECODE_OPTS
 
 
-async def check_match(video_path_1: PathLike, video_path_2: PathLike, options: Optional[CheckOptions] = None) -> bool:
+async def check_match(
+    video_path_1: PathLike,
+    video_path_2: PathLike,
+    options: Optional[CheckOptions] = None,
+    cache: Optional[VideoHashCache] = None,
+) -> bool:
     options = options or CheckOptions(DEFAULT_HASH_OPTS, DEFAULT_MATCH_OPTS)
-    hash1 = await hash_video(video_path_1, options.hash_options)
-    hash2 = await hash_video(video_path_2, options.hash_options)
+    hash_func = hash_video if cache is None else cache.hash_video
+    hash1 = await hash_func(video_path_1, options.hash_options, options.decode_options)
+    hash2 = await hash_func(video_path_2, options.hash_options, options.decode_options)
     return options.match_options.check_match(hash1, hash2)
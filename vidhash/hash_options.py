@@ -1,23 +1,52 @@
 from __future__ import annotations
 
+import dataclasses
+import functools
+import math
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Dict, Type
 
-import imagehash
 import numpy as np
 
 from vidhash.frame_hash import SimpleImageHash
+from vidhash.packed_hash import pack_bits
+from vidhash.resample import resize_lanczos
+from vidhash.sampling import Sampling
 
 if TYPE_CHECKING:
-    from typing import Optional
+    from typing import Optional, Tuple
 
+    import numpy.typing as npt
     from PIL.Image import Image
 
     from vidhash.frame_hash import FrameHash
 
 
+_HASH_SETTINGS_TYPES: Dict[str, Type[HashSettings]] = {}
+
+
 class HashSettings(ABC):
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        _HASH_SETTINGS_TYPES[cls.__name__] = cls
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Describes these settings as JSON-compatible data, so they can be stored alongside hashes
+        """
+        if not dataclasses.is_dataclass(self):
+            raise TypeError(f"{self.__class__.__name__} must be a dataclass to be serialised")
+        fields = {field.name: _option_to_json(getattr(self, field.name)) for field in dataclasses.fields(self)}
+        return {"type": self.__class__.__name__, **fields}
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> HashSettings:
+        settings_type = _HASH_SETTINGS_TYPES.get(data["type"])
+        if settings_type is None:
+            raise ValueError(f"Unknown hash settings type: {data['type']}")
+        return settings_type(**{key: _option_from_json(value) for key, value in data.items() if key != "type"})
+
     @abstractmethod
     def get_video_size(self) -> int:
         pass
@@ -27,10 +56,86 @@ class HashSettings(ABC):
     def blank_hash(self) -> FrameHash:
         pass
 
+    @property
+    @abstractmethod
+    def hash_shape(self) -> Tuple[int, ...]:
+        pass
+
+    @property
+    def blank_bits(self) -> npt.NDArray[np.bool_]:
+        """
+        The bits of blank_hash. Settings should override this where they can give the bits directly, so that matching
+        doesn't need to create the frame hash.
+        """
+        return self.blank_hash.to_bits()
+
+    @property
+    def packed_blank_hash(self) -> npt.NDArray[np.uint64]:
+        return pack_bits(self.blank_bits[np.newaxis])[0]
+
+    @property
+    def pix_fmt(self) -> str:
+        """
+        The FFmpeg pixel format of the frames given to hash_batch(), either "gray" or "rgb24"
+        """
+        return "gray"
+
+    @property
+    def coarse_settings(self) -> Optional[HashSettings]:
+        """
+        Settings for a cheaper, lower resolution hash of each frame, computed from the same frames alongside the frame
+        hashes and stored as the video hash's coarse_hashes, if these settings have one
+        """
+        return None
+
     @abstractmethod
     def hash_image(self, img: Image) -> FrameHash:
         pass
 
+    def hash_batch(self, frames: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint64]:
+        """
+        Hashes a stack of frames, shaped (N, H, W) for greyscale or (N, H, W, 3) for RGB depending on pix_fmt,
+        returning the packed hashes as a (N, words) uint64 array. Subclasses should override this with a vectorised
+        implementation where they can.
+        """
+        import PIL.Image
+
+        bits = [self.hash_image(PIL.Image.fromarray(frame)).to_bits() for frame in frames]
+        return pack_bits(np.array(bits, dtype=bool).reshape(len(frames), *self.hash_shape))
+
+
+def _option_to_json(value: Any) -> Any:
+    if isinstance(value, HashSettings):
+        return value.to_dict()
+    if isinstance(value, tuple):
+        return [_option_to_json(item) for item in value]
+    return value
+
+
+def _option_from_json(value: Any) -> Any:
+    if isinstance(value, dict):
+        return HashSettings.from_dict(value)
+    if isinstance(value, list):
+        # Options are frozen dataclasses, so sequences are stored as tuples
+        return tuple(_option_from_json(item) for item in value)
+    return value
+
+
+def _default_video_size(hash_size: int, video_size: Optional[int]) -> int:
+    if video_size is None:
+        return hash_size * 25
+    return video_size
+
+
+def _zero_bits(shape: Tuple[int, ...]) -> npt.NDArray[np.bool_]:
+    return np.zeros(shape, dtype=bool)
+
+
+def _median_threshold(values: npt.NDArray[np.float64]) -> npt.NDArray[np.bool_]:
+    # Compares each frame's values to that frame's median
+    median = np.median(values.reshape(len(values), -1), axis=1)
+    return np.asarray(values > median.reshape((-1,) + (1,) * (values.ndim - 1)), dtype=bool)
+
 
 @dataclass(eq=True, frozen=True)
 class DHash(HashSettings):
@@ -38,22 +143,364 @@ class DHash(HashSettings):
     video_size: Optional[int] = None
 
     def hash_image(self, img: Image) -> FrameHash:
+        import imagehash
+
         return SimpleImageHash(imagehash.dhash(img, hash_size=self.hash_size))
 
+    def hash_batch(self, frames: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint64]:
+        pixels = resize_lanczos(frames, self.hash_size + 1, self.hash_size)
+        return pack_bits(pixels[:, :, 1:] > pixels[:, :, :-1])
+
+    @property
+    def hash_shape(self) -> Tuple[int, ...]:
+        return self.hash_size, self.hash_size
+
+    def get_video_size(self) -> int:
+        return _default_video_size(self.hash_size, self.video_size)
+
+    @property
+    def blank_bits(self) -> npt.NDArray[np.bool_]:
+        return _zero_bits(self.hash_shape)
+
+    @property
+    def blank_hash(self) -> FrameHash:
+        return SimpleImageHash.from_bits(self.blank_bits)
+
+
+@dataclass(eq=True, frozen=True)
+class AHash(HashSettings):
+    """
+    Average hash, which sets bits for pixels brighter than the mean, after shrinking frames to hash_size square. The
+    cheapest hash to compute, but the least robust, so mostly useful for pre-filtering.
+    """
+
+    hash_size: int = 8
+    video_size: Optional[int] = None
+
+    def hash_image(self, img: Image) -> FrameHash:
+        import imagehash
+
+        return SimpleImageHash(imagehash.average_hash(img, hash_size=self.hash_size))
+
+    def hash_batch(self, frames: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint64]:
+        pixels = resize_lanczos(frames, self.hash_size, self.hash_size)
+        return pack_bits(pixels > pixels.mean(axis=(1, 2), keepdims=True))
+
+    @property
+    def hash_shape(self) -> Tuple[int, ...]:
+        return self.hash_size, self.hash_size
+
+    def get_video_size(self) -> int:
+        return _default_video_size(self.hash_size, self.video_size)
+
+    @property
+    def blank_bits(self) -> npt.NDArray[np.bool_]:
+        return _zero_bits(self.hash_shape)
+
+    @property
+    def blank_hash(self) -> FrameHash:
+        return SimpleImageHash.from_bits(self.blank_bits)
+
+
+# DCT coefficients this small relative to a frame's largest are rounding errors of coefficients which should be zero
+DCT_TOLERANCE = 1e-9
+
+
+@functools.lru_cache(maxsize=16)
+def _dct_matrix(size: int, count: int) -> npt.NDArray[np.float64]:
+    """
+    Returns the first count rows of the unnormalised type II DCT matrix, as used by scipy.fftpack.dct()
+    """
+    k = np.arange(count)[:, np.newaxis]
+    n = np.arange(size)[np.newaxis, :]
+    return 2 * np.cos(np.pi * k * (2 * n + 1) / (2 * size))
+
+
+@dataclass(eq=True, frozen=True)
+class PHash(HashSettings):
+    """
+    Perceptual hash, which sets bits for the low frequency DCT coefficients above their median, after shrinking
+    frames to hash_size * highfreq_factor square. More robust to re-encoding and brightness changes than DHash.
+    """
+
+    hash_size: int = 8
+    highfreq_factor: int = 4
+    video_size: Optional[int] = None
+
+    def hash_image(self, img: Image) -> FrameHash:
+        import imagehash
+
+        return SimpleImageHash(imagehash.phash(img, hash_size=self.hash_size, highfreq_factor=self.highfreq_factor))
+
+    def hash_batch(self, frames: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint64]:
+        img_size = self.hash_size * self.highfreq_factor
+        pixels = resize_lanczos(frames, img_size, img_size).astype(np.float64)
+        # Only the low frequencies are kept, so only those rows of the DCT need computing, along each axis
+        dct = _dct_matrix(img_size, self.hash_size)
+        coefficients = dct @ pixels @ dct.T
+        # Coefficients which should be exactly zero, such as all but the first for a flat frame, come out as rounding
+        # noise either side of zero, and would otherwise set bits at random compared to the median of zero
+        scale = np.abs(coefficients).max(axis=(1, 2), keepdims=True)
+        coefficients[np.abs(coefficients) <= scale * DCT_TOLERANCE] = 0
+        return pack_bits(_median_threshold(coefficients))
+
+    @property
+    def hash_shape(self) -> Tuple[int, ...]:
+        return self.hash_size, self.hash_size
+
+    def get_video_size(self) -> int:
+        return _default_video_size(self.hash_size, self.video_size)
+
+    @property
+    def blank_bits(self) -> npt.NDArray[np.bool_]:
+        return _zero_bits(self.hash_shape)
+
+    @property
+    def blank_hash(self) -> FrameHash:
+        return SimpleImageHash.from_bits(self.blank_bits)
+
+
+@dataclass(eq=True, frozen=True)
+class WHash(HashSettings):
+    """
+    Wavelet hash, which sets bits for the low frequency wavelet coefficients above their median, after shrinking
+    frames to image_scale square. image_scale defaults to the largest power of 2 which fits in the frame, and
+    hash_size and image_scale must be powers of 2. Batches are only vectorised for the default "haar" mode, and may
+    differ from hash_image() in rare bits where coefficients tie with the median, due to float rounding.
+    """
+
+    hash_size: int = 8
+    image_scale: Optional[int] = None
+    mode: str = "haar"
+    remove_max_haar_ll: bool = True
+    video_size: Optional[int] = None
+
+    def hash_image(self, img: Image) -> FrameHash:
+        import imagehash
+
+        return SimpleImageHash(
+            imagehash.whash(img, self.hash_size, self.image_scale, self.mode, self.remove_max_haar_ll)
+        )
+
+    def _frame_scale(self, height: int, width: int) -> int:
+        if self.image_scale is not None:
+            return self.image_scale
+        return max(2 ** int(math.log2(min(height, width))), self.hash_size)
+
+    def hash_batch(self, frames: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint64]:
+        if self.mode != "haar" or len(frames) == 0:
+            return super().hash_batch(frames)
+        scale = self._frame_scale(frames.shape[1], frames.shape[2])
+        pixels = resize_lanczos(frames, scale, scale).astype(np.float64) / 255
+        if self.remove_max_haar_ll:
+            # Zeroing the lowest frequency of a full Haar decomposition just removes the mean
+            pixels -= pixels.mean(axis=(1, 2), keepdims=True)
+        # Each level of the Haar transform halves the sum of each 2x2 block, so the approximation coefficients are
+        # the sums of each block of pixels, divided by the block size
+        block = scale // self.hash_size
+        blocks = pixels.reshape(len(pixels), self.hash_size, block, self.hash_size, block)
+        return pack_bits(_median_threshold(blocks.sum(axis=(2, 4)) / block))
+
+    @property
+    def hash_shape(self) -> Tuple[int, ...]:
+        return self.hash_size, self.hash_size
+
+    def get_video_size(self) -> int:
+        return _default_video_size(self.hash_size, self.video_size)
+
+    @property
+    def blank_bits(self) -> npt.NDArray[np.bool_]:
+        return _zero_bits(self.hash_shape)
+
+    @property
+    def blank_hash(self) -> FrameHash:
+        return SimpleImageHash.from_bits(self.blank_bits)
+
+
+def _rgb_to_luma(frames: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint8]:
+    # Pillow's fixed point ITU-R 601-2 conversion from RGB to "L"
+    rgb = frames.astype(np.uint32)
+    luma = (rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16
+    return luma.astype(np.uint8)
+
+
+def _rgb_to_hue_saturation(frames: npt.NDArray[np.uint8]) -> Tuple[npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+    """
+    Converts RGB frames to hue and saturation, with the same mix of single and double precision arithmetic as
+    Pillow's conversion to "HSV", so the results are identical
+    """
+    r, g, b = (frames[..., channel].astype(np.int64) for channel in range(3))
+    max_c = np.maximum(np.maximum(r, g), b)
+    min_c = np.minimum(np.minimum(r, g), b)
+    grey = max_c == min_c
+    chroma = np.where(grey, 1, max_c - min_c).astype(np.float32)
+    saturation = chroma / np.where(max_c == 0, 1, max_c).astype(np.float32)
+    rc, gc, bc = ((max_c - channel).astype(np.float32) / chroma for channel in (r, g, b))
+    hue = np.where(
+        r == max_c,
+        bc - gc,
+        np.where(g == max_c, 2.0 + rc.astype(np.float64) - bc, 4.0 + gc.astype(np.float64) - rc).astype(np.float32),
+    )
+    hue = np.fmod(hue.astype(np.float64) / 6.0 + 1.0, 1.0).astype(np.float32)
+    hue_int = np.where(grey, 0, np.clip((hue.astype(np.float64) * 255.0).astype(np.int64), 0, 255))
+    saturation_int = np.where(grey, 0, np.clip((saturation.astype(np.float64) * 255.0).astype(np.int64), 0, 255))
+    return hue_int, saturation_int
+
+
+@dataclass(eq=True, frozen=True)
+class ColorHash(HashSettings):
+    """
+    Colour hash, which encodes the fraction of each frame which is black, grey, and in each of 6 hue bins for faint
+    and bright colours, using binbits bits for each of the 14 fractions. This ignores the layout of the frame
+    entirely, so it is robust to cropping and flipping, but not very distinctive alone. Frames are hashed in colour.
+    """
+
+    binbits: int = 3
+    video_size: Optional[int] = None
+
+    def hash_image(self, img: Image) -> FrameHash:
+        import imagehash
+
+        return SimpleImageHash(imagehash.colorhash(img, binbits=self.binbits))
+
+    @property
+    def pix_fmt(self) -> str:
+        return "rgb24"
+
+    def hash_batch(self, frames: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint64]:
+        frames = np.asarray(frames, dtype=np.uint8)
+        frame_count = len(frames)
+        pixels = frames.reshape(frame_count, -1, 3)
+        pixel_count = pixels.shape[1]
+        intensity = _rgb_to_luma(pixels)
+        hue, saturation = _rgb_to_hue_saturation(pixels)
+        black = intensity < 256 // 8
+        grey = saturation < 256 // 3
+        colours = ~black & ~grey
+        faint = colours & (saturation < 256 * 2 // 3)
+        bright = colours & (saturation > 256 * 2 // 3)
+        # Count pixels in 6 equal hue bins, for each frame
+        bins = np.arange(frame_count)[:, np.newaxis] * 6 + np.minimum(hue * 6 // 255, 5)
+        faint_counts = np.bincount(bins[faint], minlength=frame_count * 6).reshape(frame_count, 6)
+        bright_counts = np.bincount(bins[bright], minlength=frame_count * 6).reshape(frame_count, 6)
+        colour_count = np.maximum(colours.sum(axis=1), 1)[:, np.newaxis]
+        max_value = 2**self.binbits
+        fractions = np.concatenate(
+            [
+                (black.sum(axis=1) / pixel_count)[:, np.newaxis] * max_value,
+                ((~black & grey).sum(axis=1) / pixel_count)[:, np.newaxis] * max_value,
+                (faint_counts * max_value).astype(np.float64) / colour_count,
+                (bright_counts * max_value).astype(np.float64) / colour_count,
+            ],
+            axis=1,
+        )
+        values = np.minimum(max_value - 1, fractions.astype(np.int64))
+        # imagehash sets each bit if the value has any bits set down to that position
+        bits = np.stack(
+            [(values >> (self.binbits - i - 1)) % 2 ** (self.binbits - i) > 0 for i in range(self.binbits)], axis=2
+        )
+        return pack_bits(bits)
+
+    @property
+    def hash_shape(self) -> Tuple[int, ...]:
+        return 14, self.binbits
+
     def get_video_size(self) -> int:
         if self.video_size is None:
-            return self.hash_size * 25
+            return 128
         return self.video_size
 
+    @property
+    def blank_bits(self) -> npt.NDArray[np.bool_]:
+        # A black frame is entirely in the first bin
+        bits = _zero_bits(self.hash_shape)
+        bits[0] = True
+        return bits
+
     @property
     def blank_hash(self) -> FrameHash:
-        return SimpleImageHash(imagehash.ImageHash(np.zeros([self.hash_size, self.hash_size], dtype=bool)))
+        return SimpleImageHash.from_bits(self.blank_bits)
+
+
+@dataclass(eq=True, frozen=True)
+class MultiResolutionHash(HashSettings):
+    """
+    Hashes each frame with both the fine settings, which give the frame hashes, and the coarse settings, which give
+    the video hash's coarse_hashes. Matching with CascadeMatch uses the coarse hashes to reject videos cheaply. Both
+    settings must hash frames of the same pixel format.
+    """
+
+    fine: HashSettings = DHash(8)
+    coarse: HashSettings = DHash(6)
+
+    def __post_init__(self) -> None:
+        if self.fine.pix_fmt != self.coarse.pix_fmt:
+            raise ValueError("Fine and coarse hash settings must hash frames of the same pixel format")
+
+    def hash_image(self, img: Image) -> FrameHash:
+        return self.fine.hash_image(img)
+
+    def hash_batch(self, frames: npt.NDArray[np.uint8]) -> npt.NDArray[np.uint64]:
+        return self.fine.hash_batch(frames)
+
+    @property
+    def hash_shape(self) -> Tuple[int, ...]:
+        return self.fine.hash_shape
+
+    def get_video_size(self) -> int:
+        return self.fine.get_video_size()
+
+    @property
+    def blank_bits(self) -> npt.NDArray[np.bool_]:
+        return self.fine.blank_bits
+
+    @property
+    def blank_hash(self) -> FrameHash:
+        return self.fine.blank_hash
+
+    @property
+    def pix_fmt(self) -> str:
+        return self.fine.pix_fmt
+
+    @property
+    def coarse_settings(self) -> Optional[HashSettings]:
+        return self.coarse
 
 
 @dataclass(eq=True, frozen=True)
 class HashOptions:
     fps: float = 5
     settings: HashSettings = DHash(8)
+    # If set, chooses which frames to hash instead of sampling at fps
+    sampling: Optional[Sampling] = None
+
+    @property
+    def fixed_rate(self) -> bool:
+        """
+        Whether frames are sampled at a fixed rate of fps, so consecutive frame hashes are evenly spaced in time
+        """
+        return self.sampling is None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {"fps": self.fps, "settings": self.settings.to_dict()}
+        if self.sampling is not None:
+            data["sampling"] = self.sampling.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> HashOptions:
+        sampling = Sampling.from_dict(data["sampling"]) if "sampling" in data else None
+        return cls(fps=data["fps"], settings=HashSettings.from_dict(data["settings"]), sampling=sampling)
+
+    @property
+    def coarse_options(self) -> Optional[HashOptions]:
+        """
+        Hash options describing the coarse hashes, if the settings compute any
+        """
+        coarse_settings = self.settings.coarse_settings
+        if coarse_settings is None:
+            return None
+        return HashOptions(self.fps, coarse_settings, self.sampling)
 
 
 DEFAULT_HASH_OPTS = HashOptions()
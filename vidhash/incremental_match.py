@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+import logging
+import math
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from vidhash.packed_hash import PackedFrameHashes, blank_mask, hamming_distances, hash_words
+
+if TYPE_CHECKING:
+    from typing import List, Optional
+
+    import numpy.typing as npt
+
+    from vidhash.frame_hash import FrameHash
+    from vidhash.match_options import CascadeMatch, DurationMatch, FrameCountMatch, MatchOptions, PercentageMatch
+    from vidhash.video_hash import VideoHash
+
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalMatcher:
+    """
+    Checks a video against a reference video hash, while the video's frame hashes arrive in order.
+
+    Once the frames seen so far guarantee a match, whatever frames come after them, result becomes True and the rest
+    of the video does not need hashing. Otherwise finish() gives the final result once all the frames are in. Either
+    way, the result is the same as match_options.check_match(video_hash, reference) on the complete video hash.
+
+    If the video's length is not given, a match can only be decided early when it is certain for any video length.
+    This base class never decides early, and is used for match options which do not provide their own.
+
+    A matcher can be kept while a video grows, such as a live recording: add each new part with add_video_hash(), and
+    call finish() with the length so far to check the match. A video which doesn't match yet stays undecided, so later
+    parts can still be added, carrying on from where the last check left off.
+    """
+
+    def __init__(self, match_options: MatchOptions, reference: VideoHash, video_length: Optional[float] = None) -> None:
+        self.match_options = match_options
+        self.reference = reference
+        self.video_length = video_length
+        self.result: Optional[bool] = None
+        self._hash_shape = reference.hash_options.settings.hash_shape
+        self._batches: List[npt.NDArray[np.uint64]] = []
+        # Coarse hashes of each batch, kept while every batch has had them
+        self._coarse_batches: Optional[List[npt.NDArray[np.uint64]]] = []
+        self.frame_count = 0
+
+    @property
+    def decided(self) -> bool:
+        return self.result is not None
+
+    def add(self, frame_hash: FrameHash) -> Optional[bool]:
+        """
+        Adds the video's next frame hash, returning the result if the match has been decided
+        """
+        return self.add_packed(PackedFrameHashes.from_frame_hashes([frame_hash], self._hash_shape).packed)
+
+    def add_packed(
+        self, packed: npt.NDArray[np.uint64], coarse_packed: Optional[npt.NDArray[np.uint64]] = None
+    ) -> Optional[bool]:
+        """
+        Adds the video's next frame hashes, packed into an array shaped (N, words), and their packed coarse hashes, if
+        the hash settings compute them, returning the result if the match has been decided
+        """
+        packed = np.asarray(packed, dtype=np.uint64).reshape(-1, hash_words(self._hash_shape))
+        self._batches.append(packed)
+        if coarse_packed is None or self._coarse_batches is None:
+            self._coarse_batches = None
+        else:
+            self._coarse_batches.append(np.asarray(coarse_packed, dtype=np.uint64).reshape(len(packed), -1))
+        self.frame_count += len(packed)
+        if self.result is None and len(packed) and self._update(packed):
+            logger.debug("Match decided after %s frames", self.frame_count)
+            self.result = True
+        return self.result
+
+    def add_video_hash(self, video_hash: VideoHash) -> Optional[bool]:
+        """
+        Adds the frame hashes of the next part of the video, such as from hash_video_range(), returning the result if
+        the match has been decided
+        """
+        if video_hash.hash_options != self.reference.hash_options:
+            raise ValueError("Video hash was made with different hash options to the reference")
+        coarse_hashes = video_hash.coarse_hashes
+        return self.add_packed(video_hash.packed_hashes.packed, None if coarse_hashes is None else coarse_hashes.packed)
+
+    def _update(self, packed: npt.NDArray[np.uint64]) -> bool:
+        """
+        Updates the matcher's state with new frame hashes, and returns whether a match is now certain
+        """
+        return False
+
+    def video_hash(self, video_length: float) -> VideoHash:
+        """
+        Returns the video hash of all the frames added so far, with their coarse hashes if every part had them
+        """
+        packed = np.concatenate(self._batches) if self._batches else np.zeros((0, hash_words(self._hash_shape)))
+        hashes = PackedFrameHashes(packed.astype(np.uint64), self._hash_shape)
+        coarse_hashes = None
+        coarse_options = self.reference.hash_options.coarse_options
+        if self._coarse_batches is not None and coarse_options is not None:
+            coarse_shape = coarse_options.settings.hash_shape
+            coarse_packed = (
+                np.concatenate(self._coarse_batches)
+                if self._coarse_batches
+                else np.zeros((0, hash_words(coarse_shape)), dtype=np.uint64)
+            )
+            coarse_hashes = PackedFrameHashes(coarse_packed, coarse_shape)
+        return type(self.reference)(hashes, video_length, self.reference.hash_options, coarse_hashes=coarse_hashes)
+
+    def finish(self, video_length: Optional[float] = None) -> bool:
+        """
+        Returns the result for all the video's frames added so far. Only a match is kept as the result, so more frames
+        can be added to a video which doesn't match yet, and finish() called again.
+        """
+        if self.result is None:
+            length = video_length if video_length is not None else self.video_length
+            if length is None:
+                raise ValueError("Video length is needed to finish an undecided match")
+            if not self.match_options.check_match(self.video_hash(length), self.reference):
+                return False
+            self.result = True
+        return self.result
+
+
+class _SimilarityMatcher(IncrementalMatcher):
+    def __init__(
+        self,
+        match_options: MatchOptions,
+        reference: VideoHash,
+        video_length: Optional[float] = None,
+        ignore_blank: bool = False,
+    ) -> None:
+        super().__init__(match_options, reference, video_length)
+        self.ignore_blank = ignore_blank
+        self._blank = reference.hash_options.settings.packed_blank_hash
+        self._reference_hashes, self._reference_counts = np.unique(
+            reference.packed_hashes.packed, axis=0, return_counts=True
+        )
+
+    def _similar(self, packed: npt.NDArray[np.uint64]) -> npt.NDArray[np.bool_]:
+        """
+        Returns which of the new frame hashes are similar to which distinct reference hashes, shaped (N, refs)
+        """
+        similar = hamming_distances(packed, self._reference_hashes) <= self.match_options.hamming_dist
+        if self.ignore_blank:
+            similar[blank_mask(packed, self._blank)] = False
+            similar[:, blank_mask(self._reference_hashes, self._blank)] = False
+        return similar
+
+
+class PercentageMatcher(_SimilarityMatcher):
+    match_options: PercentageMatch
+
+    def __init__(
+        self, match_options: PercentageMatch, reference: VideoHash, video_length: Optional[float] = None
+    ) -> None:
+        super().__init__(match_options, reference, video_length, match_options.ignore_blank)
+        # The overlap needed is a percentage of the shorter video's frame count, which is at most the reference's
+        self._max_required = max(match_options.percentage_overlap * len(reference.image_hashes) / 100, 1)
+        self._video_overlap = 0
+        self._reference_matched = np.zeros(len(self._reference_hashes), dtype=bool)
+
+    def _update(self, packed: npt.NDArray[np.uint64]) -> bool:
+        similar = self._similar(packed)
+        # Overlap counted over this video's frames, if it is shorter than the reference
+        self._video_overlap += int(similar.any(axis=1).sum())
+        # Overlap counted over the reference's frames, if this video is not shorter
+        self._reference_matched |= similar.any(axis=0)
+        reference_overlap = int(self._reference_counts[self._reference_matched].sum())
+        video_shorter = self.video_length is not None and self.video_length < self.reference.video_length
+        reference_shorter = self.video_length is not None and not video_shorter
+        return (reference_shorter or self._video_overlap >= self._max_required) and (
+            video_shorter or reference_overlap >= self._max_required
+        )
+
+
+class FrameCountMatcher(_SimilarityMatcher):
+    match_options: FrameCountMatch
+
+    def __init__(
+        self, match_options: FrameCountMatch, reference: VideoHash, video_length: Optional[float] = None
+    ) -> None:
+        super().__init__(match_options, reference, video_length, match_options.ignore_blank)
+        # The distinct frame hashes needed is capped by the reference's distinct frame hashes
+        self._max_required = max(min(match_options.count_overlap, len(self._reference_hashes)), 1)
+        self._matched_hashes = np.zeros((0, hash_words(self._hash_shape)), dtype=np.uint64)
+
+    def _update(self, packed: npt.NDArray[np.uint64]) -> bool:
+        matched = packed[self._similar(packed).any(axis=1)]
+        self._matched_hashes = np.unique(np.concatenate([self._matched_hashes, matched]), axis=0)
+        return len(self._matched_hashes) >= self._max_required
+
+
+class DurationMatcher(IncrementalMatcher):
+    match_options: DurationMatch
+
+    def __init__(
+        self, match_options: DurationMatch, reference: VideoHash, video_length: Optional[float] = None
+    ) -> None:
+        super().__init__(match_options, reference, video_length)
+        frame_count = min(
+            math.ceil(reference.hash_options.fps * match_options.time_overlap), len(reference.image_hashes)
+        )
+        self._max_required = max(frame_count, 1)
+        # Length of the run of matching frames ending at the latest frame of this video, along each diagonal ending
+        # at each frame of the reference
+        self._runs = np.zeros(len(reference.image_hashes), dtype=np.int64)
+
+    def _update(self, packed: npt.NDArray[np.uint64]) -> bool:
+        similar = hamming_distances(packed, self.reference.packed_hashes.packed) <= self.match_options.hamming_dist
+        runs = self._runs
+        for row in similar:
+            extended = np.zeros_like(runs)
+            extended[1:] = runs[:-1]
+            runs = np.where(row, extended + 1, 0)
+            if len(runs) and runs.max() >= self._max_required:
+                self._runs = runs
+                return True
+        self._runs = runs
+        return False
+
+
+class CascadeMatcher(IncrementalMatcher):
+    """
+    Runs the matcher of the full match options as frames arrive, but never decides early, as the coarse check of the
+    whole video can still reject a match which the full check would accept. finish() runs the coarse check on all the
+    coarse hashes added, and then finishes the full match options' matcher.
+    """
+
+    match_options: CascadeMatch
+
+    def __init__(self, match_options: CascadeMatch, reference: VideoHash, video_length: Optional[float] = None) -> None:
+        self._matcher = match_options.match_options.incremental_matcher(reference, video_length)
+        super().__init__(match_options, reference, video_length)
+
+    @property  # type: ignore[override]
+    def video_length(self) -> Optional[float]:
+        return self._matcher.video_length
+
+    @video_length.setter
+    def video_length(self, video_length: Optional[float]) -> None:
+        self._matcher.video_length = video_length
+
+    def add_packed(
+        self, packed: npt.NDArray[np.uint64], coarse_packed: Optional[npt.NDArray[np.uint64]] = None
+    ) -> Optional[bool]:
+        super().add_packed(packed, coarse_packed)
+        self._matcher.add_packed(packed)
+        return self.result
+
+    def finish(self, video_length: Optional[float] = None) -> bool:
+        if self.result is None:
+            length = video_length if video_length is not None else self.video_length
+            if length is None:
+                raise ValueError("Video length is needed to finish an undecided match")
+            if not self.match_options._coarse_could_match(self.video_hash(length), self.reference):
+                return False
+            if not self._matcher.finish(length):
+                return False
+            self.result = True
+        return self.result
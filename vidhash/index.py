@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from vidhash.hash_options import DEFAULT_HASH_OPTS
+from vidhash.match_options import DEFAULT_MATCH_OPTS, MatchException
+from vidhash.packed_hash import hash_words, popcount, unique_values, unpack_bits
+
+if TYPE_CHECKING:
+    from typing import Dict, Iterator, List, Optional, Tuple
+
+    import numpy.typing as npt
+
+    from vidhash.hash_options import HashOptions
+    from vidhash.match_options import MatchOptions
+    from vidhash.video_hash import VideoHash
+
+logger = logging.getLogger(__name__)
+
+
+class VideoHashIndex:
+    """
+    An index of many video hashes, for finding which of them match a given video hash.
+
+    Each distinct frame hash of each video is an entry in the index. Entries are indexed with multi-index hashing:
+    each hash is split into more chunks than max_hamming_dist, so any two hashes within that hamming distance must
+    have at least one chunk exactly equal. Each chunk has a sorted array of chunk values, which is searched to find
+    entries sharing a chunk with the query's frame hashes, and those are then checked for their actual hamming
+    distance. This gives how many frames of the query and of each indexed video are similar to a frame of the other,
+    and videos without enough similar frames for the match options are dropped. Only the remaining shortlist is
+    checked with the full match options.
+
+    All the built-in match options need at least one pair of similar frames to match, so videos which share no
+    chunks with the query are never checked.
+
+    Inserted videos are buffered and merged into the sorted arrays on the next query. Removed videos are filtered
+    out of results, and compacted away once they make up half of the index.
+    """
+
+    def __init__(self, hash_options: HashOptions = DEFAULT_HASH_OPTS, max_hamming_dist: int = 3) -> None:
+        self.hash_options = hash_options
+        self.max_hamming_dist = max_hamming_dist
+        self._hash_shape = hash_options.settings.hash_shape
+        self._bit_count = int(np.prod(self._hash_shape))
+        # Chunks need to fit in a uint64, and there must be more chunks than the hamming distance
+        chunk_count = min(self._bit_count, max(max_hamming_dist + 1, -(-self._bit_count // 64)))
+        self._chunk_bits = [
+            (int(chunk[0]), int(chunk[-1]) + 1) for chunk in np.array_split(range(self._bit_count), chunk_count)
+        ]
+        self._ids: Dict[str, int] = {}
+        self._keys: Dict[int, str] = {}
+        self._video_hashes: Dict[int, VideoHash] = {}
+        self._next_id = 0
+        # Entries: each distinct frame hash of each video, with its video id and how many frames have it
+        self._entry_hashes = np.zeros((0, hash_words(self._hash_shape)), dtype=np.uint64)
+        self._entry_videos = np.zeros(0, dtype=np.int64)
+        self._entry_counts = np.zeros(0, dtype=np.int64)
+        # For each chunk, the sorted chunk values of all entries, and which entry each one is
+        self._chunk_values = [np.zeros(0, dtype=np.uint64) for _ in self._chunk_bits]
+        self._chunk_entries = [np.zeros(0, dtype=np.int64) for _ in self._chunk_bits]
+        self._pending: List[int] = []
+        self._removed_videos = 0
+
+    def _split_chunks(self, hashes: npt.NDArray[np.uint64]) -> npt.NDArray[np.uint64]:
+        """
+        Splits packed hashes, shaped (N, words), into their chunk values, shaped (chunks, N)
+        """
+        bits = unpack_bits(hashes, self._hash_shape).reshape(len(hashes), self._bit_count)
+        values = np.zeros((len(self._chunk_bits), len(hashes)), dtype=np.uint64)
+        for chunk_num, (start, end) in enumerate(self._chunk_bits):
+            weights = np.left_shift(np.uint64(1), np.arange(end - start - 1, -1, -1, dtype=np.uint64))
+            values[chunk_num] = (bits[:, start:end].astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+        return values
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._ids)
+
+    def get(self, key: str) -> Optional[VideoHash]:
+        video_id = self._ids.get(key)
+        if video_id is None:
+            return None
+        return self._video_hashes[video_id]
+
+    def insert(self, key: str, video_hash: VideoHash) -> None:
+        """
+        Adds a video hash to the index, replacing any existing video hash with the same key
+        """
+        if video_hash.hash_options != self.hash_options:
+            raise MatchException("Video hash was not created with the same hash options as the index.")
+        if key in self._ids:
+            self.remove(key)
+        video_id = self._next_id
+        self._next_id += 1
+        self._ids[key] = video_id
+        self._keys[video_id] = key
+        self._video_hashes[video_id] = video_hash.to_packed()
+        self._pending.append(video_id)
+
+    def remove(self, key: str) -> None:
+        video_id = self._ids.pop(key)
+        del self._keys[video_id]
+        del self._video_hashes[video_id]
+        if video_id in self._pending:
+            self._pending.remove(video_id)
+        else:
+            self._removed_videos += 1
+
+    def _merge_pending(self) -> None:
+        if self._removed_videos * 2 > len(self._ids):
+            self._compact()
+        if not self._pending:
+            return
+        logger.debug("Merging %s videos into index", len(self._pending))
+        new_hashes = []
+        new_videos = []
+        new_counts = []
+        for video_id in self._pending:
+            packed = self._video_hashes[video_id].packed_hashes.packed
+            unique, counts = np.unique(packed, axis=0, return_counts=True)
+            new_hashes.append(unique.reshape(len(unique), self._entry_hashes.shape[1]))
+            new_videos.append(np.full(len(unique), video_id, dtype=np.int64))
+            new_counts.append(counts)
+        first_entry = len(self._entry_hashes)
+        self._entry_hashes = np.concatenate([self._entry_hashes, *new_hashes])
+        self._entry_videos = np.concatenate([self._entry_videos, *new_videos])
+        self._entry_counts = np.concatenate([self._entry_counts, *new_counts])
+        new_values = self._split_chunks(self._entry_hashes[first_entry:])
+        new_entries = np.arange(first_entry, len(self._entry_hashes))
+        for chunk_num in range(len(self._chunk_bits)):
+            values = np.concatenate([self._chunk_values[chunk_num], new_values[chunk_num]])
+            entries = np.concatenate([self._chunk_entries[chunk_num], new_entries])
+            order = np.argsort(values, kind="stable")
+            self._chunk_values[chunk_num] = values[order]
+            self._chunk_entries[chunk_num] = entries[order]
+        self._pending = []
+
+    def _compact(self) -> None:
+        logger.debug("Compacting %s removed videos out of index", self._removed_videos)
+        live_ids = np.fromiter(self._video_hashes.keys(), dtype=np.int64, count=len(self._video_hashes))
+        live = np.isin(self._entry_videos, live_ids)
+        new_positions = np.cumsum(live) - 1
+        self._entry_hashes = self._entry_hashes[live]
+        self._entry_videos = self._entry_videos[live]
+        self._entry_counts = self._entry_counts[live]
+        for chunk_num in range(len(self._chunk_bits)):
+            entries = self._chunk_entries[chunk_num]
+            live_values = live[entries]
+            self._chunk_values[chunk_num] = self._chunk_values[chunk_num][live_values]
+            self._chunk_entries[chunk_num] = new_positions[entries[live_values]]
+        self._removed_videos = 0
+
+    def _frame_hits(
+        self, video_hash: VideoHash, hamming_dist: int
+    ) -> Dict[int, Tuple[Tuple[int, int], Tuple[int, int]]]:
+        """
+        Finds which indexed videos have any frames within hamming distance of the video hash's frames. Returns, for
+        each of those videos, how many frames and how many distinct frame hashes of the query and of the indexed video
+        are similar to a frame in the other.
+        """
+        self._merge_pending()
+        if len(video_hash.image_hashes) == 0 or len(self._entry_hashes) == 0:
+            return {}
+        query, query_counts = np.unique(video_hash.packed_hashes.packed, axis=0, return_counts=True)
+        query_values = self._split_chunks(query)
+        hit_rows = []
+        hit_entries = []
+        for chunk_num in range(len(self._chunk_bits)):
+            values = self._chunk_values[chunk_num]
+            starts = np.searchsorted(values, query_values[chunk_num], side="left")
+            ends = np.searchsorted(values, query_values[chunk_num], side="right")
+            lengths = ends - starts
+            # Gather every entry in each query row's range of equal chunk values
+            positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+            hit_rows.append(np.repeat(np.arange(len(query)), lengths))
+            hit_entries.append(self._chunk_entries[chunk_num][positions])
+        # Drop pairs found through more than one chunk, and pairs which are not actually similar
+        pair_keys = unique_values(np.concatenate(hit_entries) * len(query) + np.concatenate(hit_rows))
+        entries, rows = np.divmod(pair_keys, len(query))
+        similar = popcount(self._entry_hashes[entries] ^ query[rows]).sum(axis=1) <= hamming_dist
+        entries, rows = entries[similar], rows[similar]
+        if len(entries) == 0:
+            return {}
+        videos = self._entry_videos[entries]
+        # Pairs are sorted by entry, so each entry's pairs are together, and so are each video's, as each video's
+        # entries are contiguous. Totals for each video are summed over its distinct entries and query rows.
+        video_ids = unique_values(videos)
+        video_nums = np.searchsorted(video_ids, videos)
+        new_entry = np.concatenate([[True], entries[1:] != entries[:-1]])
+        entry_frames = np.bincount(video_nums[new_entry], self._entry_counts[entries[new_entry]], len(video_ids))
+        entry_hashes = np.bincount(video_nums[new_entry], minlength=len(video_ids))
+        row_videos, query_rows = np.divmod(unique_values(video_nums * len(query) + rows), len(query))
+        query_frames = np.bincount(row_videos, query_counts[query_rows], len(video_ids))
+        query_hashes = np.bincount(row_videos, minlength=len(video_ids))
+        hits: Dict[int, Tuple[Tuple[int, int], Tuple[int, int]]] = {}
+        for video_num, video_id in enumerate(video_ids.tolist()):
+            if video_id not in self._video_hashes:
+                continue
+            hits[video_id] = (
+                (int(query_frames[video_num]), int(query_hashes[video_num])),
+                (int(entry_frames[video_num]), int(entry_hashes[video_num])),
+            )
+        return hits
+
+    def candidates(self, video_hash: VideoHash, match_options: Optional[MatchOptions] = None) -> List[str]:
+        """
+        Returns the keys of indexed videos which could match the video hash under the given match options, without
+        running the full match check
+        """
+        match_options = match_options or DEFAULT_MATCH_OPTS
+        if video_hash.hash_options != self.hash_options:
+            raise MatchException("Video hash was not created with the same hash options as the index.")
+        if match_options.hamming_dist > self.max_hamming_dist:
+            raise ValueError(
+                f"Index supports hamming distances up to {self.max_hamming_dist}, not {match_options.hamming_dist}"
+            )
+        shortlist = []
+        for video_id, (query_hits, video_hits) in self._frame_hits(video_hash, match_options.hamming_dist).items():
+            matching_frames = (query_hits[0], video_hits[0])
+            matching_hashes = (query_hits[1], video_hits[1])
+            if match_options._could_match(video_hash, self._video_hashes[video_id], matching_frames, matching_hashes):
+                shortlist.append(self._keys[video_id])
+        logger.debug("Shortlisted %s of %s indexed videos", len(shortlist), len(self))
+        return shortlist
+
+    def find_matches(self, video_hash: VideoHash, match_options: Optional[MatchOptions] = None) -> List[str]:
+        """
+        Returns the keys of indexed videos which match the video hash under the given match options
+        """
+        match_options = match_options or DEFAULT_MATCH_OPTS
+        return [
+            key
+            for key in self.candidates(video_hash, match_options)
+            if match_options.check_match(video_hash, self._video_hashes[self._ids[key]])
+        ]
@@ -0,0 +1,163 @@
+"""
+Optional instrumentation of the hashing and matching pipeline.
+
+Code run inside `with trace() as tracer:` records statistics for each stage it goes through into the tracer, such as
+"transcode", "extract_frames", "hash_frames" or "match". Outside of a trace, stages record nothing, and cost next to
+nothing. The tracer is held in a context variable, so it follows asyncio tasks created inside the trace, and separate
+traces in concurrent tasks don't interfere.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import dataclasses
+import sys
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict
+
+if TYPE_CHECKING:
+    from contextvars import Token
+    from types import TracebackType
+    from typing import Iterator, Optional, Type
+
+_current_tracer: ContextVar[Optional[Tracer]] = ContextVar("vidhash_tracer", default=None)
+_current_stage: ContextVar[Optional[Stage]] = ContextVar("vidhash_stage", default=None)
+
+
+@dataclass
+class StageStats:
+    """
+    Statistics for one stage of the pipeline, or the totals of all the times a stage ran:
+    - duration is the wall clock time of the stage in seconds. For "hash_frames" it is the time spent hashing, summed
+      across the executor's workers, which may be more than the wall clock time
+    - frames is how many frames the stage decoded, wrote or hashed
+    - bytes_written is how much was written to TEMP_DIR
+    - cpu_time is the user and system CPU time of FFmpeg and FFprobe subprocesses which finished during the stage.
+      This is measured for all the process's children, so it overlaps between stages running concurrently, and is
+      always 0 on Windows
+    - comparisons is how many pairs of frame hashes were compared
+    - calls is how many times the stage ran, such as once per batch of frames for "hash_frames"
+    """
+
+    duration: float = 0
+    calls: int = 0
+    frames: int = 0
+    bytes_written: int = 0
+    cpu_time: float = 0
+    comparisons: int = 0
+
+    def add(self, other: StageStats) -> None:
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dataclasses.asdict(self)
+
+
+class Tracer:
+    """
+    Collects the statistics of each stage which runs while it is the current tracer, totalled by stage name.
+
+    Subclass it and override record() to export each stage's statistics to a metrics system as they come in.
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, StageStats] = {}
+
+    def record(self, name: str, stats: StageStats) -> None:
+        """
+        Called with the statistics of each stage as it finishes
+        """
+        self.stages.setdefault(name, StageStats()).add(stats)
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stats.to_dict() for name, stats in self.stages.items()}
+
+
+def current_tracer() -> Optional[Tracer]:
+    return _current_tracer.get()
+
+
+@contextlib.contextmanager
+def trace(tracer: Optional[Tracer] = None) -> Iterator[Tracer]:
+    """
+    Makes the tracer current for the duration of the block, creating a new one if none is given, and yields it
+    """
+    tracer = tracer or Tracer()
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+def children_cpu_time() -> float:
+    """
+    Returns the total user and system CPU time of this process's child processes which have finished
+    """
+    if sys.platform == "win32":
+        return 0
+    import resource
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Stage:
+    """
+    Records a stage's duration and subprocess CPU time to the current tracer, when used as a context manager. Other
+    statistics can be added to stats inside the block, and comparisons counted by count_comparisons() are added to
+    the innermost stage.
+
+    This sets a context variable for the duration of the block, so must not be held open across a yield in a
+    generator. Use record_stage() there instead.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.stats = StageStats(calls=1)
+        self._tracer: Optional[Tracer] = None
+        self._token: Optional[Token[Optional[Stage]]] = None
+        self._start = 0.0
+        self._start_cpu = 0.0
+
+    def __enter__(self) -> Stage:
+        self._tracer = current_tracer()
+        if self._tracer is not None:
+            self._token = _current_stage.set(self)
+            self._start = time.perf_counter()
+            self._start_cpu = children_cpu_time()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        if self._tracer is None or self._token is None:
+            return
+        _current_stage.reset(self._token)
+        self.stats.duration += time.perf_counter() - self._start
+        self.stats.cpu_time += children_cpu_time() - self._start_cpu
+        self._tracer.record(self.name, self.stats)
+
+
+def record_stage(name: str, stats: StageStats) -> None:
+    """
+    Records a stage's statistics to the current tracer, if there is one
+    """
+    tracer = current_tracer()
+    if tracer is not None:
+        tracer.record(name, stats)
+
+
+def count_comparisons(count: int) -> None:
+    """
+    Adds frame hash comparisons to the innermost stage, if a trace is running
+    """
+    current = _current_stage.get()
+    if current is not None:
+        current.stats.comparisons += count
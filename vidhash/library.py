@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import mmap
+import struct
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from vidhash.video_hash import VideoHash
+
+if TYPE_CHECKING:
+    from types import TracebackType
+    from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Type
+
+    import numpy.typing as npt
+
+# Library container format: a fixed header, then each video hash in its own binary format, aligned to 8 bytes. After
+# those come a table of offsets of the video hashes, and a table of offsets into a blob of UTF-8 keys, one per video.
+# Both tables have one more offset than there are videos, marking where the last entry ends.
+# The header holds the magic bytes, format version, number of videos, and the offsets of the two tables.
+LIBRARY_FORMAT_MAGIC = b"VHLB"
+LIBRARY_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHHQQQ")
+
+
+def _pad(f: BinaryIO, offset: int) -> int:
+    padding = -offset % 8
+    f.write(b"\0" * padding)
+    return offset + padding
+
+
+def write_library(path: str, video_hashes: Iterable[Tuple[str, VideoHash]]) -> int:
+    """
+    Writes a library file of keyed video hashes, which can be opened with VideoHashLibrary.
+    Video hashes are written as they are iterated, so they do not all need to be held in memory.
+    Returns the number of video hashes written.
+    """
+    entry_offsets: List[int] = []
+    keys: List[bytes] = []
+    with open(path, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        offset = _HEADER.size
+        for key, video_hash in video_hashes:
+            entry_offsets.append(offset)
+            keys.append(key.encode())
+            entry = video_hash.to_bytes()
+            f.write(entry)
+            offset = _pad(f, offset + len(entry))
+        entry_offsets.append(offset)
+        index_offset = offset
+        f.write(np.array(entry_offsets, dtype="<u8").tobytes())
+        keys_offset = index_offset + 8 * len(entry_offsets)
+        f.write(np.cumsum([0] + [len(key) for key in keys], dtype=np.uint64).astype("<u8").tobytes())
+        f.write(b"".join(keys))
+        f.seek(0)
+        f.write(_HEADER.pack(LIBRARY_FORMAT_MAGIC, LIBRARY_FORMAT_VERSION, 0, len(keys), index_offset, keys_offset))
+    return len(keys)
+
+
+class VideoHashLibrary:
+    """
+    A read-only, memory mapped library file of keyed video hashes.
+
+    Opening a library only reads its header and offset tables, so it takes about the same time however many videos
+    it holds. Video hashes are decoded when accessed, and their packed frame hashes are views onto the mapped file, so
+    they stay valid only while the library is open.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            raise ValueError(f"{path} is too short to be a video hash library")
+        magic, version, _, count, index_offset, keys_offset = _HEADER.unpack_from(self._mmap, 0)
+        if magic != LIBRARY_FORMAT_MAGIC:
+            raise ValueError(f"{path} is not a video hash library")
+        if version != LIBRARY_FORMAT_VERSION:
+            raise ValueError(f"Unsupported video hash library format version: {version}")
+        self._count = count
+        # The offset tables are copied out, as views onto the mapping would stop it from ever being closed
+        self._entry_offsets: npt.NDArray[np.uint64] = np.frombuffer(
+            self._mmap, dtype="<u8", count=count + 1, offset=index_offset
+        ).copy()
+        self._key_offsets: npt.NDArray[np.uint64] = np.frombuffer(
+            self._mmap, dtype="<u8", count=count + 1, offset=keys_offset
+        ).copy()
+        self._keys_start = keys_offset + 8 * (count + 1)
+        self._key_lookup: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def key(self, index: int) -> str:
+        start = self._keys_start + int(self._key_offsets[index])
+        end = self._keys_start + int(self._key_offsets[index + 1])
+        return self._mmap[start:end].decode()
+
+    def keys(self) -> Iterator[str]:
+        for index in range(self._count):
+            yield self.key(index)
+
+    def index_of(self, key: str) -> int:
+        if self._key_lookup is None:
+            self._key_lookup = {key: index for index, key in enumerate(self.keys())}
+        return self._key_lookup[key]
+
+    def video_hash(self, index: int) -> VideoHash:
+        if not 0 <= index < self._count:
+            raise IndexError(f"Library has no video hash at index {index}")
+        video_hash, _ = VideoHash.from_buffer(self._mmap, int(self._entry_offsets[index]))
+        return video_hash
+
+    def __getitem__(self, key: str) -> VideoHash:
+        return self.video_hash(self.index_of(key))
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        try:
+            self.index_of(key)
+        except KeyError:
+            return False
+        return True
+
+    def items(self) -> Iterator[Tuple[str, VideoHash]]:
+        for index in range(self._count):
+            yield self.key(index), self.video_hash(index)
+
+    def close(self) -> None:
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Video hashes read from the library still reference the mapping, it will be unmapped once they are gone
+            pass
+
+    def __enter__(self) -> VideoHashLibrary:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        self.close()
@@ -1,20 +1,32 @@
 from __future__ import annotations
 
+import dataclasses
 import logging
 import math
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import TYPE_CHECKING
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Dict
+
+import numpy as np
+
+from vidhash import incremental_match
+from vidhash.instrumentation import Stage
+from vidhash.packed_hash import blank_mask, distance_blocks, longest_diagonal_run_of_runs, similar_masks, unique_hashes
 
 if TYPE_CHECKING:
-    from typing import Iterable, Tuple
+    from typing import Optional, Tuple, Type
+
+    import numpy.typing as npt
 
-    from vidhash.frame_hash import FrameHash
+    from vidhash.hash_options import HashOptions
+    from vidhash.incremental_match import IncrementalMatcher
     from vidhash.video_hash import VideoHash
 
 
 logger = logging.getLogger(__name__)
 
+_MATCH_OPTIONS_TYPES: Dict[str, Type[MatchOptions]] = {}
+
 
 class MatchException(ValueError):
     pass
@@ -24,29 +36,117 @@ class MatchException(ValueError):
 class MatchOptions(ABC):
     hamming_dist: int = 3
 
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        _MATCH_OPTIONS_TYPES[cls.__name__] = cls
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Describes these match options as JSON-compatible data, so they can be sent to a server or stored
+        """
+        fields = {
+            option.name: _option_to_json(getattr(self, option.name))
+            for option in dataclasses.fields(self)
+            if option.init
+        }
+        return {"type": self.__class__.__name__, **fields}
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> MatchOptions:
+        options_type = _MATCH_OPTIONS_TYPES.get(data["type"])
+        if options_type is None:
+            raise ValueError(f"Unknown match options type: {data['type']}")
+        return options_type(**{key: _option_from_json(value) for key, value in data.items() if key != "type"})
+
     def check_match(self, hash1: VideoHash, hash2: VideoHash) -> bool:
         logger.info("Checking match between hashes using %s", self.__class__.__name__)
-        if hash1.hash_options != hash2.hash_options:
-            raise MatchException("Video hashes were not created with the same hash options, so cannot be compared.")
-        return self._check_match(hash1, hash2)
+        _check_comparable(hash1, hash2)
+        with Stage("match"):
+            if not self._signatures_could_match(hash1, hash2):
+                logger.debug("Rejected by video signatures")
+                return False
+            return self._check_match(hash1, hash2)
 
     @abstractmethod
     def _check_match(self, hash1: VideoHash, hash2: VideoHash) -> bool:
         pass
 
+    def _could_match(
+        self, hash1: VideoHash, hash2: VideoHash, matching_frames: Tuple[int, int], matching_hashes: Tuple[int, int]
+    ) -> bool:
+        """
+        Given upper bounds on how many frames, and how many distinct frame hashes, of each video are within hamming
+        distance of a frame in the other video, returns whether these match options could possibly find a match.
+        This is used to shortlist candidates cheaply, so it must never rule out a pair which would match.
+        """
+        return True
+
+    def _signatures_could_match(self, hash1: VideoHash, hash2: VideoHash) -> bool:
+        """
+        Checks whether the video signatures leave enough frames which could be similar for a match, without comparing
+        any frames
+        """
+        bounds = hash1.matching_bounds(hash2, self.hamming_dist)
+        if bounds is None:
+            return True
+        matching_frames, matching_hashes = bounds
+        return self._could_match(hash1, hash2, matching_frames, matching_hashes)
+
+    def incremental_matcher(self, reference: VideoHash, video_length: Optional[float] = None) -> IncrementalMatcher:
+        """
+        Returns a matcher for checking a video against the reference video hash as its frame hashes are produced
+        """
+        return incremental_match.IncrementalMatcher(self, reference, video_length)
+
     def _has_overlap(
-        self, frame_hashes: Iterable[FrameHash], hash2: VideoHash, required_overlap: float, ignore_blank: bool
+        self,
+        frame_hashes: npt.NDArray[np.uint64],
+        hash2: VideoHash,
+        required_overlap: float,
+        ignore_blank: bool,
+        frame_counts: Optional[npt.NDArray[np.int64]] = None,
     ) -> bool:
+        """
+        Checks whether at least required_overlap of the given packed frame hashes are within hamming distance of a
+        frame in hash2. frame_counts optionally gives how many times each of the frame hashes should be counted.
+        Distances are computed in blocks, so this returns as soon as enough overlapping frames have been found.
+        """
+        reference = hash2.unique_packed_hashes(ignore_blank)
         overlaps = 0
-        for image_hash in frame_hashes:
-            if hash2.contains_hash(image_hash, self.hamming_dist, ignore_blank):
-                overlaps += 1
-                logger.debug("Found %s of %s overlaps", overlaps, required_overlap)
-                if overlaps >= required_overlap:
-                    return True
+        for start, distances in distance_blocks(frame_hashes, reference):
+            matches = (distances <= self.hamming_dist).any(axis=1)
+            if frame_counts is None:
+                overlaps += int(matches.sum())
+            else:
+                overlaps += int(frame_counts[start : start + len(distances)][matches].sum())
+            logger.debug("Found %s of %s overlaps", overlaps, required_overlap)
+            if overlaps and overlaps >= required_overlap:
+                return True
         return False
 
 
+def _option_to_json(value: Any) -> Any:
+    if isinstance(value, MatchOptions):
+        return value.to_dict()
+    return value
+
+
+def _option_from_json(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MatchOptions.from_dict(value)
+    return value
+
+
+def _check_comparable(hash1: VideoHash, hash2: VideoHash) -> None:
+    if hash1.hash_options != hash2.hash_options:
+        raise MatchException("Video hashes were not created with the same hash options, so cannot be compared.")
+
+
+def _check_fixed_rate(hash_options: HashOptions) -> None:
+    if not hash_options.fixed_rate:
+        raise MatchException("Video hashes were not sampled at a fixed frame rate, so durations cannot be compared.")
+
+
 def _shorter_longer(hash1: VideoHash, hash2: VideoHash) -> Tuple[VideoHash, VideoHash]:
     return (hash1, hash2) if hash1.video_length < hash2.video_length else (hash2, hash1)
 
@@ -62,11 +162,25 @@ class PercentageMatch(MatchOptions):
             "Match will require at least %s frames with hamming distance %s", required_overlap, self.hamming_dist
         )
         shorter, longer = _shorter_longer(hash1, hash2)
-        image_hashes = shorter.image_hashes.copy()
+        # Every frame of the shorter video counts, but each distinct frame hash only needs comparing once
+        runs = shorter.runs()
+        image_hashes, inverse = np.unique(runs.packed_runs, axis=0, return_inverse=True)
+        frame_counts = np.bincount(inverse.reshape(-1), runs.run_lengths, len(image_hashes)).astype(np.int64)
         if self.ignore_blank:
-            blank_hash = shorter.hash_options.settings.blank_hash
-            image_hashes = [frame_hash for frame_hash in image_hashes if frame_hash != blank_hash]
-        return self._has_overlap(image_hashes, longer, required_overlap, self.ignore_blank)
+            not_blank = ~blank_mask(image_hashes, shorter.hash_options.settings.packed_blank_hash)
+            image_hashes, frame_counts = image_hashes[not_blank], frame_counts[not_blank]
+        return self._has_overlap(image_hashes, longer, required_overlap, self.ignore_blank, frame_counts)
+
+    def _could_match(
+        self, hash1: VideoHash, hash2: VideoHash, matching_frames: Tuple[int, int], matching_hashes: Tuple[int, int]
+    ) -> bool:
+        shorter, _ = _shorter_longer(hash1, hash2)
+        shorter_frames = matching_frames[0] if shorter is hash1 else matching_frames[1]
+        required_overlap = self.percentage_overlap * min(len(hash1.image_hashes), len(hash2.image_hashes)) / 100
+        return shorter_frames >= max(required_overlap, 1)
+
+    def incremental_matcher(self, reference: VideoHash, video_length: Optional[float] = None) -> IncrementalMatcher:
+        return incremental_match.PercentageMatcher(self, reference, video_length)
 
 
 @dataclass(eq=True, frozen=True)
@@ -75,56 +189,159 @@ class FrameCountMatch(MatchOptions):
     ignore_blank: bool = True
 
     def _check_match(self, hash1: VideoHash, hash2: VideoHash) -> bool:
-        required_overlap = min(self.count_overlap, len(hash1.hash_set), len(hash2.hash_set))
+        required_overlap = min(self.count_overlap, len(hash1.unique_packed_hashes()), len(hash2.unique_packed_hashes()))
         logger.debug(
             "Match will require at least %s frames with hamming distance %s", required_overlap, self.hamming_dist
         )
-        hash_set = hash1.hash_set.copy()
-        if self.ignore_blank:
-            hash_set.discard(hash1.hash_options.settings.blank_hash)
+        hash_set = hash1.unique_packed_hashes(self.ignore_blank)
         return self._has_overlap(hash_set, hash2, required_overlap, self.ignore_blank)
 
+    def _could_match(
+        self, hash1: VideoHash, hash2: VideoHash, matching_frames: Tuple[int, int], matching_hashes: Tuple[int, int]
+    ) -> bool:
+        required_overlap = min(
+            self.count_overlap,
+            hash1.get_signature().distinct_hash_count,
+            hash2.get_signature().distinct_hash_count,
+        )
+        return matching_hashes[0] >= max(required_overlap, 1)
+
+    def incremental_matcher(self, reference: VideoHash, video_length: Optional[float] = None) -> IncrementalMatcher:
+        return incremental_match.FrameCountMatcher(self, reference, video_length)
+
+
+@dataclass(eq=True, frozen=True)
+class AlignedSegment:
+    """
+    A run of consecutive frames in one video hash which match up, in order, with consecutive frames in another
+    """
+
+    start_frame1: int
+    start_frame2: int
+    frame_count: int
+    fps: float
+
+    @property
+    def start_time1(self) -> float:
+        return self.start_frame1 / self.fps
+
+    @property
+    def start_time2(self) -> float:
+        return self.start_frame2 / self.fps
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count / self.fps
+
 
 @dataclass(eq=True, frozen=True)
 class DurationMatch(MatchOptions):
     time_overlap: float = 3
 
-    def _check_match_from(
-        self,
-        hash1: VideoHash,
-        start_frame1: int,
-        hash2: VideoHash,
-        start_frame2: int,
-        target_length: int,
-    ) -> bool:
-        match_count = 0
-        remaining_frames1 = hash1.image_hashes[start_frame1:]
-        remaining_frames2 = hash2.image_hashes[start_frame2:]
-        if len(remaining_frames1) < target_length or len(remaining_frames2) < target_length:
-            return False
-        for frame1, frame2 in zip(remaining_frames1, remaining_frames2):
-            if not frame1.similar_to(frame2, self.hamming_dist):
-                return False
-            match_count += 1
-            if match_count >= target_length:
-                return True
-        return match_count >= target_length
+    def _longest_run(self, hash1: VideoHash, hash2: VideoHash, target_length: Optional[int]) -> Tuple[int, int, int]:
+        # Scan with the video with fewer frames as the rows, as each row is one step of the scan
+        runs1, runs2 = hash1.runs(), hash2.runs()
+        if len(runs1) <= len(runs2):
+            return longest_diagonal_run_of_runs(runs1, runs2, self.hamming_dist, target_length)
+        length, start2, start1 = longest_diagonal_run_of_runs(runs2, runs1, self.hamming_dist, target_length)
+        return length, start1, start2
 
-    def _check_match(self, hash1: VideoHash, hash2: VideoHash) -> bool:
+    def _required_frames(self, hash1: VideoHash, hash2: VideoHash) -> int:
         frame_count = min(
             math.ceil(hash1.hash_options.fps * self.time_overlap), len(hash1.image_hashes), len(hash2.image_hashes)
         )
+        return max(frame_count, 1)
+
+    def _check_match(self, hash1: VideoHash, hash2: VideoHash) -> bool:
+        _check_fixed_rate(hash1.hash_options)
+        frame_count = self._required_frames(hash1, hash2)
         logger.debug(
             "Will need at least %s frames in a row which match within %s hamming distance",
             frame_count,
             self.hamming_dist,
         )
-        shorter, longer = _shorter_longer(hash1, hash2)
-        for frame_num1 in range(len(shorter.image_hashes)):
-            for frame_num2 in range(len(longer.image_hashes)):
-                if self._check_match_from(shorter, frame_num1, longer, frame_num2, frame_count):
-                    return True
-        return False
+        length, _, _ = self._longest_run(hash1, hash2, frame_count)
+        return length >= frame_count
+
+    def _could_match(
+        self, hash1: VideoHash, hash2: VideoHash, matching_frames: Tuple[int, int], matching_hashes: Tuple[int, int]
+    ) -> bool:
+        # Each frame of the run, in both videos, needs to be similar to a frame in the other video
+        return min(matching_frames) >= self._required_frames(hash1, hash2)
+
+    def incremental_matcher(self, reference: VideoHash, video_length: Optional[float] = None) -> IncrementalMatcher:
+        _check_fixed_rate(reference.hash_options)
+        return incremental_match.DurationMatcher(self, reference, video_length)
+
+    def best_segment(self, hash1: VideoHash, hash2: VideoHash) -> Optional[AlignedSegment]:
+        """
+        Finds the longest segment of frames which match, in order, between the two video hashes, regardless of
+        time_overlap. Returns None if no frames match at all.
+        """
+        _check_comparable(hash1, hash2)
+        _check_fixed_rate(hash1.hash_options)
+        length, start1, start2 = self._longest_run(hash1, hash2, None)
+        if length == 0:
+            return None
+        return AlignedSegment(start1, start2, length, hash1.hash_options.fps)
+
+
+@dataclass(eq=True, frozen=True)
+class CascadeMatch(MatchOptions):
+    """
+    Checks video hashes with match_options, but first rejects pairs whose coarse hashes rule out a match, which is
+    much cheaper than the full check. Video hashes need coarse hashes, from MultiResolutionHash settings, for this to
+    reject anything, otherwise this just runs the full check.
+
+    Frames are assumed similar in the coarse check if their coarse hashes are within coarse_hamming_dist. Frames whose
+    full hashes are similar almost always have similar coarse hashes, but this is not guaranteed, so a higher
+    coarse_hamming_dist rejects fewer true matches, but also fewer non-matches.
+    The hamming distance of the full check is match_options.hamming_dist.
+    """
+
+    hamming_dist: int = field(init=False)
+    match_options: MatchOptions = PercentageMatch()
+    coarse_hamming_dist: int = 2
+
+    def __post_init__(self) -> None:
+        object.__setattr__(self, "hamming_dist", self.match_options.hamming_dist)
+
+    def _check_match(self, hash1: VideoHash, hash2: VideoHash) -> bool:
+        if not self._coarse_could_match(hash1, hash2):
+            logger.debug("Rejected by coarse hashes")
+            return False
+        return self.match_options._check_match(hash1, hash2)
+
+    def _coarse_could_match(self, hash1: VideoHash, hash2: VideoHash) -> bool:
+        coarse1, coarse2 = hash1.coarse_video_hash(), hash2.coarse_video_hash()
+        if coarse1 is None or coarse2 is None:
+            return True
+        bit_count = int(np.prod(coarse1.hash_options.settings.hash_shape))
+        similar1, similar2 = similar_masks(
+            coarse1.packed_hashes.packed, coarse2.packed_hashes.packed, self.coarse_hamming_dist, bit_count
+        )
+        # Frames whose coarse hashes are similar to none in the other video shouldn't be similar in full either, so
+        # counting the rest gives the bounds which the match options need to rule out a match
+        matching_frames = (int(similar1.sum()), int(similar2.sum()))
+        matching_hashes = (
+            len(unique_hashes(hash1.packed_hashes.packed[similar1])),
+            len(unique_hashes(hash2.packed_hashes.packed[similar2])),
+        )
+        return self.match_options._could_match(hash1, hash2, matching_frames, matching_hashes)
+
+    def _could_match(
+        self, hash1: VideoHash, hash2: VideoHash, matching_frames: Tuple[int, int], matching_hashes: Tuple[int, int]
+    ) -> bool:
+        return self.match_options._could_match(
+            hash1, hash2, matching_frames, matching_hashes
+        ) and self._coarse_could_match(hash1, hash2)
+
+    def _signatures_could_match(self, hash1: VideoHash, hash2: VideoHash) -> bool:
+        # The coarse hashes are checked by _check_match, so only the full match options' bounds are wanted here
+        return self.match_options._signatures_could_match(hash1, hash2)
+
+    def incremental_matcher(self, reference: VideoHash, video_length: Optional[float] = None) -> IncrementalMatcher:
+        return incremental_match.CascadeMatcher(self, reference, video_length)
 
 
 DEFAULT_MATCH_OPTS = PercentageMatch(3, 30)
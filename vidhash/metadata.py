@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import dataclasses
+import re
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional
+
+_DURATION_PATTERN = re.compile(r"^\s*Duration: (?:(\d+):(\d+):(\d+(?:\.\d+)?)|N/A)")
+_VIDEO_STREAM_PATTERN = re.compile(r"^\s*Stream #0:\d+.*?: Video: (\w+)")
+_RESOLUTION_PATTERN = re.compile(r", (\d+)x(\d+)\b")
+_FPS_PATTERN = re.compile(r", (\d+(?:\.\d+)?)(k?) (?:fps|tbr)\b")
+
+
+@dataclass(eq=True, frozen=True)
+class VideoMetadata:
+    """
+    Details of the source video, read from FFmpeg's description of its input. Any detail which FFmpeg didn't report
+    is None. frame_count is estimated from the duration and frame rate, as containers don't reliably give it.
+    """
+
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    codec: Optional[str] = None
+    fps: Optional[float] = None
+
+    @property
+    def frame_count(self) -> Optional[int]:
+        if self.duration is None or self.fps is None:
+            return None
+        return round(self.duration * self.fps)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> VideoMetadata:
+        return cls(**data)
+
+
+def parse_ffmpeg_log(lines: Iterable[str]) -> Optional[VideoMetadata]:
+    """
+    Reads the metadata of the first input's first video stream from FFmpeg's stderr output. Returns None if FFmpeg
+    didn't describe an input.
+    """
+    found_input = False
+    duration = width = height = codec = fps = None
+    for line in lines:
+        if line.startswith("Input #0"):
+            found_input = True
+            continue
+        if not found_input:
+            continue
+        if line.startswith(("Input #", "Output #", "Stream mapping:")):
+            break
+        duration_match = _DURATION_PATTERN.match(line)
+        if duration_match and duration_match.group(1) is not None:
+            hours, minutes, seconds = duration_match.groups()
+            duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        stream_match = _VIDEO_STREAM_PATTERN.match(line)
+        if stream_match and codec is None:
+            codec = stream_match.group(1)
+            resolution_match = _RESOLUTION_PATTERN.search(line)
+            if resolution_match:
+                width, height = int(resolution_match.group(1)), int(resolution_match.group(2))
+            # FFmpeg gives "fps" if the container states a frame rate, and "tbr" as its own guess
+            fps_match = _FPS_PATTERN.search(line)
+            if fps_match:
+                fps = float(fps_match.group(1)) * (1000 if fps_match.group(2) else 1)
+    if not found_input:
+        return None
+    return VideoMetadata(duration, width, height, codec, fps)
@@ -0,0 +1,417 @@
+"""
+Helpers for storing frame hashes as packed bits, with each hash being a row of big-endian uint64 words.
+
+The first bit of the flattened hash is the most significant bit of the first word, matching the bit order of
+imagehash's hex strings. Hashes which aren't a multiple of 64 bits are padded with zero bits at the end.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Sequence, overload
+
+import numpy as np
+
+from vidhash.frame_hash import FrameHash, SimpleImageHash
+from vidhash.instrumentation import count_comparisons
+
+if TYPE_CHECKING:
+    from typing import Iterable, Iterator, Optional, Tuple, Union
+
+    import numpy.typing as npt
+
+# Maximum number of uint64 words to XOR at once when comparing blocks of hashes
+BLOCK_WORDS = 2**20
+# Maximum number of diagonal segments through similar pairs of runs to find runs of matching frames from, beyond
+# which longest_diagonal_run_of_runs() scans frame by frame instead, to bound memory
+MAX_RUN_SEGMENTS = 2**22
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+
+def word_count(bit_count: int) -> int:
+    return max(1, -(-bit_count // 64))
+
+
+def hash_words(hash_shape: Tuple[int, ...]) -> int:
+    return word_count(int(np.prod(hash_shape)))
+
+
+def pack_bits(bits: npt.NDArray[np.bool_]) -> npt.NDArray[np.uint64]:
+    """
+    Packs an array of boolean hashes, shaped (N, ...), into a uint64 array shaped (N, words)
+    """
+    bits = np.asarray(bits, dtype=bool)
+    flat = bits.reshape(len(bits), int(np.prod(bits.shape[1:])))
+    padded = np.zeros((len(flat), word_count(flat.shape[1]) * 64), dtype=bool)
+    padded[:, : flat.shape[1]] = flat
+    return np.packbits(padded, axis=1).view(">u8").astype(np.uint64)
+
+
+def unpack_bits(packed: npt.NDArray[np.uint64], shape: Tuple[int, ...]) -> npt.NDArray[np.bool_]:
+    """
+    Unpacks a uint64 array shaped (N, words) back into boolean hashes shaped (N, *shape)
+    """
+    packed = np.asarray(packed, dtype=np.uint64).reshape(len(packed), hash_words(shape))
+    bits = np.unpackbits(packed.astype(">u8").view(np.uint8), axis=1)
+    return bits[:, : int(np.prod(shape))].reshape(len(packed), *shape).astype(bool)
+
+
+def pack_frame_hashes(frame_hashes: Iterable[FrameHash], hash_shape: Tuple[int, ...]) -> npt.NDArray[np.uint64]:
+    bits = [frame_hash.to_bits() for frame_hash in frame_hashes]
+    return pack_bits(np.array(bits, dtype=bool).reshape(len(bits), *hash_shape))
+
+
+def popcount(words: npt.NDArray[np.uint64]) -> npt.NDArray[np.uint64]:
+    """
+    Counts the set bits in each uint64 in an array
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).astype(np.uint64)
+    # SWAR popcount, for numpy versions before 2.0
+    words = words - ((words >> np.uint64(1)) & _M1)
+    words = (words & _M2) + ((words >> np.uint64(2)) & _M2)
+    words = (words + (words >> np.uint64(4))) & _M4
+    return (words * _H01) >> np.uint64(56)
+
+
+def hamming_distances(hashes1: npt.NDArray[np.uint64], hashes2: npt.NDArray[np.uint64]) -> npt.NDArray[np.int64]:
+    """
+    Returns the (N, M) matrix of hamming distances between two arrays of packed hashes, shaped (N, words) and
+    (M, words)
+    """
+    count_comparisons(len(hashes1) * len(hashes2))
+    return popcount(hashes1[:, np.newaxis, :] ^ hashes2[np.newaxis, :, :]).sum(axis=2, dtype=np.int64)
+
+
+def distance_blocks(
+    hashes1: npt.NDArray[np.uint64], hashes2: npt.NDArray[np.uint64]
+) -> Iterator[Tuple[int, npt.NDArray[np.int64]]]:
+    """
+    Computes the hamming distance matrix between two arrays of packed hashes a block of rows at a time, so that
+    memory use stays bounded and callers can stop early. Yields the index of the first row in each block, and the
+    distances from each row in that block to every hash in hashes2.
+    """
+    rows_per_block = max(1, BLOCK_WORDS // max(1, hashes2.size))
+    for start in range(0, len(hashes1), rows_per_block):
+        yield start, hamming_distances(hashes1[start : start + rows_per_block], hashes2)
+
+
+def _chunk_pairs(values1: npt.NDArray[np.uint64], values2: npt.NDArray[np.uint64]) -> npt.NDArray[np.int64]:
+    """
+    Returns the index pairs, shaped (P, 2), of equal values in the two arrays
+    """
+    order = np.argsort(values2, kind="stable")
+    sorted2 = values2[order]
+    starts = np.searchsorted(sorted2, values1, side="left")
+    lengths = np.searchsorted(sorted2, values1, side="right") - starts
+    positions = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.stack([np.repeat(np.arange(len(values1)), lengths), order[positions]], axis=1)
+
+
+def similar_masks(
+    hashes1: npt.NDArray[np.uint64], hashes2: npt.NDArray[np.uint64], hamming_dist: int, bit_count: int
+) -> Tuple[npt.NDArray[np.bool_], npt.NDArray[np.bool_]]:
+    """
+    Returns which hashes in each array of packed hashes are within hamming distance of any hash in the other.
+
+    Single word hashes are split into hamming_dist + 1 chunks of bits, and any two hashes within the distance must
+    have at least one chunk equal, so only pairs with an equal chunk need comparing. This is much cheaper than
+    comparing every pair, unless most pairs share a chunk.
+    """
+    found1 = np.zeros(len(hashes1), dtype=bool)
+    found2 = np.zeros(len(hashes2), dtype=bool)
+    if len(hashes1) == 0 or len(hashes2) == 0:
+        return found1, found2
+    if hashes1.shape[1] == 1 and hamming_dist < bit_count <= 64:
+        unique1, inverse1 = np.unique(hashes1[:, 0], return_inverse=True)
+        unique2, inverse2 = np.unique(hashes2[:, 0], return_inverse=True)
+        pairs = []
+        for chunk in np.array_split(np.arange(bit_count), hamming_dist + 1):
+            shift = np.uint64(64 - chunk[-1] - 1)
+            mask = np.uint64((1 << len(chunk)) - 1)
+            pairs.append(_chunk_pairs((unique1 >> shift) & mask, (unique2 >> shift) & mask))
+        if sum(len(chunk_pairs) for chunk_pairs in pairs) < len(unique1) * len(unique2):
+            rows, columns = np.concatenate(pairs).T
+            similar = popcount(unique1[rows] ^ unique2[columns]) <= hamming_dist
+            unique_found1 = np.zeros(len(unique1), dtype=bool)
+            unique_found2 = np.zeros(len(unique2), dtype=bool)
+            unique_found1[rows[similar]] = True
+            unique_found2[columns[similar]] = True
+            return unique_found1[inverse1.reshape(-1)], unique_found2[inverse2.reshape(-1)]
+    for start, distances in distance_blocks(hashes1, hashes2):
+        similar_block = distances <= hamming_dist
+        found1[start : start + len(distances)] = similar_block.any(axis=1)
+        found2 |= similar_block.any(axis=0)
+    return found1, found2
+
+
+def longest_diagonal_run(
+    hashes1: npt.NDArray[np.uint64],
+    hashes2: npt.NDArray[np.uint64],
+    hamming_dist: float,
+    target_length: Optional[int] = None,
+) -> Tuple[int, int, int]:
+    """
+    Finds the longest run of consecutive hashes in hashes1 which are each within hamming_dist of the same number of
+    consecutive hashes in hashes2, by scanning along every diagonal of the similarity matrix at once.
+    Returns the length of the run, and the index it starts at in each array. If target_length is given, this returns
+    as soon as a run of that length is found.
+    """
+    best = (0, 0, 0)
+    if len(hashes1) == 0 or len(hashes2) == 0:
+        return best
+    # runs[j] is the length of the matching run along the diagonal ending at the current row and column j
+    runs = np.zeros(len(hashes2), dtype=np.int64)
+    for start, distances in distance_blocks(hashes1, hashes2):
+        for row_num, similar in enumerate(distances <= hamming_dist, start):
+            new_runs = np.zeros_like(runs)
+            new_runs[0] = similar[0]
+            new_runs[1:] = np.where(similar[1:], runs[:-1] + 1, 0)
+            runs = new_runs
+            end = int(runs.argmax())
+            length = int(runs[end])
+            if length > best[0]:
+                best = (length, row_num - length + 1, end - length + 1)
+                if target_length is not None and length >= target_length:
+                    return best
+    return best
+
+
+def longest_diagonal_run_of_runs(
+    runs1: RunLengthFrameHashes,
+    runs2: RunLengthFrameHashes,
+    hamming_dist: float,
+    target_length: Optional[int] = None,
+) -> Tuple[int, int, int]:
+    """
+    Gives the same result as longest_diagonal_run() on the frame hashes of two run-length encoded sequences, but only
+    compares each pair of runs once, and works along diagonals a whole pair of runs at a time, so the cost scales with
+    the number of runs rather than frames.
+    """
+    if len(runs1.packed_runs) == 0 or len(runs2.packed_runs) == 0:
+        return 0, 0, 0
+    rows = []
+    columns = []
+    segment_count = 0
+    for start, distances in distance_blocks(runs1.packed_runs, runs2.packed_runs):
+        block_rows, block_columns = np.nonzero(distances <= hamming_dist)
+        block_rows += start
+        # Each similar pair of runs is crossed by one diagonal segment per frame of its height and width, less one
+        segment_count += int((runs1.run_lengths[block_rows] + runs2.run_lengths[block_columns] - 1).sum())
+        if segment_count > MAX_RUN_SEGMENTS:
+            return longest_diagonal_run(runs1.to_packed().packed, runs2.to_packed().packed, hamming_dist, target_length)
+        rows.append(block_rows)
+        columns.append(block_columns)
+    return longest_run_of_similar_runs(
+        runs1, runs2, np.concatenate(rows), np.concatenate(columns), hamming_dist, target_length
+    )
+
+
+def longest_run_of_similar_runs(
+    runs1: RunLengthFrameHashes,
+    runs2: RunLengthFrameHashes,
+    pairs1: npt.NDArray[np.int64],
+    pairs2: npt.NDArray[np.int64],
+    hamming_dist: float,
+    target_length: Optional[int] = None,
+) -> Tuple[int, int, int]:
+    """
+    Gives the same result as longest_diagonal_run_of_runs(), given the indexes of every pair of runs, one from each
+    sequence, whose hashes are within hamming distance, for callers which have already compared the runs
+    """
+    if len(pairs1) == 0:
+        return 0, 0, 0
+    if int((runs1.run_lengths[pairs1] + runs2.run_lengths[pairs2] - 1).sum()) > MAX_RUN_SEGMENTS:
+        return longest_diagonal_run(runs1.to_packed().packed, runs2.to_packed().packed, hamming_dist, target_length)
+    row_starts, heights = runs1.run_starts[pairs1], runs1.run_lengths[pairs1]
+    column_starts, widths = runs2.run_starts[pairs2], runs2.run_lengths[pairs2]
+    # Every diagonal, numbered by column - row, which crosses each pair of runs, and the rows where it does
+    counts = heights + widths - 1
+    pair_nums = np.repeat(np.arange(len(pairs1)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    diagonals = (column_starts - row_starts - heights + 1)[pair_nums] + offsets
+    segment_starts = np.maximum(row_starts[pair_nums], column_starts[pair_nums] - diagonals)
+    segment_ends = np.minimum((row_starts + heights)[pair_nums], (column_starts + widths)[pair_nums] - diagonals)
+    # Segments which meet along the same diagonal join up into one run of matching frames
+    order = np.lexsort((segment_starts, diagonals))
+    diagonals, segment_starts, segment_ends = diagonals[order], segment_starts[order], segment_ends[order]
+    new_run = np.concatenate([[True], (diagonals[1:] != diagonals[:-1]) | (segment_starts[1:] != segment_ends[:-1])])
+    run_starts = np.flatnonzero(new_run)
+    starts, run_diagonals = segment_starts[run_starts], diagonals[run_starts]
+    lengths = np.maximum.reduceat(segment_ends, run_starts) - starts
+    length = int(lengths.max())
+    if target_length is not None:
+        length = min(length, target_length)
+    # The frame by frame scan settles on the first row, then column, at which a run reaches this length
+    reaching = np.flatnonzero(lengths >= length)
+    end_rows = starts[reaching] + length - 1
+    first = reaching[np.lexsort((end_rows + run_diagonals[reaching], end_rows))[0]]
+    return length, int(starts[first]), int(starts[first] + run_diagonals[first])
+
+
+def unique_values(values: npt.NDArray[np.int64]) -> npt.NDArray[np.int64]:
+    """
+    Returns the distinct values of a 1D integer array, in ascending order. Sorting and dropping repeats is many times
+    faster than np.unique(), which hashes integer arrays in numpy 2.
+    """
+    if len(values) == 0:
+        return values
+    ordered = np.sort(values)
+    return ordered[np.concatenate([[True], ordered[1:] != ordered[:-1]])]
+
+
+def unique_hashes(hashes: npt.NDArray[np.uint64]) -> npt.NDArray[np.uint64]:
+    if len(hashes) == 0:
+        return hashes
+    return np.unique(hashes, axis=0)
+
+
+def blank_mask(hashes: npt.NDArray[np.uint64], blank_hash: npt.NDArray[np.uint64]) -> npt.NDArray[np.bool_]:
+    return np.asarray((hashes == blank_hash).all(axis=1), dtype=bool)
+
+
+class PackedFrameHashes(Sequence[FrameHash]):
+    """
+    A sequence of frame hashes held as one contiguous (N, words) uint64 array, rather than as individual FrameHash
+    objects. Items are unpacked into SimpleImageHash objects on access.
+    """
+
+    def __init__(self, packed: npt.NDArray[np.uint64], hash_shape: Tuple[int, ...]) -> None:
+        self.packed = np.asarray(packed, dtype=np.uint64).reshape(len(packed), hash_words(hash_shape))
+        self.hash_shape = tuple(hash_shape)
+
+    @classmethod
+    def from_frame_hashes(cls, frame_hashes: Sequence[FrameHash], hash_shape: Tuple[int, ...]) -> PackedFrameHashes:
+        if isinstance(frame_hashes, PackedFrameHashes):
+            return frame_hashes
+        if isinstance(frame_hashes, RunLengthFrameHashes):
+            return frame_hashes.to_packed()
+        return cls(pack_frame_hashes(frame_hashes, hash_shape), hash_shape)
+
+    def __len__(self) -> int:
+        return len(self.packed)
+
+    @overload
+    def __getitem__(self, index: int) -> FrameHash: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> PackedFrameHashes: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[FrameHash, PackedFrameHashes]:
+        if isinstance(index, slice):
+            return PackedFrameHashes(self.packed[index], self.hash_shape)
+        return SimpleImageHash.from_bits(unpack_bits(self.packed[[index]], self.hash_shape)[0])
+
+    def __iter__(self) -> Iterator[FrameHash]:
+        for bits in unpack_bits(self.packed, self.hash_shape):
+            yield SimpleImageHash.from_bits(bits)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PackedFrameHashes):
+            return self.hash_shape == other.hash_shape and np.array_equal(self.packed, other.packed)
+        if isinstance(other, RunLengthFrameHashes):
+            return self == other.to_packed()
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({len(self)} hashes of shape {self.hash_shape})"
+
+
+class RunLengthFrameHashes(Sequence[FrameHash]):
+    """
+    A sequence of frame hashes held as runs of identical consecutive hashes: the packed hash of each run, shaped
+    (runs, words), with the frame index each run starts at and how many frames it lasts. Static shots, slides and
+    black frames then take one entry each, however long they are.
+    """
+
+    def __init__(
+        self, packed_runs: npt.NDArray[np.uint64], run_lengths: npt.NDArray[np.int64], hash_shape: Tuple[int, ...]
+    ) -> None:
+        self.packed_runs = np.asarray(packed_runs, dtype=np.uint64).reshape(len(packed_runs), hash_words(hash_shape))
+        self.run_lengths = np.asarray(run_lengths, dtype=np.int64)
+        self.run_starts = np.cumsum(self.run_lengths) - self.run_lengths
+        self.hash_shape = tuple(hash_shape)
+
+    @classmethod
+    def _merged(
+        cls, packed_runs: npt.NDArray[np.uint64], run_lengths: npt.NDArray[np.int64], hash_shape: Tuple[int, ...]
+    ) -> RunLengthFrameHashes:
+        # Joins neighbouring runs of the same hash
+        if len(packed_runs) == 0:
+            return cls(packed_runs, run_lengths, hash_shape)
+        new_run = np.concatenate([[True], (packed_runs[1:] != packed_runs[:-1]).any(axis=1)])
+        starts = np.flatnonzero(new_run)
+        return cls(packed_runs[starts], np.add.reduceat(run_lengths, starts), hash_shape)
+
+    @classmethod
+    def from_packed(cls, packed: npt.NDArray[np.uint64], hash_shape: Tuple[int, ...]) -> RunLengthFrameHashes:
+        packed = np.asarray(packed, dtype=np.uint64).reshape(len(packed), hash_words(hash_shape))
+        return cls._merged(packed, np.ones(len(packed), dtype=np.int64), hash_shape)
+
+    @classmethod
+    def from_frame_hashes(cls, frame_hashes: Sequence[FrameHash], hash_shape: Tuple[int, ...]) -> RunLengthFrameHashes:
+        if isinstance(frame_hashes, RunLengthFrameHashes):
+            return frame_hashes
+        return cls.from_packed(PackedFrameHashes.from_frame_hashes(frame_hashes, hash_shape).packed, hash_shape)
+
+    @classmethod
+    def concatenate(cls, parts: Sequence[RunLengthFrameHashes], hash_shape: Tuple[int, ...]) -> RunLengthFrameHashes:
+        """
+        Joins run-length encoded sequences end to end, merging runs which continue from one into the next
+        """
+        words = hash_words(hash_shape)
+        packed_runs = np.concatenate([np.zeros((0, words), dtype=np.uint64)] + [part.packed_runs for part in parts])
+        run_lengths = np.concatenate([np.zeros(0, dtype=np.int64)] + [part.run_lengths for part in parts])
+        return cls._merged(packed_runs, run_lengths, hash_shape)
+
+    def to_packed(self) -> PackedFrameHashes:
+        return PackedFrameHashes(np.repeat(self.packed_runs, self.run_lengths, axis=0), self.hash_shape)
+
+    def __len__(self) -> int:
+        return int(self.run_lengths.sum())
+
+    @overload
+    def __getitem__(self, index: int) -> FrameHash: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> PackedFrameHashes: ...
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[FrameHash, PackedFrameHashes]:
+        if isinstance(index, slice):
+            return self.to_packed()[index]
+        frame_count = len(self)
+        if not -frame_count <= index < frame_count:
+            raise IndexError("Frame hash index out of range")
+        run_num = int(np.searchsorted(self.run_starts, index % frame_count, side="right")) - 1
+        return SimpleImageHash.from_bits(unpack_bits(self.packed_runs[[run_num]], self.hash_shape)[0])
+
+    def __iter__(self) -> Iterator[FrameHash]:
+        for bits, run_length in zip(unpack_bits(self.packed_runs, self.hash_shape), self.run_lengths):
+            frame_hash = SimpleImageHash.from_bits(bits)
+            for _ in range(run_length):
+                yield frame_hash
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RunLengthFrameHashes):
+            return (
+                self.hash_shape == other.hash_shape
+                and np.array_equal(self.packed_runs, other.packed_runs)
+                and np.array_equal(self.run_lengths, other.run_lengths)
+            )
+        if isinstance(other, Sequence):
+            return self.to_packed() == other
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}({len(self)} hashes in {len(self.run_lengths)} runs of shape {self.hash_shape})"
+        )
@@ -0,0 +1,102 @@
+"""
+Reimplementation of Pillow's Lanczos resampling for stacks of greyscale frames.
+
+Pillow resizes with a separable filter whose coefficients are rounded to fixed point integers, and rounds the output
+of each pass back to 8 bits. Doing the same integer arithmetic here gives results which are bit-identical to
+`Image.resize(size, Image.Resampling.LANCZOS)` on an "L" mode image, but for a whole batch of frames at once.
+"""
+
+from __future__ import annotations
+
+import functools
+import math
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import numpy.typing as npt
+
+LANCZOS_SUPPORT = 3.0
+PRECISION_BITS = 32 - 8 - 2
+ROW_BLOCK_SIZE = 1024
+
+
+def _sinc(x: float) -> float:
+    if x == 0.0:
+        return 1.0
+    x = x * math.pi
+    return math.sin(x) / x
+
+
+def _lanczos(x: float) -> float:
+    if -LANCZOS_SUPPORT <= x < LANCZOS_SUPPORT:
+        return _sinc(x) * _sinc(x / LANCZOS_SUPPORT)
+    return 0.0
+
+
+@functools.lru_cache(maxsize=128)
+def _coefficients(in_size: int, out_size: int) -> npt.NDArray[np.float64]:
+    """
+    Builds a dense (out_size, in_size) matrix of fixed point filter weights, computed the same way as Pillow's
+    precompute_coeffs() and normalize_coeffs_8bpp(). Weights outside of each output pixel's bounds are zero.
+    """
+    scale = in_size / out_size
+    filter_scale = max(scale, 1.0)
+    support = LANCZOS_SUPPORT * filter_scale
+    inverse_scale = 1.0 / filter_scale
+    weights = np.zeros((out_size, in_size), dtype=np.float64)
+    for out_x in range(out_size):
+        center = (out_x + 0.5) * scale
+        x_min = max(int(center - support + 0.5), 0)
+        x_max = min(int(center + support + 0.5), in_size)
+        row = [_lanczos((x - center + 0.5) * inverse_scale) for x in range(x_min, x_max)]
+        total = sum(row)
+        for x, weight in zip(range(x_min, x_max), row):
+            if total != 0.0:
+                weight /= total
+            if weight < 0:
+                weights[out_x, x] = int(-0.5 + weight * (1 << PRECISION_BITS))
+            else:
+                weights[out_x, x] = int(0.5 + weight * (1 << PRECISION_BITS))
+    return weights
+
+
+def _clip8(sums: npt.NDArray[np.float64]) -> npt.NDArray[np.uint8]:
+    # The weighted sums are computed as floats to use BLAS, but every term is an integer well below 2**53, so the
+    # sums are exact and match Pillow's integer arithmetic
+    values = sums.astype(np.int64) + (1 << (PRECISION_BITS - 1))
+    return np.clip(values >> PRECISION_BITS, 0, 255).astype(np.uint8)
+
+
+def _resize_horizontal(frames: npt.NDArray[np.uint8], width: int) -> npt.NDArray[np.uint8]:
+    if frames.shape[2] == width:
+        return frames
+    horizontal = _coefficients(frames.shape[2], width).T
+    rows = frames.reshape(-1, frames.shape[2])
+    resized_rows = np.empty((len(rows), width), dtype=np.uint8)
+    # Converting to float in blocks keeps the working set in cache, rather than copying the whole stack
+    for start in range(0, len(rows), ROW_BLOCK_SIZE):
+        block = rows[start : start + ROW_BLOCK_SIZE]
+        resized_rows[start : start + ROW_BLOCK_SIZE] = _clip8(block.astype(np.float64) @ horizontal)
+    return resized_rows.reshape(frames.shape[0], frames.shape[1], width)
+
+
+def _resize_vertical(frames: npt.NDArray[np.uint8], height: int) -> npt.NDArray[np.uint8]:
+    if frames.shape[1] == height:
+        return frames
+    vertical = _coefficients(frames.shape[1], height)
+    return _clip8(vertical @ frames.astype(np.float64))
+
+
+def resize_lanczos(frames: npt.NDArray[np.uint8], width: int, height: int) -> npt.NDArray[np.uint8]:
+    """
+    Resizes a stack of greyscale frames, shaped (N, H, W), to (N, height, width) exactly as Pillow would resize each
+    frame individually.
+    """
+    frames = np.asarray(frames, dtype=np.uint8)
+    # Pillow does the horizontal pass first, and skips any pass which doesn't change the size, except for very tall
+    # images being shrunk vertically
+    if frames.shape[1] > frames.shape[2] * 100 and height < frames.shape[1]:
+        return _resize_horizontal(_resize_vertical(frames, height), width)
+    return _resize_vertical(_resize_horizontal(frames, width), height)
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import dataclasses
+from abc import ABC
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Type
+
+if TYPE_CHECKING:
+    from typing import List, Optional
+
+
+_SAMPLING_TYPES: Dict[str, Type[Sampling]] = {}
+
+
+class Sampling(ABC):
+    """
+    Chooses which frames of a video are hashed, in place of sampling at a fixed frame rate.
+
+    Frames picked by a sampling strategy are not evenly spaced in time, so video hashes made with one can't be
+    compared by DurationMatch.
+    """
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        _SAMPLING_TYPES[cls.__name__] = cls
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not dataclasses.is_dataclass(self):
+            raise TypeError(f"{self.__class__.__name__} must be a dataclass to be serialised")
+        fields = {field.name: getattr(self, field.name) for field in dataclasses.fields(self)}
+        return {"type": self.__class__.__name__, **fields}
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> Sampling:
+        sampling_type = _SAMPLING_TYPES.get(data["type"])
+        if sampling_type is None:
+            raise ValueError(f"Unknown sampling type: {data['type']}")
+        return sampling_type(**{key: value for key, value in data.items() if key != "type"})
+
+    def input_options(self) -> List[str]:
+        """
+        FFmpeg options applied to the video input
+        """
+        return []
+
+    def filters(self) -> List[str]:
+        """
+        FFmpeg filters which select the sampled frames from the decoded video
+        """
+        return []
+
+    @property
+    def seeks(self) -> bool:
+        """
+        Whether this strategy samples by seeking to each frame given by seek_times(), rather than by decoding the
+        whole video
+        """
+        return False
+
+    def seek_times(self, video_length: float) -> Optional[List[float]]:
+        """
+        Timestamps to seek to and take a single frame from, if this strategy seeks, otherwise None
+        """
+        return None
+
+
+@dataclass(eq=True, frozen=True)
+class KeyframeSampling(Sampling):
+    """
+    Hashes only the keyframes of the video. The decoder skips every other frame, so this is much cheaper than
+    decoding the whole video, but how many frames are hashed depends on how the video was encoded.
+    """
+
+    def input_options(self) -> List[str]:
+        return ["-skip_frame", "nokey"]
+
+
+@dataclass(eq=True, frozen=True)
+class SceneChangeSampling(Sampling):
+    """
+    Hashes the first frame, and each frame which FFmpeg's scene detection scores above the threshold, from 0 to 1.
+    The whole video is still decoded, but only frames at scene changes are scaled and hashed.
+    """
+
+    threshold: float = 0.3
+
+    def filters(self) -> List[str]:
+        return [f"select='eq(n\\,0)+gt(scene\\,{self.threshold})'"]
+
+
+@dataclass(eq=True, frozen=True)
+class UniformSampling(Sampling):
+    """
+    Hashes a fixed number of frames, evenly spaced through the video. Each one is found with a fast input seek, so
+    only the frames around each seek point are decoded, however long the video is.
+    """
+
+    frame_count: int = 100
+
+    @property
+    def seeks(self) -> bool:
+        return True
+
+    def seek_times(self, video_length: float) -> Optional[List[float]]:
+        return [(num + 0.5) * video_length / self.frame_count for num in range(self.frame_count)]
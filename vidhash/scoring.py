@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import heapq
+import logging
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from vidhash.instrumentation import Stage
+from vidhash.match_options import AlignedSegment, MatchException
+from vidhash.packed_hash import blank_mask, distance_blocks, longest_run_of_similar_runs
+
+if TYPE_CHECKING:
+    from typing import Iterable, List, Optional, Tuple, Union
+
+    import numpy.typing as npt
+
+    from vidhash.video_hash import VideoHash
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(eq=True, frozen=True)
+class MatchScore:
+    """
+    How closely two video hashes match, rather than just whether they do. percentage_overlap is the percentage of
+    frames in the shorter video which are similar to a frame in the other, as PercentageMatch counts them, and
+    best_segment is the longest run of frames which match in order, as found by DurationMatch.best_segment(). It is
+    None if the hashes were not sampled at a fixed frame rate, or no frames match. min_distances1 and min_distances2
+    give the smallest hamming distance from each frame of each video to any frame of the other.
+    """
+
+    percentage_overlap: float
+    overlap_frames: int
+    best_segment: Optional[AlignedSegment]
+    min_distances1: npt.NDArray[np.int64] = field(compare=False, repr=False)
+    min_distances2: npt.NDArray[np.int64] = field(compare=False, repr=False)
+
+    @property
+    def rank_key(self) -> Tuple[float, int]:
+        """
+        Orders scores by percentage overlap, then by the length of the best segment
+        """
+        return self.percentage_overlap, 0 if self.best_segment is None else self.best_segment.frame_count
+
+
+def score_match(
+    hash1: VideoHash,
+    hash2: VideoHash,
+    hamming_dist: int = 3,
+    ignore_blank: bool = True,
+    min_percentage: Optional[float] = None,
+) -> Optional[MatchScore]:
+    """
+    Scores how closely two video hashes match, comparing each pair of runs of identical frames, one from each video,
+    just once. ignore_blank leaves blank frames out of the percentage overlap, as with PercentageMatch.
+
+    If min_percentage is given, returns None as soon as the percentage overlap is certain to be below it, first from
+    the video signatures, and then while comparing the frames, so that pairs which cannot beat the scores found so
+    far are cheap to rule out.
+    """
+    if hash1.hash_options != hash2.hash_options:
+        raise MatchException("Video hashes were not created with the same hash options, so cannot be compared.")
+    with Stage("match"):
+        # Rows of the distance matrix are the runs of the shorter video, whose frames the overlap counts, so the most
+        # it could still reach is known after each block of rows
+        swapped = hash1.video_length >= hash2.video_length
+        shorter, longer = (hash2, hash1) if swapped else (hash1, hash2)
+        frame_count = min(len(hash1.image_hashes), len(hash2.image_hashes))
+        if min_percentage is not None:
+            bounds = shorter.matching_bounds(longer, hamming_dist)
+            if bounds is not None and _percentage(bounds[0][0], frame_count) < min_percentage:
+                logger.debug("Score ruled out by video signatures")
+                return None
+        runs1, runs2 = shorter.runs(), longer.runs()
+        counted = runs1.run_lengths.copy()
+        reference = np.ones(len(runs2.packed_runs), dtype=bool)
+        if ignore_blank:
+            blank_hash = shorter.hash_options.settings.packed_blank_hash
+            counted[blank_mask(runs1.packed_runs, blank_hash)] = 0
+            reference = ~blank_mask(runs2.packed_runs, blank_hash)
+        # No frame can be further than this from another, so it stands in for frames with nothing to compare to
+        no_distance = int(np.prod(shorter.hash_options.settings.hash_shape)) + 1
+        min_distances1 = np.full(len(runs1.packed_runs), no_distance, dtype=np.int64)
+        min_distances2 = np.full(len(runs2.packed_runs), no_distance, dtype=np.int64)
+        overlap_frames = 0
+        remaining = int(counted.sum())
+        rows: List[npt.NDArray[np.int64]] = [np.zeros(0, dtype=np.int64)]
+        columns: List[npt.NDArray[np.int64]] = [np.zeros(0, dtype=np.int64)]
+        if len(runs2.packed_runs):
+            for start, distances in distance_blocks(runs1.packed_runs, runs2.packed_runs):
+                block = slice(start, start + len(distances))
+                similar = distances <= hamming_dist
+                min_distances1[block] = distances.min(axis=1)
+                np.minimum(min_distances2, distances.min(axis=0), out=min_distances2)
+                block_rows, block_columns = np.nonzero(similar)
+                rows.append(block_rows + start)
+                columns.append(block_columns)
+                overlap_frames += int(counted[block][(similar & reference).any(axis=1)].sum())
+                remaining -= int(counted[block].sum())
+                if min_percentage is not None and _percentage(overlap_frames + remaining, frame_count) < min_percentage:
+                    logger.debug("Score ruled out after %s of %s runs", start + len(distances), len(runs1.packed_runs))
+                    return None
+        pairs1, pairs2 = np.concatenate(rows), np.concatenate(columns)
+        best_segment = None
+        if shorter.hash_options.fixed_rate:
+            # Scanned with hash1 as the rows unless hash2 has fewer frames, as DurationMatch does, so ties between
+            # equally long segments are settled the same
+            (runs_a, pairs_a), (runs_b, pairs_b) = (
+                ((runs2, pairs2), (runs1, pairs1)) if swapped else ((runs1, pairs1), (runs2, pairs2))
+            )
+            if len(runs_a) <= len(runs_b):
+                length, start1, start2 = longest_run_of_similar_runs(runs_a, runs_b, pairs_a, pairs_b, hamming_dist)
+            else:
+                length, start2, start1 = longest_run_of_similar_runs(runs_b, runs_a, pairs_b, pairs_a, hamming_dist)
+            if length:
+                best_segment = AlignedSegment(start1, start2, length, shorter.hash_options.fps)
+        frame_distances1 = np.repeat(min_distances1, runs1.run_lengths)
+        frame_distances2 = np.repeat(min_distances2, runs2.run_lengths)
+        if swapped:
+            frame_distances1, frame_distances2 = frame_distances2, frame_distances1
+        return MatchScore(
+            _percentage(overlap_frames, frame_count), overlap_frames, best_segment, frame_distances1, frame_distances2
+        )
+
+
+def rank_matches(
+    video_hash: VideoHash,
+    candidates: Union[Mapping[str, VideoHash], Iterable[Tuple[str, VideoHash]]],
+    top_k: int = 10,
+    hamming_dist: int = 3,
+    ignore_blank: bool = True,
+) -> List[Tuple[str, MatchScore]]:
+    """
+    Scores keyed candidate video hashes, such as a dict or VideoHashLibrary.items(), against a video hash, and returns
+    the keys and scores of the top_k best, ordered by MatchScore.rank_key, best first. Candidates with equal scores
+    keep the order they were given in. Once top_k candidates have been scored, each further candidate is only compared
+    for as long as it could still beat the worst of them.
+    """
+    items = candidates.items() if isinstance(candidates, Mapping) else candidates
+    best: List[Tuple[Tuple[float, int], int, str, MatchScore]] = []
+    for num, (key, candidate) in enumerate(items):
+        if top_k <= 0:
+            break
+        min_percentage = best[0][0][0] if len(best) == top_k else None
+        score = score_match(video_hash, candidate, hamming_dist, ignore_blank, min_percentage)
+        if score is None:
+            continue
+        # Earlier candidates win ties, so they rank higher with the same score
+        entry = (score.rank_key, -num, key, score)
+        if len(best) < top_k:
+            heapq.heappush(best, entry)
+        elif entry[:2] > best[0][:2]:
+            heapq.heapreplace(best, entry)
+    return [(key, score) for _, _, key, score in sorted(best, key=lambda entry: entry[:2], reverse=True)]
+
+
+def _percentage(frames: int, frame_count: int) -> float:
+    return 100 * frames / frame_count if frame_count else 0
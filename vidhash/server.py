@@ -0,0 +1,451 @@
+"""
+A long-running service which keeps a pool of hashing workers and sets of reference video hashes resident, so that
+short-lived worker processes can hash and match videos without each importing vidhash, starting their own pool, and
+rebuilding their reference hashes.
+
+VideoHashServer listens on a Unix socket, and VideoHashClient connects to it. Each request and response is one line
+of JSON. Requests are {"id": ..., "method": ..., "params": {...}}, and are answered, in any order, with
+{"id": ..., "result": ...} or {"id": ..., "error": {"type": ..., "message": ...}}. The methods are:
+- hash_video(video_path, hash_options=None), giving the video hash in its binary format, base64 encoded
+- check_match(video_path_1, video_path_2, match_options=None), giving whether the videos match
+- add_references(reference_set, video_paths), hashing videos given as {key: video_path} into a reference set
+- load_library(reference_set, library_path), adding the video hashes of a library file to a reference set
+- find_matches(video_path, reference_set, match_options=None), giving the keys of the matching references
+- reference_sets(), giving the number of video hashes in each reference set
+Options are given in the form of their to_dict() methods, and default to the server's options.
+
+Run a server with `python -m vidhash.server SOCKET_PATH`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Any, Dict
+
+from vidhash.cache import VideoHashCache
+from vidhash.decode_options import DecodeOptions
+from vidhash.func import hash_video
+from vidhash.hash_options import DEFAULT_HASH_OPTS, HashOptions
+from vidhash.index import VideoHashIndex
+from vidhash.library import VideoHashLibrary
+from vidhash.match_options import DEFAULT_MATCH_OPTS, MatchOptions
+from vidhash.video_hash import VideoHash
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from types import TracebackType
+    from typing import Awaitable, Callable, Iterable, List, Mapping, Optional, Set, Tuple, Type
+
+    from vidhash.func import PathLike
+
+# Longest line of JSON which can be sent either way, which needs to fit the base64 video hash of a long video
+STREAM_LIMIT = 2**26
+DEFAULT_MAX_PENDING = 64
+
+logger = logging.getLogger(__name__)
+
+
+class ServerError(Exception):
+    """
+    An error raised while the server handled a request, which the client raises in turn
+    """
+
+    def __init__(self, error_type: str, message: str) -> None:
+        super().__init__(f"{error_type}: {message}")
+        self.error_type = error_type
+        self.message = message
+
+
+class VideoHashServer:
+    """
+    Serves hashing and matching requests on a Unix socket, see the module documentation for the protocol.
+
+    Frames of all the videos being hashed are hashed on one shared executor, the given one or a process pool of
+    max_workers processes, which stays running between requests. At most max_videos videos are decoded at once,
+    defaulting to max_workers, and further requests wait for a free slot, bounding the number of FFmpeg processes.
+    Requests to hash a video which is already being hashed with the same options wait for that result rather than
+    hashing it again. Each connection may have up to max_pending requests running, after which the server stops
+    reading its requests until some finish, so that busy clients are held back rather than queueing unbounded work.
+
+    Reference sets are VideoHashIndex objects, which support match options with hamming distances up to
+    max_hamming_dist. Video hashes are read from and written to the cache, if one is given.
+
+    Matching, and loading libraries into reference sets, run in threads rather than on the event loop, so that other
+    requests keep being answered meanwhile. Each reference set has a lock, as an index isn't safe to use from several
+    threads at once.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        hash_options: Optional[HashOptions] = None,
+        decode_options: Optional[DecodeOptions] = None,
+        max_videos: Optional[int] = None,
+        max_workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        cache: Optional[VideoHashCache] = None,
+        max_hamming_dist: int = 3,
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ) -> None:
+        self.socket_path = socket_path
+        self.hash_options = hash_options or DEFAULT_HASH_OPTS
+        self.decode_options = decode_options
+        self.cache = cache
+        self.max_hamming_dist = max_hamming_dist
+        self.max_pending = max_pending
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._video_slots = asyncio.Semaphore(max_videos or self._max_workers)
+        self._executor = executor
+        self._own_executor = executor is None
+        self._reference_sets: Dict[str, VideoHashIndex] = {}
+        self._reference_locks: Dict[str, asyncio.Lock] = {}
+        self._libraries: List[VideoHashLibrary] = []
+        self._hashing: Dict[Tuple[str, HashOptions], asyncio.Task[VideoHash]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: Set[asyncio.Task[Any]] = set()
+        self._methods: Dict[str, Callable[..., Awaitable[Any]]] = {
+            "hash_video": self._hash_video_request,
+            "check_match": self._check_match_request,
+            "add_references": self._add_references_request,
+            "load_library": self._load_library_request,
+            "find_matches": self._find_matches_request,
+            "reference_sets": self._reference_sets_request,
+        }
+
+    async def start(self) -> None:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self._max_workers)
+        self._server = await asyncio.start_unix_server(self._handle_connection, self.socket_path, limit=STREAM_LIMIT)
+        logger.info("Serving on %s", self.socket_path)
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        assert self._server is not None
+        await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            for connection in self._connections:
+                connection.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        for task in self._hashing.values():
+            task.cancel()
+        await asyncio.gather(*self._hashing.values(), return_exceptions=True)
+        if self._own_executor and self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+        for library in self._libraries:
+            library.close()
+        self._libraries = []
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.socket_path)
+
+    async def __aenter__(self) -> VideoHashServer:
+        await self.start()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        await self.close()
+
+    async def hash_video(self, video_path: PathLike, hash_options: Optional[HashOptions] = None) -> VideoHash:
+        """
+        Hashes a video, sharing the result with any other request to hash the same video with the same options
+        """
+        options = hash_options or self.hash_options
+        key = (os.path.abspath(video_path), options)
+        task = self._hashing.get(key)
+        if task is None:
+            task = asyncio.create_task(self._hash_video(video_path, options))
+            self._hashing[key] = task
+            task.add_done_callback(lambda _: self._hashing.pop(key, None))
+        # Shielded, so one request being cancelled doesn't cancel the hashing for the others
+        return await asyncio.shield(task)
+
+    async def _hash_video(self, video_path: PathLike, hash_options: HashOptions) -> VideoHash:
+        hash_func = hash_video if self.cache is None else self.cache.hash_video
+        async with self._video_slots:
+            return await hash_func(video_path, hash_options, self.decode_options, self._executor)
+
+    def _reference_set(self, name: str) -> Tuple[VideoHashIndex, asyncio.Lock]:
+        index = self._reference_sets.get(name)
+        if index is None:
+            index = VideoHashIndex(self.hash_options, self.max_hamming_dist)
+            self._reference_sets[name] = index
+            self._reference_locks[name] = asyncio.Lock()
+        return index, self._reference_locks[name]
+
+    async def add_references(self, reference_set: str, video_paths: Mapping[str, PathLike]) -> int:
+        """
+        Hashes videos, given by key, and adds them to the named reference set, creating it if needed
+        """
+        video_hashes = await asyncio.gather(*[self.hash_video(video_path) for video_path in video_paths.values()])
+        index, lock = self._reference_set(reference_set)
+        async with lock:
+            await asyncio.to_thread(_insert_all, index, zip(video_paths, video_hashes))
+        return len(video_hashes)
+
+    async def load_library(self, reference_set: str, library_path: str) -> int:
+        """
+        Adds the video hashes of a library file to the named reference set, creating it if needed. The library is
+        kept open while the server runs, as its video hashes are views onto the file.
+        """
+        library = await asyncio.to_thread(VideoHashLibrary, library_path)
+        self._libraries.append(library)
+        index, lock = self._reference_set(reference_set)
+        async with lock:
+            await asyncio.to_thread(_insert_all, index, library.items())
+        return len(library)
+
+    async def find_matches(
+        self, video_path: PathLike, reference_set: str, match_options: Optional[MatchOptions] = None
+    ) -> List[str]:
+        if reference_set not in self._reference_sets:
+            raise KeyError(f"No reference set named {reference_set}")
+        video_hash = await self.hash_video(video_path)
+        index, lock = self._reference_set(reference_set)
+        async with lock:
+            return await asyncio.to_thread(index.find_matches, video_hash, match_options)
+
+    async def check_match(
+        self, video_path_1: PathLike, video_path_2: PathLike, match_options: Optional[MatchOptions] = None
+    ) -> bool:
+        hash1, hash2 = await asyncio.gather(self.hash_video(video_path_1), self.hash_video(video_path_2))
+        return await asyncio.to_thread((match_options or DEFAULT_MATCH_OPTS).check_match, hash1, hash2)
+
+    async def _hash_video_request(self, video_path: str, hash_options: Optional[Dict[str, Any]] = None) -> str:
+        options = HashOptions.from_dict(hash_options) if hash_options is not None else None
+        video_hash = await self.hash_video(video_path, options)
+        return base64.b64encode(video_hash.to_bytes()).decode()
+
+    async def _check_match_request(
+        self, video_path_1: str, video_path_2: str, match_options: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        options = MatchOptions.from_dict(match_options) if match_options is not None else None
+        return await self.check_match(video_path_1, video_path_2, options)
+
+    async def _add_references_request(self, reference_set: str, video_paths: Dict[str, str]) -> int:
+        return await self.add_references(reference_set, video_paths)
+
+    async def _load_library_request(self, reference_set: str, library_path: str) -> int:
+        return await self.load_library(reference_set, library_path)
+
+    async def _find_matches_request(
+        self, video_path: str, reference_set: str, match_options: Optional[Dict[str, Any]] = None
+    ) -> List[str]:
+        options = MatchOptions.from_dict(match_options) if match_options is not None else None
+        return await self.find_matches(video_path, reference_set, options)
+
+    async def _reference_sets_request(self) -> Dict[str, int]:
+        return {name: len(index) for name, index in self._reference_sets.items()}
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        pending = asyncio.Semaphore(self.max_pending)
+        tasks: Set[asyncio.Task[None]] = set()
+        connection = asyncio.current_task()
+        assert connection is not None
+        self._connections.add(connection)
+        try:
+            while True:
+                # Stop reading requests while too many are running, so the client is held back by the socket
+                await pending.acquire()
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self._respond(line, writer, pending))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError) as e:
+            logger.warning("Dropping connection: %s", e)
+        except asyncio.CancelledError:
+            # Cancelled by close(), which is a normal end to the connection rather than an error
+            for task in tasks:
+                task.cancel()
+        finally:
+            self._connections.discard(connection)
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _respond(self, line: bytes, writer: asyncio.StreamWriter, pending: asyncio.Semaphore) -> None:
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            method = self._methods.get(request.get("method"))
+            if method is None:
+                raise ValueError(f"Unknown method: {request.get('method')}")
+            response = {"id": request_id, "result": await method(**request.get("params", {}))}
+        except Exception as e:
+            logger.warning("Request %s failed: %s", request_id, e)
+            response = {"id": request_id, "error": {"type": e.__class__.__name__, "message": str(e)}}
+        try:
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        except ConnectionError:
+            logger.debug("Client went away before request %s finished", request_id)
+        finally:
+            pending.release()
+
+
+def _insert_all(index: VideoHashIndex, video_hashes: Iterable[Tuple[str, VideoHash]]) -> None:
+    for key, video_hash in video_hashes:
+        index.insert(key, video_hash)
+
+
+class VideoHashClient:
+    """
+    Connects to a VideoHashServer, giving the same results as hashing and matching videos locally. Many tasks can make
+    requests over one client at once. Video paths are made absolute before being sent, as the server may be running
+    in another directory.
+    """
+
+    def __init__(self, socket_path: str) -> None:
+        self.socket_path = socket_path
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task[None]] = None
+        self._responses: Dict[int, asyncio.Future[Any]] = {}
+        self._next_id = 0
+
+    async def connect(self) -> None:
+        reader, self._writer = await asyncio.open_unix_connection(self.socket_path, limit=STREAM_LIMIT)
+        self._read_task = asyncio.create_task(self._read_responses(reader))
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            with contextlib.suppress(ConnectionError):
+                await self._writer.wait_closed()
+            self._writer = None
+        if self._read_task is not None:
+            self._read_task.cancel()
+            await asyncio.gather(self._read_task, return_exceptions=True)
+            self._read_task = None
+
+    async def __aenter__(self) -> VideoHashClient:
+        await self.connect()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[TracebackType],
+    ) -> None:
+        await self.close()
+
+    async def _read_responses(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while line := await reader.readline():
+                response = json.loads(line)
+                future = self._responses.pop(response["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(ServerError(response["error"]["type"], response["error"]["message"]))
+                else:
+                    future.set_result(response["result"])
+        finally:
+            for future in self._responses.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection to the server was closed"))
+            self._responses.clear()
+
+    async def _call(self, method: str, **params: Any) -> Any:
+        if self._writer is None:
+            await self.connect()
+        assert self._writer is not None
+        request_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._responses[request_id] = future
+        self._writer.write(json.dumps({"id": request_id, "method": method, "params": params}).encode() + b"\n")
+        await self._writer.drain()
+        return await future
+
+    async def hash_video(self, video_path: PathLike, hash_options: Optional[HashOptions] = None) -> VideoHash:
+        options = hash_options.to_dict() if hash_options is not None else None
+        data = await self._call("hash_video", video_path=os.path.abspath(video_path), hash_options=options)
+        return VideoHash.from_bytes(base64.b64decode(data))
+
+    async def check_match(
+        self, video_path_1: PathLike, video_path_2: PathLike, match_options: Optional[MatchOptions] = None
+    ) -> bool:
+        return bool(
+            await self._call(
+                "check_match",
+                video_path_1=os.path.abspath(video_path_1),
+                video_path_2=os.path.abspath(video_path_2),
+                match_options=match_options.to_dict() if match_options is not None else None,
+            )
+        )
+
+    async def add_references(self, reference_set: str, video_paths: Mapping[str, PathLike]) -> int:
+        paths = {key: os.path.abspath(video_path) for key, video_path in video_paths.items()}
+        return int(await self._call("add_references", reference_set=reference_set, video_paths=paths))
+
+    async def load_library(self, reference_set: str, library_path: str) -> int:
+        return int(
+            await self._call("load_library", reference_set=reference_set, library_path=os.path.abspath(library_path))
+        )
+
+    async def find_matches(
+        self, video_path: PathLike, reference_set: str, match_options: Optional[MatchOptions] = None
+    ) -> List[str]:
+        return list(
+            await self._call(
+                "find_matches",
+                video_path=os.path.abspath(video_path),
+                reference_set=reference_set,
+                match_options=match_options.to_dict() if match_options is not None else None,
+            )
+        )
+
+    async def reference_sets(self) -> Dict[str, int]:
+        return dict(await self._call("reference_sets"))
+
+
+async def _serve(args: argparse.Namespace) -> None:
+    cache = VideoHashCache(args.cache_dir) if args.cache_dir else None
+    server = VideoHashServer(
+        args.socket_path,
+        decode_options=DecodeOptions(pipe_frames=args.pipe_frames),
+        max_videos=args.max_videos,
+        max_workers=args.max_workers,
+        cache=cache,
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve vidhash hashing and matching requests on a Unix socket")
+    parser.add_argument("socket_path", help="Path of the Unix socket to listen on")
+    parser.add_argument("--max-videos", type=int, help="Most videos to decode at once")
+    parser.add_argument("--max-workers", type=int, help="Processes to hash frames on")
+    parser.add_argument("--pipe-frames", action="store_true", help="Stream frames from FFmpeg in memory")
+    parser.add_argument("--cache-dir", help="Cache video hashes in this directory")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(_serve(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import base64
+from typing import TYPE_CHECKING, Any, Dict
+
+import numpy as np
+
+from vidhash.packed_hash import unique_hashes, unpack_bits
+
+if TYPE_CHECKING:
+    from typing import Tuple
+
+    import numpy.typing as npt
+
+# Frame hashes are split into this many chunks, so two frame hashes within a hamming distance of less than this must
+# have at least one chunk exactly equal
+SIGNATURE_CHUNKS = 4
+# Chunks are folded into keys of this many bits, so signatures stay small for large hashes
+KEY_BITS = 16
+SIGNATURE_VERSION = 2
+
+
+def chunk_keys(packed: npt.NDArray[np.uint64], hash_shape: Tuple[int, ...]) -> npt.NDArray[np.uint16]:
+    """
+    Splits packed hashes, shaped (N, words), into the keys of their signature chunks, shaped (chunks, N). Equal chunks
+    always have equal keys.
+    """
+    bit_count = int(np.prod(hash_shape))
+    bits = unpack_bits(packed, hash_shape).reshape(len(packed), bit_count)
+    chunks = np.array_split(np.arange(bit_count), min(bit_count, SIGNATURE_CHUNKS))
+    keys = np.zeros((len(chunks), len(packed)), dtype=np.uint16)
+    for chunk_num, chunk in enumerate(chunks):
+        weights = np.left_shift(np.uint64(1), np.arange(len(chunk) - 1, -1, -1, dtype=np.uint64))
+        values = (bits[:, chunk].astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64)
+        if len(chunk) > KEY_BITS:
+            # Fibonacci hashing, keeping the top bits of the product, which depend on every bit of the chunk
+            values = (values * np.uint64(0x9E3779B97F4A7C15)) >> np.uint64(64 - KEY_BITS)
+        keys[chunk_num] = values
+    return keys
+
+
+class VideoSignature:
+    """
+    A compact summary of a video hash, for ruling out matches without comparing any frames.
+
+    Each frame hash is split into SIGNATURE_CHUNKS chunks, and the signature holds the distinct keys of each chunk
+    among the video's frames. Two frame hashes within a hamming distance less than the number of chunks have at least
+    one chunk equal, so checking each frame of a video against another video's signature gives upper bounds on how
+    many frames could be similar to a frame of the other. Unrelated videos share few chunk keys, so their bounds are
+    usually far too low to match.
+    """
+
+    def __init__(self, frame_count: int, distinct_hash_count: int, keys: Tuple[npt.NDArray[np.uint16], ...]) -> None:
+        self.frame_count = frame_count
+        self.distinct_hash_count = distinct_hash_count
+        # The sorted distinct keys of each chunk
+        self.keys = keys
+
+    @classmethod
+    def from_packed(cls, packed: npt.NDArray[np.uint64], hash_shape: Tuple[int, ...]) -> VideoSignature:
+        """
+        Computes the signature of an array of packed frame hashes, shaped (N, words)
+        """
+        unique = unique_hashes(packed)
+        keys = tuple(np.unique(chunk) for chunk in chunk_keys(unique, hash_shape))
+        return cls(len(packed), len(unique), keys)
+
+    def __eq__(self, other: object) -> bool:
+        return (
+            isinstance(other, VideoSignature)
+            and (self.frame_count, self.distinct_hash_count) == (other.frame_count, other.distinct_hash_count)
+            and len(self.keys) == len(other.keys)
+            and all(np.array_equal(keys, other_keys) for keys, other_keys in zip(self.keys, other.keys))
+        )
+
+    def __repr__(self) -> str:
+        return f"VideoSignature(frame_count={self.frame_count}, distinct_hash_count={self.distinct_hash_count})"
+
+    def bounds_hamming_dist(self, hamming_dist: int) -> bool:
+        """
+        Whether the signature can rule out frames being within this hamming distance
+        """
+        return hamming_dist < len(self.keys)
+
+    def near_mask(self, keys: npt.NDArray[np.uint16]) -> npt.NDArray[np.bool_]:
+        """
+        Given the chunk keys of some frame hashes, shaped (chunks, N), returns which of them share a chunk key with a
+        frame of this video, which every frame hash within a bounded hamming distance of one of its frames does
+        """
+        if len(keys) != len(self.keys):
+            raise ValueError("Video signature is for frame hashes of a different size")
+        near = np.zeros(keys.shape[1], dtype=bool)
+        present = np.zeros(2**KEY_BITS, dtype=bool)
+        for frame_keys, own_keys in zip(keys, self.keys):
+            present[own_keys] = True
+            near |= present[frame_keys]
+            present[own_keys] = False
+        return near
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "version": SIGNATURE_VERSION,
+            "frame_count": self.frame_count,
+            "distinct_hash_count": self.distinct_hash_count,
+            "keys": [base64.b64encode(keys.astype("<u2").tobytes()).decode() for keys in self.keys],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> VideoSignature:
+        if data.get("version") != SIGNATURE_VERSION:
+            raise ValueError(f"Unsupported video signature version: {data.get('version')}")
+        keys = tuple(np.frombuffer(base64.b64decode(keys), dtype="<u2").astype(np.uint16) for keys in data["keys"])
+        return cls(data["frame_count"], data["distinct_hash_count"], keys)
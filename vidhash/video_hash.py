@@ -1,44 +1,312 @@
 from __future__ import annotations
 
 import dataclasses
+import functools
+import json
+import struct
 from typing import TYPE_CHECKING, Optional
 
+import numpy as np
+
+from vidhash.hash_options import HashOptions
 from vidhash.match_options import DEFAULT_MATCH_OPTS
+from vidhash.metadata import VideoMetadata
+from vidhash.packed_hash import PackedFrameHashes, RunLengthFrameHashes, blank_mask, hamming_distances, unique_hashes
+from vidhash.signature import SIGNATURE_VERSION, VideoSignature, chunk_keys
 
 if TYPE_CHECKING:
-    from typing import Iterator, List, Set
+    import mmap
+    from typing import Iterator, Sequence, Set, Tuple, Union
+
+    import numpy.typing as npt
 
     from vidhash.frame_hash import FrameHash
-    from vidhash.hash_options import HashOptions
     from vidhash.match_options import MatchOptions
 
+    Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+# Binary format: a fixed header, then the hash options as JSON, then the packed frame hashes as little-endian uint64s,
+# aligned to 8 bytes. The header holds the magic bytes, format version, flags marking which optional sections follow,
+# words per frame hash, length of the JSON, frame count and video length.
+# Optional sections follow the frame hashes, in the order of their flags. Each is a uint32 length, then that many
+# bytes, aligned to 8 bytes.
+HASH_FORMAT_MAGIC = b"VHSH"
+HASH_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sHHIIQd")
+_SECTION_HEADER = struct.Struct("<I")
+# Section holding the video metadata as JSON
+FLAG_METADATA = 1
+# Section holding the coarse frame hashes, as little-endian uint64s
+FLAG_COARSE_HASHES = 2
+# Section holding the video signature as JSON
+FLAG_SIGNATURE = 4
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // 8) * 8
+
+
+def _read_section(buffer: Buffer, offset: int) -> Tuple[bytes, int]:
+    if len(buffer) < offset + _SECTION_HEADER.size:
+        raise ValueError("Buffer is too short for the video hash it contains")
+    (length,) = _SECTION_HEADER.unpack_from(buffer, offset)
+    start = offset + _SECTION_HEADER.size
+    if len(buffer) < start + length:
+        raise ValueError("Buffer is too short for the video hash it contains")
+    return bytes(buffer[start : start + length]), _aligned(start + length)
+
+
+@functools.lru_cache(maxsize=32)
+def _options_from_json(options_json: bytes) -> HashOptions:
+    # Videos in a library will usually share hash options, so they only need parsing once
+    return HashOptions.from_dict(json.loads(options_json))
+
 
 @dataclasses.dataclass
 class VideoHash:
-    image_hashes: List[FrameHash]
+    image_hashes: Sequence[FrameHash]
     video_length: float
     hash_options: HashOptions
+    metadata: Optional[VideoMetadata] = dataclasses.field(default=None, compare=False)
+    # Lower resolution hashes of the same frames, if the hash settings compute them
+    coarse_hashes: Optional[PackedFrameHashes] = dataclasses.field(default=None, compare=False)
+    # Summary of the frame hashes, computed when hashing, for cheaply ruling out matches
+    signature: Optional[VideoSignature] = dataclasses.field(default=None, compare=False)
+
+    @property
+    def packed_hashes(self) -> PackedFrameHashes:
+        return PackedFrameHashes.from_frame_hashes(self.image_hashes, self.hash_options.settings.hash_shape)
+
+    def to_packed(self) -> VideoHash:
+        """
+        Returns this video hash with its frame hashes held in a single packed uint64 array
+        """
+        return dataclasses.replace(self, image_hashes=self.packed_hashes)
+
+    def to_unpacked(self) -> VideoHash:
+        """
+        Returns this video hash with its frame hashes held as a list of FrameHash objects
+        """
+        return dataclasses.replace(self, image_hashes=list(self.image_hashes))
+
+    def runs(self) -> RunLengthFrameHashes:
+        """
+        Returns this video hash's frame hashes as runs of identical consecutive hashes
+        """
+        return RunLengthFrameHashes.from_frame_hashes(self.image_hashes, self.hash_options.settings.hash_shape)
+
+    def to_run_length(self) -> VideoHash:
+        """
+        Returns this video hash with its frame hashes run-length encoded, which takes much less memory for videos with
+        long static shots
+        """
+        return dataclasses.replace(self, image_hashes=self.runs())
+
+    def coarse_video_hash(self) -> Optional[VideoHash]:
+        """
+        Returns a video hash of the coarse frame hashes, if there are any
+        """
+        coarse_options = self.hash_options.coarse_options
+        if self.coarse_hashes is None or coarse_options is None:
+            return None
+        return VideoHash(self.coarse_hashes, self.video_length, coarse_options, self.metadata)
+
+    def compute_signature(self) -> VideoSignature:
+        """
+        Computes the signature of this video hash's frame hashes
+        """
+        return VideoSignature.from_packed(self.packed_hashes.packed, self.hash_options.settings.hash_shape)
+
+    @functools.cached_property
+    def _computed_signature(self) -> VideoSignature:
+        return self.compute_signature()
+
+    def get_signature(self) -> VideoSignature:
+        """
+        Returns the stored signature of this video hash, or computes it if there isn't one, which is kept for next time
+        """
+        if self.signature is not None:
+            return self.signature
+        return self._computed_signature
+
+    def matching_bounds(self, other: VideoHash, hamming_dist: int) -> Optional[Tuple[Tuple[int, int], Tuple[int, int]]]:
+        """
+        Returns upper bounds on how many frames, and how many distinct frame hashes, of this video and of the other
+        video are within hamming distance of a frame in the other, in the form taken by MatchOptions._could_match(),
+        by checking each video's frames against the other's signature. Returns None if the hamming distance is too
+        high for signatures to rule out any frames.
+        """
+        signature, other_signature = self.get_signature(), other.get_signature()
+        if not (signature.bounds_hamming_dist(hamming_dist) and other_signature.bounds_hamming_dist(hamming_dist)):
+            return None
+        frames, hashes = self._near_counts(other_signature)
+        other_frames, other_hashes = other._near_counts(signature)
+        return (frames, other_frames), (hashes, other_hashes)
+
+    def _near_counts(self, signature: VideoSignature) -> Tuple[int, int]:
+        # How many frames, and distinct frame hashes, of this video share a chunk with the signature's video
+        runs = self.runs()
+        near = signature.near_mask(chunk_keys(runs.packed_runs, self.hash_options.settings.hash_shape))
+        return int(runs.run_lengths[near].sum()), len(unique_hashes(runs.packed_runs[near]))
+
+    @property
+    def next_frame_time(self) -> float:
+        """
+        Time in the video of the frame after this video hash's last frame, where hashing should carry on from for the
+        next part of the video. Frames sampled at a fixed rate are at multiples of 1/fps.
+        """
+        if self.hash_options.fixed_rate:
+            return len(self.image_hashes) / self.hash_options.fps
+        return self.video_length
+
+    def append(self, other: VideoHash) -> VideoHash:
+        """
+        Returns a video hash of this video followed by the other, which is the hash of the next part of the video,
+        starting from this video hash's next_frame_time, such as one from hash_video_range(). Frame hashes stay
+        run-length encoded if either video hash's are.
+        """
+        if other.hash_options != self.hash_options:
+            raise ValueError("Video hashes made with different hash options cannot be appended")
+        hash_shape = self.hash_options.settings.hash_shape
+        image_hashes: Sequence[FrameHash]
+        if isinstance(self.image_hashes, RunLengthFrameHashes) or isinstance(other.image_hashes, RunLengthFrameHashes):
+            image_hashes = RunLengthFrameHashes.concatenate([self.runs(), other.runs()], hash_shape)
+        else:
+            image_hashes = PackedFrameHashes(
+                np.concatenate([self.packed_hashes.packed, other.packed_hashes.packed]), hash_shape
+            )
+        coarse_hashes = None
+        if self.coarse_hashes is not None and other.coarse_hashes is not None:
+            coarse_hashes = PackedFrameHashes(
+                np.concatenate([self.coarse_hashes.packed, other.coarse_hashes.packed]), self.coarse_hashes.hash_shape
+            )
+        video_length = self.next_frame_time + other.video_length
+        metadata = self.metadata or other.metadata
+        if metadata is not None:
+            metadata = dataclasses.replace(metadata, duration=video_length)
+        video_hash = VideoHash(image_hashes, video_length, self.hash_options, metadata, coarse_hashes)
+        # Distinct frame hashes may be shared between the parts, so the signature can't be added up from theirs
+        video_hash.signature = video_hash.compute_signature()
+        return video_hash
+
+    def unique_packed_hashes(self, ignore_blank: bool = False) -> npt.NDArray[np.uint64]:
+        unique = unique_hashes(self.runs().packed_runs)
+        if ignore_blank:
+            unique = unique[~blank_mask(unique, self.hash_options.settings.packed_blank_hash)]
+        return unique
 
     @property
     def hash_set(self) -> Set[FrameHash]:
+        if isinstance(self.image_hashes, PackedFrameHashes):
+            return set(PackedFrameHashes(self.unique_packed_hashes(), self.image_hashes.hash_shape))
         return set(self.image_hashes)
 
     def matching_hashes(
         self, other_hash: FrameHash, hamming_dist: int = 0, ignore_blank: bool = False
     ) -> Iterator[FrameHash]:
-        hash_set = self.hash_set.copy()
-        if ignore_blank:
-            hash_set.discard(self.hash_options.settings.blank_hash)
-        for image_hash in hash_set:
-            if image_hash.similar_to(other_hash, hamming_dist):
-                yield image_hash
+        hash_shape = self.hash_options.settings.hash_shape
+        unique = self.unique_packed_hashes(ignore_blank)
+        distances = hamming_distances(unique, PackedFrameHashes.from_frame_hashes([other_hash], hash_shape).packed)[
+            :, 0
+        ]
+        yield from PackedFrameHashes(unique[distances <= hamming_dist], hash_shape)
 
     def contains_hash(self, other_hash: FrameHash, hamming_dist: int = 0, ignore_blank: bool = False) -> bool:
-        return any(self.matching_hashes(other_hash, hamming_dist, ignore_blank))
+        hash_shape = self.hash_options.settings.hash_shape
+        distances = hamming_distances(
+            self.unique_packed_hashes(ignore_blank),
+            PackedFrameHashes.from_frame_hashes([other_hash], hash_shape).packed,
+        )
+        return bool((distances <= hamming_dist).any())
 
     def matches_hash(self, other_hash: VideoHash, match_options: Optional[MatchOptions] = None) -> bool:
         match_options = match_options or DEFAULT_MATCH_OPTS
         return match_options.check_match(self, other_hash)
 
     def has_blank_frame(self) -> bool:
-        return self.hash_options.settings.blank_hash in self.hash_set
+        return bool(blank_mask(self.packed_hashes.packed, self.hash_options.settings.packed_blank_hash).any())
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialises this video hash into vidhash's compact binary format
+        """
+        packed = self.packed_hashes.packed
+        options_json = json.dumps(self.hash_options.to_dict(), sort_keys=True).encode()
+        flags = 0
+        sections = []
+        if self.metadata is not None:
+            flags |= FLAG_METADATA
+            sections.append(json.dumps(self.metadata.to_dict(), sort_keys=True).encode())
+        if self.coarse_hashes is not None:
+            flags |= FLAG_COARSE_HASHES
+            sections.append(self.coarse_hashes.packed.astype("<u8").tobytes())
+        if self.signature is not None:
+            flags |= FLAG_SIGNATURE
+            sections.append(json.dumps(self.signature.to_dict(), sort_keys=True).encode())
+        header = _HEADER.pack(
+            HASH_FORMAT_MAGIC,
+            HASH_FORMAT_VERSION,
+            flags,
+            packed.shape[1],
+            len(options_json),
+            len(packed),
+            self.video_length,
+        )
+        body_offset = _aligned(len(header) + len(options_json))
+        padding = b"\0" * (body_offset - len(header) - len(options_json))
+        data = [header, options_json, padding, packed.astype("<u8").tobytes()]
+        for section in sections:
+            data += [_SECTION_HEADER.pack(len(section)), section, b"\0" * (-(_SECTION_HEADER.size + len(section)) % 8)]
+        return b"".join(data)
+
+    @classmethod
+    def from_bytes(cls, data: Buffer) -> VideoHash:
+        video_hash, _ = cls.from_buffer(data)
+        return video_hash
+
+    @classmethod
+    def from_buffer(cls, buffer: Buffer, offset: int = 0) -> Tuple[VideoHash, int]:
+        """
+        Reads a video hash from its binary format at the given offset into a buffer, returning it along with the
+        offset where it ends. The packed frame hashes are a view onto the buffer rather than a copy, so this is cheap
+        to use on a memory mapped file.
+        """
+        if len(buffer) < offset + _HEADER.size:
+            raise ValueError("Buffer is too short to contain a video hash")
+        magic, version, flags, words, options_length, frame_count, video_length = _HEADER.unpack_from(buffer, offset)
+        if magic != HASH_FORMAT_MAGIC:
+            raise ValueError("Buffer does not contain a video hash")
+        if version != HASH_FORMAT_VERSION:
+            raise ValueError(f"Unsupported video hash format version: {version}")
+        options_start = offset + _HEADER.size
+        hash_options = _options_from_json(bytes(buffer[options_start : options_start + options_length]))
+        body_start = _aligned(options_start + options_length)
+        body_end = body_start + frame_count * words * 8
+        if len(buffer) < body_end:
+            raise ValueError("Buffer is too short for the video hash it contains")
+        packed = np.frombuffer(buffer, dtype="<u8", count=frame_count * words, offset=body_start)
+        frame_hashes = PackedFrameHashes(packed.reshape(frame_count, words), hash_options.settings.hash_shape)
+        end = body_end
+        metadata = None
+        if flags & FLAG_METADATA:
+            section, end = _read_section(buffer, end)
+            metadata = VideoMetadata.from_dict(json.loads(section))
+        coarse_hashes = None
+        if flags & FLAG_COARSE_HASHES:
+            section, end = _read_section(buffer, end)
+            coarse_options = hash_options.coarse_options
+            if coarse_options is None:
+                raise ValueError("Video hash has coarse hashes, but its hash settings do not")
+            coarse_packed = np.frombuffer(section, dtype="<u8")
+            coarse_words = len(coarse_packed) // max(frame_count, 1)
+            coarse_hashes = PackedFrameHashes(
+                coarse_packed.reshape(frame_count, coarse_words), coarse_options.settings.hash_shape
+            )
+        signature = None
+        if flags & FLAG_SIGNATURE:
+            section, end = _read_section(buffer, end)
+            signature_data = json.loads(section)
+            # Signatures of an older kind are left out, and computed again when needed
+            if signature_data.get("version") == SIGNATURE_VERSION:
+                signature = VideoSignature.from_dict(signature_data)
+        return cls(frame_hashes, video_length, hash_options, metadata, coarse_hashes, signature), end